@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+# Producer for the ard-workflows work queues.  Enqueues only the jobs whose prepared output
+# is not already in S3, e.g.
+#
+#   python producer.py jobS2 jobs.jsonl
+#
+# where jobs.jsonl has one JSON object of prepare function keyword arguments per line,
+# as pushed by hand with `rpush jobS2 '{"in_scene": ..., "s3_dir": ...}'`.
+#
+# Each output prefix (s3_bucket + s3_dir) is listed once, so checking thousands of scenes
+# costs a handful of paginated ListObjects calls, plus a GET of each datacube-metadata.yaml
+# found to check its bands were all uploaded, as jobs check before they start.
+
+import argparse
+import collections
+import concurrent.futures
+import importlib
+import inspect
+import json
+import logging
+import os
+
+import rediswq
+from worker import QUEUE_JOBS
+
+# Work queue name -> "module:function" giving the output scene directory of a job, from
+# the job's keyword arguments.
+QUEUE_SCENE_NAMES = {
+    "jobS2": "utils.prepS2:s2_scene_name",
+    "jobS1": "utils.prep_utils:s1_scene_name",
+    "jobS1AM": "utils.prep_utils:s1_scene_name",
+    "jobLS": "utils.prepLS:ls_scene_name",
+    "jobMOD": "utils.prepMOD:mod_scene_name",
+    "jobWater": "utils.genprepWater:wofs_scene_name",
+    "jobMLWater": "utils.genprepMLWater:mlwater_scene_name",
+}
+
+# Work queue name -> "module:function" giving the band names a job's output must have, from
+# the job's keyword arguments, for queues whose jobs can prepare a scene with fewer bands.
+QUEUE_SCENE_BANDS = {
+    "jobS2": "utils.prepS2:s2_prod_band_names",
+}
+
+# Work queue name -> "module:function" run with the in_scene of every newly enqueued job (and the
+# queue's redis connection), to fill caches the jobs would otherwise fill one scene at a time.
+QUEUE_PRELOADS = {
+    "jobS1": "utils.prepS1:cache_s1_asf_urls",
+    "jobS1AM": "utils.prepS1:cache_s1_asf_urls",
+}
+
+logger = logging.getLogger("producer")
+
+
+def _import(target):
+    """Import a "module:function"."""
+    module_name, function_name = target.split(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def _call(function, kwargs):
+    """Call `function` with only the keyword arguments (of a job) it accepts."""
+    params = inspect.signature(function).parameters
+    return function(**{k: v for k, v in kwargs.items() if k in params})
+
+
+def list_scene_bands(s3_bucket, s3_dir, max_workers=16):
+    """
+    List an output prefix once and find the bands of every scene directory within it.
+
+    :param s3_bucket: bucket of the prepared products
+    :param s3_dir: directory of prepared scenes, one sub-directory per scene
+    :param max_workers: datacube-metadata.yaml files read at once
+    :return: dict of scene name -> set of its band names if it is complete (its datacube-metadata.yaml
+        and every band it lists were uploaded, as checked by prep_utils.s3_scene_complete), else None
+    """
+    from utils.prep_utils import s3_create_client, s3_list_objects_paths, s3_scene_uploaded_bands
+
+    scene_keys = collections.defaultdict(set)
+    for key in s3_list_objects_paths(s3_bucket, s3_dir):
+        parts = key[len(s3_dir):].lstrip('/').split('/')
+        if len(parts) >= 2:
+            scene_keys[parts[0]].add(key)
+
+    client, bucket = s3_create_client(s3_bucket)
+
+    def bands(scene):
+        return s3_scene_uploaded_bands(client, s3_bucket, os.path.join(s3_dir, scene, ''), scene_keys[scene])
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(scene_keys, executor.map(bands, scene_keys)))
+
+
+def enqueue_missing(queue, jobs, force=False, priority=None, deadline=None):
+    """
+    Enqueue the jobs whose output is missing or incomplete in S3 (including lacking bands the job
+    prepares), and not already queued.
+
+    :param queue: RedisWQ to add the jobs to - its name selects the prepare function
+    :param jobs: list of dicts of prepare function keyword arguments
+    :param force: enqueue jobs even if their output is complete
+    :param priority: optional priority (see RedisWQ.put), otherwise jobs are pushed as plain items
+    :param deadline: optional deadline (see RedisWQ.put)
+    :return: Counter of jobs by status: 'missing' and 'incomplete' (enqueued), 'complete' and 'queued' (skipped)
+
+    Caches for the enqueued jobs are then filled by the queue's QUEUE_PRELOADS function, if any.
+    """
+    prepare = _import(QUEUE_JOBS[queue.name()])
+    scene_name = _import(QUEUE_SCENE_NAMES[queue.name()])
+    scene_bands = _import(QUEUE_SCENE_BANDS[queue.name()]) if queue.name() in QUEUE_SCENE_BANDS else None
+    defaults = {k: p.default for k, p in inspect.signature(prepare).parameters.items()
+                if p.default is not inspect.Parameter.empty}
+
+    queued = queue.queued_items()
+    listings = {}
+    counts = collections.Counter()
+    enqueued = []
+    for job in jobs:
+        kwargs = dict(defaults, **job)
+        prefix = (kwargs['s3_bucket'], kwargs['s3_dir'])
+        if prefix not in listings:
+            listings[prefix] = list_scene_bands(*prefix)
+        name = _call(scene_name, kwargs)
+        if name not in listings[prefix]:
+            status = 'missing'
+        else:
+            uploaded = listings[prefix][name]
+            required = _call(scene_bands, kwargs) if scene_bands else set()
+            status = 'complete' if uploaded is not None and set(required) <= uploaded else 'incomplete'
+
+        item = json.dumps(job)
+        if item.encode() in queued:
+            status = 'queued'
+        elif status != 'complete' or force:
+            if priority is None and deadline is None:
+                queue.push(item)
+            else:
+                queue.put(item, priority=priority or 0, deadline=deadline)
+            queued.add(item.encode())
+            enqueued.append(kwargs)
+        counts[status] += 1
+
+    if enqueued and queue.name() in QUEUE_PRELOADS:
+        try:
+            _import(QUEUE_PRELOADS[queue.name()])([job['in_scene'] for job in enqueued], db=queue.db())
+        except Exception:
+            logger.exception(f"{queue.name()}: preloading caches failed, jobs will fill them")
+
+    logger.info(f"{queue.name()}: " + ", ".join(f"{n} {status}" for status, n in sorted(counts.items())))
+    return counts
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Enqueue jobs whose prepared output is not already in S3.")
+    parser.add_argument("queue", help=f"work queue name, one of {', '.join(QUEUE_JOBS)}")
+    parser.add_argument("jobs", help="file of jobs, one JSON object of prepare function arguments per line")
+    parser.add_argument("--force", action="store_true", help="enqueue jobs even if their output is complete")
+    parser.add_argument("--priority", type=int, help="priority of the jobs (see RedisWQ.put)")
+    parser.add_argument("--host", default=os.getenv("REDIS_SERVICE_HOST", "redis-master"))
+    parser.add_argument("--port", type=int, default=6379)
+    cli_args = parser.parse_args(args)
+
+    logging.basicConfig(format="%(asctime)s %(levelname)-8s %(name)s %(message)s", level=logging.INFO)
+    with open(cli_args.jobs) as f:
+        jobs = [json.loads(line) for line in f if line.strip()]
+    queue = rediswq.RedisWQ(name=cli_args.queue, host=cli_args.host, port=cli_args.port)
+    counts = enqueue_missing(queue, jobs, force=cli_args.force, priority=cli_args.priority)
+    print(json.dumps(counts))
+
+
+if __name__ == "__main__":
+    main()
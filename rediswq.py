@@ -5,9 +5,157 @@
 # http://redis.io/commands/rpoplpush, which suggests how to implement a work-queue.
 
  
+import argparse
+import contextlib
+import datetime
+import random
+import logging
+import threading
+import time
 import redis
 import uuid
-import hashlib
+
+# Claim an item that lease() has just moved onto the processing list: take it off the
+# list and record its lease deadline and owner, and its schedule if it has none yet.
+# KEYS: processing queue, leases zset, lease owners hash, scores hash
+# ARGV: item, deadline, session id, now
+_CLAIM_LUA = """
+-- brpoplpush pushes onto the head of the processing list, so this is found straight away
+redis.call('LREM', KEYS[1], 1, ARGV[1])
+redis.call('ZADD', KEYS[2], ARGV[2], ARGV[1])
+redis.call('HSET', KEYS[3], ARGV[1], ARGV[3])
+redis.call('HSETNX', KEYS[4], ARGV[1], ARGV[4])
+return 1
+"""
+
+# Atomically move items whose lease deadline has passed back to the (consuming) end of
+# the main queue.  Items left on the processing list were never claimed (the worker
+# crashed inside lease()); they are reclaimed once seen there for the grace period,
+# tracked in a hash of item -> first seen time.
+# KEYS: main queue, processing queue, leases zset, lease owners hash, unclaimed hash, reclaimed counter
+# ARGV: now, grace seconds
+_RECLAIM_LUA = """
+local now = tonumber(ARGV[1])
+local grace = tonumber(ARGV[2])
+local reclaimed = 0
+for _, item in ipairs(redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', now)) do
+    redis.call('ZREM', KEYS[3], item)
+    redis.call('HDEL', KEYS[4], item)
+    redis.call('RPUSH', KEYS[1], item)
+    reclaimed = reclaimed + 1
+end
+-- The processing list only holds items between brpoplpush and claim, so is short.
+local seen = {}
+for _, item in ipairs(redis.call('LRANGE', KEYS[2], 0, -1)) do
+    seen[item] = true
+    local since = tonumber(redis.call('HGET', KEYS[5], item))
+    if not since then
+        redis.call('HSET', KEYS[5], item, now)
+    elseif now - since >= grace then
+        redis.call('LREM', KEYS[2], 1, item)
+        redis.call('RPUSH', KEYS[1], item)
+        redis.call('HDEL', KEYS[5], item)
+        reclaimed = reclaimed + 1
+    end
+end
+-- forget items that were claimed since they were first seen
+for _, item in ipairs(redis.call('HKEYS', KEYS[5])) do
+    if not seen[item] then
+        redis.call('HDEL', KEYS[5], item)
+    end
+end
+if reclaimed > 0 then
+    redis.call('INCRBY', KEYS[6], reclaimed)
+end
+return reclaimed
+"""
+
+# Lease up to n items in one round trip, recording their lease deadline and owner.
+# Items pushed onto the main list by plain producers are first moved into the pending
+# set - at their original schedule if they were leased or put() before and since
+# released or reclaimed, or else as default priority items enqueued now, which is then
+# recorded as their schedule.  Items due within the deadline lead time
+# are leased first, earliest deadline first, then pending items in score order.
+# Failed items waiting out their retry backoff in the delayed set are moved back into
+# pending once ready.
+# KEYS: main queue, pending zset, deadlines zset, leases zset, lease owners hash,
+#       scores hash, deadlines hash, delayed zset
+# ARGV: n, now, lease deadline, session id, deadline lead seconds, max items to move
+_LEASE_LUA = """
+local now = tonumber(ARGV[2])
+local ready = redis.call('ZRANGEBYSCORE', KEYS[8], '-inf', now, 'LIMIT', 0, tonumber(ARGV[6]))
+for i, item in ipairs(ready) do
+    redis.call('ZREM', KEYS[8], item)
+    redis.call('LPUSH', KEYS[1], item)
+end
+for i = 1, tonumber(ARGV[6]) do
+    local item = redis.call('RPOP', KEYS[1])
+    if not item then
+        break
+    end
+    local score = redis.call('HGET', KEYS[6], item)
+    if not score then
+        -- keep plain items in FIFO order
+        score = now + i * 0.001
+        redis.call('HSET', KEYS[6], item, score)
+    end
+    redis.call('ZADD', KEYS[2], score, item)
+    local due = redis.call('HGET', KEYS[7], item)
+    if due then
+        redis.call('ZADD', KEYS[3], due, item)
+    end
+end
+local items = {}
+for i = 1, tonumber(ARGV[1]) do
+    local item = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', now + tonumber(ARGV[5]), 'LIMIT', 0, 1)[1]
+    if not item then
+        item = redis.call('ZRANGE', KEYS[2], 0, 0)[1]
+    end
+    if not item then
+        break
+    end
+    redis.call('ZREM', KEYS[2], item)
+    redis.call('ZREM', KEYS[3], item)
+    redis.call('ZADD', KEYS[4], ARGV[3], item)
+    redis.call('HSET', KEYS[5], item, ARGV[4])
+    items[#items + 1] = item
+end
+return items
+"""
+
+# Give up the lease on a failed item and record the attempt.  It is retried after an
+# exponential backoff (via the delayed set) or, after max attempts, moved onto the
+# dead-letter list with its last error.
+# KEYS: leases zset, lease owners hash, attempts hash, delayed zset, dead-letter list,
+#       errors hash, scores hash, deadlines hash
+# ARGV: item, now, max attempts, backoff seconds, jitter factor, error
+_FAIL_LUA = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+local attempts = redis.call('HINCRBY', KEYS[3], ARGV[1], 1)
+redis.call('HSET', KEYS[6], ARGV[1], ARGV[6])
+if attempts >= tonumber(ARGV[3]) then
+    redis.call('LPUSH', KEYS[5], ARGV[1])
+    redis.call('HDEL', KEYS[7], ARGV[1])
+    redis.call('HDEL', KEYS[8], ARGV[1])
+    return {attempts, 1}
+end
+local delay = tonumber(ARGV[4]) * 2 ^ (attempts - 1) * tonumber(ARGV[5])
+redis.call('ZADD', KEYS[4], tonumber(ARGV[2]) + delay, ARGV[1])
+return {attempts, 0}
+"""
+
+# Extend a lease only if it is still held by this session, so a lease that already
+# expired (and may have been picked up by another worker) is never resurrected.
+# KEYS: leases zset, lease owners hash
+# ARGV: item, session id, new deadline
+_RENEW_LUA = """
+if redis.call('HGET', KEYS[2], ARGV[1]) == ARGV[2] then
+    redis.call('ZADD', KEYS[1], 'XX', ARGV[3], ARGV[1])
+    return 1
+end
+return 0
+"""
 
 class RedisWQ(object):
     """Simple Finite Work Queue with Redis Backend
@@ -19,34 +167,108 @@ class RedisWQ(object):
     The items in the work queue are assumed to have unique values.
 
     This object is not intended to be used by multiple threads
-    concurrently.
+    concurrently, other than the lease renewal thread started by leased().
     """
-    def __init__(self, name, **redis_kwargs):
+    def __init__(self, name, prefetch=1, aging_secs=3600, deadline_lead_secs=3600, poll_secs=5,
+                 max_attempts=3, backoff_secs=60, **redis_kwargs):
        """The default connection parameters are: host='localhost', port=6379, db=0
 
        The work queue is identified by "name".  The library may create other
        keys with "name" as a prefix. 
+
+       "prefetch" is the default number of items leased at once by lease_many.
+
+       Items are leased in order of priority (see put), where each priority level is
+       worth "aging_secs" of waiting, so low priority items are not starved.  Items
+       with a deadline are leased ahead of everything else from "deadline_lead_secs"
+       before it.  Blocking leases check for put() items every "poll_secs".
+
+       Failed items (see fail) are retried up to "max_attempts" times, after an
+       exponential backoff starting at "backoff_secs", before being dead-lettered.
        """
        self._db = redis.StrictRedis(**redis_kwargs)
        # The session ID will uniquely identify this "worker".
        self._session = str(uuid.uuid4())
-       # Work queue is implemented as two queues: main, and processing.
-       # Work is initially in main, and moved to processing when a client picks it up.
+       # Producers push work onto main, or put() it into pending, a sorted set of item
+       # -> score (enqueue time less priority), and deadlines, a sorted set of item
+       # -> deadline.  The schedule of every item is kept in the scores and due hashes
+       # from when it is put() or first leased until completion, so released and
+       # reclaimed items keep their place.  Workers move plain
+       # items from main into pending as they lease.
+       # A worker picking up an item claims it into leases, a sorted set of item ->
+       # lease deadline, with the owning session in lease_owners.  When blocking, items
+       # are moved from main onto processing first and claimed straight after.
+       # Completing, renewing and expiring leases are then O(log N).
+       # Failed items wait in delayed, a sorted set of item -> retry time, until they
+       # are moved back into main.  Attempts and the last error of each item are kept
+       # until completion, and items that fail too often are moved onto dead.
        self._main_q_key = name
+       self._pending_key = name + ":pending"
+       self._deadlines_key = name + ":deadlines"
+       self._scores_key = name + ":scores"
+       self._due_key = name + ":due"
        self._processing_q_key = name + ":processing"
-       self._lease_key_prefix = name + ":leased_by_session:"
+       self._delayed_key = name + ":delayed"
+       self._attempts_key = name + ":attempts"
+       self._errors_key = name + ":errors"
+       self._dead_q_key = name + ":dead"
+       # Statistics about the work, e.g. resources used, shared by all workers.
+       self._stats_key = name + ":stats"
+       self._leases_key = name + ":leases"
+       self._lease_owners_key = name + ":lease_owners"
+       # Bookkeeping for reclaiming expired leases.
+       self._unclaimed_key = name + ":unclaimed_since"
+       self._reclaimed_key = name + ":reclaimed"
+       self._prefetch = prefetch
+       self._aging_secs = aging_secs
+       self._deadline_lead_secs = deadline_lead_secs
+       self._poll_secs = poll_secs
+       self._max_attempts = max_attempts
+       self._backoff_secs = backoff_secs
+       self._claim_script = self._db.register_script(_CLAIM_LUA)
+       self._lease_script = self._db.register_script(_LEASE_LUA)
+       self._reclaim_script = self._db.register_script(_RECLAIM_LUA)
+       self._renew_script = self._db.register_script(_RENEW_LUA)
+       self._fail_script = self._db.register_script(_FAIL_LUA)
+
+    def name(self):
+        """Return the name of the work queue."""
+        return self._main_q_key
+
+    def db(self):
+        """Return the redis connection of the work queue."""
+        return self._db
 
     def sessionID(self):
         """Return the ID for this session."""
         return self._session
 
     def _main_qsize(self):
-        """Return the size of the main queue."""
-        return self._db.llen(self._main_q_key)
+        """Return the number of items waiting to be worked on."""
+        return (self._db.llen(self._main_q_key) + self._db.zcard(self._pending_key) +
+                self._db.zcard(self._delayed_key))
 
     def _processing_qsize(self):
-        """Return the size of the main queue."""
-        return self._db.llen(self._processing_q_key)
+        """Return the number of items being worked on."""
+        return self._db.llen(self._processing_q_key) + self._db.zcard(self._leases_key)
+
+    def queued_items(self):
+        """Return the set of all items waiting, being retried or being worked on."""
+        pipe = self._db.pipeline()
+        pipe.lrange(self._main_q_key, 0, -1)
+        pipe.zrange(self._pending_key, 0, -1)
+        pipe.zrange(self._delayed_key, 0, -1)
+        pipe.lrange(self._processing_q_key, 0, -1)
+        pipe.zrange(self._leases_key, 0, -1)
+        return set().union(*pipe.execute())
+
+    def get_stats(self):
+        """Return the statistics recorded for the queue's work (see update_stats), as floats."""
+        return {k.decode(): float(v) for k, v in self._db.hgetall(self._stats_key).items()}
+
+    def update_stats(self, mapping):
+        """Record statistics (a dict of name to number) about the queue's work, shared by all workers."""
+        self._db.hset(self._stats_key, mapping=mapping)
 
     def empty(self):
         """Return True if the queue is empty, including work being done, False otherwise.
@@ -55,30 +277,56 @@ class RedisWQ(object):
         """
         return self._main_qsize() == 0 and self._processing_qsize() == 0
 
-# TODO: implement this
-#    def check_expired_leases(self):
-#        """Return to the work queueReturn True if the queue is empty, False otherwise."""
-#        # Processing list should not be _too_ long since it is approximately as long
-#        # as the number of active and recently active workers.
-#        processing = self._db.lrange(self._processing_q_key, 0, -1)
-#        for item in processing:
-#          # If the lease key is not present for an item (it expired or was 
-#          # never created because the client crashed before creating it)
-#          # then move the item back to the main queue so others can work on it.
-#          if not self._lease_exists(item):
-#            TODO: transactionally move the key from processing queue to
-#            to main queue, while detecting if a new lease is created
-#            or if either queue is modified.
-
-    def _itemkey(self, item):
-        """Returns a string that uniquely identifies an item (bytes)."""
-        return hashlib.sha224(item).hexdigest()
-
-    def _lease_exists(self, item):
-        """True if a lease on 'item' exists."""
-        return self._db.exists(self._lease_key_prefix + self._itemkey(item))
-
-    def lease(self, lease_secs=60, block=True, timeout=None):
+    def check_expired_leases(self, grace_secs=60):
+        """Return items whose lease has expired to the main queue.
+
+        Items are also returned if they were never leased because the worker crashed
+        inside lease().  To avoid racing a worker that is still claiming an item, these
+        are only reclaimed once seen unclaimed for at least grace_secs.
+
+        Returns the number of items reclaimed by this call.
+        """
+        return int(self._reclaim_script(
+            keys=[self._main_q_key, self._processing_q_key, self._leases_key, self._lease_owners_key,
+                  self._unclaimed_key, self._reclaimed_key],
+            args=[time.time(), grace_secs]))
+
+    def reclaimed_count(self):
+        """Return the total number of items reclaimed from expired leases, by any session."""
+        return int(self._db.get(self._reclaimed_key) or 0)
+
+    def push(self, item):
+        """Add an item to the work queue with default priority, as producers pushing onto the list "name" do."""
+        self._db.lpush(self._main_q_key, item)
+
+    def put(self, item, priority=0, deadline=None):
+        """Add an item to the work queue.
+
+        Items with a higher priority are leased first, but every aging_secs an item waits
+        counts as one level of priority.  If a deadline (a datetime or epoch seconds) is
+        given, the item is leased ahead of all others from deadline_lead_secs before it.
+        Items pushed straight onto the list named "name" have priority 0.
+        """
+        if isinstance(deadline, datetime.datetime):
+            deadline = deadline.timestamp()
+        score = time.time() - priority * self._aging_secs
+        pipe = self._db.pipeline()
+        pipe.hset(self._scores_key, item, score)
+        pipe.zadd(self._pending_key, {item: score})
+        if deadline is not None:
+            pipe.hset(self._due_key, item, deadline)
+            pipe.zadd(self._deadlines_key, {item: deadline})
+        pipe.execute()
+
+    def _lease_next(self, n, lease_secs):
+        """Atomically lease up to n of the highest priority items, without blocking."""
+        now = time.time()
+        return self._lease_script(
+            keys=[self._main_q_key, self._pending_key, self._deadlines_key, self._leases_key,
+                  self._lease_owners_key, self._scores_key, self._due_key, self._delayed_key],
+            args=[n, now, now + lease_secs, self._session, self._deadline_lead_secs, 100])
+
+    def lease(self, lease_secs=60, block=True, timeout=None, reap_expired=True):
         """Begin working on an item the work queue. 
 
         Lease the item for lease_secs.  After that time, other
@@ -86,20 +334,103 @@ class RedisWQ(object):
         and pick up the item instead.
 
         If optional args block is true and timeout is None (the default), block
-        if necessary until an item is available."""
-        if block:
-            item = self._db.brpoplpush(self._main_q_key, self._processing_q_key, timeout=timeout)
-        else:
-            item = self._db.rpoplpush(self._main_q_key, self._processing_q_key)
-        if item:
-            # Record that we (this session id) are working on a key.  Expire that
-            # note after the lease timeout.
-            # Note: if we crash at this line of the program, then GC will see no lease
-            # for this item a later return it to the main queue.
-            itemkey = self._itemkey(item)
-            self._db.setex(self._lease_key_prefix + itemkey, lease_secs, self._session)
+        if necessary until an item is available.
+
+        If reap_expired is true and no item was available, items with expired leases
+        are returned to the main queue (see check_expired_leases)."""
+        items = self._lease_next(1, lease_secs)
+        item = items[0] if items else None
+        end = None if timeout is None else time.time() + timeout
+        while item is None and block:
+            wait = self._poll_secs if end is None else min(self._poll_secs, end - time.time())
+            if wait <= 0:
+                break
+            # Wake straight away for items pushed onto main, and check pending every poll.
+            item = self._db.brpoplpush(self._main_q_key, self._processing_q_key, timeout=max(1, int(wait)))
+            if item:
+                # Record that we (this session id) are working on the item until the deadline.
+                # Note: if we crash at this line of the program, then GC will see the item is
+                # unclaimed and later return it to the main queue.
+                now = time.time()
+                self._claim_script(keys=[self._processing_q_key, self._leases_key, self._lease_owners_key,
+                                         self._scores_key],
+                                   args=[item, now + lease_secs, self._session, now])
+            else:
+                items = self._lease_next(1, lease_secs)
+                item = items[0] if items else None
+        if item is None and reap_expired:
+            # Nothing to do right now - make sure that isn't because of crashed workers.
+            self.check_expired_leases()
         return item
 
+    def lease_many(self, n=None, lease_secs=60, block=True, timeout=None):
+        """Begin working on up to n items (default: the prefetch depth) from the work queue.
+
+        All items are leased atomically in a single round trip, for lease_secs.  If none
+        are available and block is true, wait (up to timeout) for the first one as lease()
+        does, then lease the rest of the batch from whatever else is available.
+
+        Returns a list of items, which is empty if none were available.
+        """
+        n = n or self._prefetch
+        items = self._lease_next(n, lease_secs)
+        if items or not block:
+            return items
+        item = self.lease(lease_secs=lease_secs, block=True, timeout=timeout)
+        if item is None:
+            return []
+        return [item] + (self._lease_next(n - 1, lease_secs) if n > 1 else [])
+
+    def renew_lease(self, item, lease_secs=60):
+        """Extend the lease on 'item' to lease_secs from now.
+
+        Returns False if this session no longer holds the lease (it expired, or
+        the item was completed), in which case nothing is changed.
+        """
+        return bool(self._renew_script(keys=[self._leases_key, self._lease_owners_key],
+                                       args=[item, self._session, time.time() + lease_secs]))
+
+    @contextlib.contextmanager
+    def leased(self, lease_secs=60, block=True, timeout=None, renew_secs=None):
+        """Lease an item for the duration of a with block, renewing the lease as the work runs.
+
+        A background thread renews the lease every renew_secs (default lease_secs / 3), so
+        jobs longer than lease_secs are not picked up by other workers.  If the block exits
+        normally the item is completed, unless it was failed (see fail) or the lease was lost.
+        If it raises, renewal stops and the lease is left
+        to expire, so the item can be reclaimed (see check_expired_leases).  If the worker
+        dies, so does the renewal thread.
+
+        Yields None if no item was available, e.g.
+
+            with q.leased(lease_secs=600, timeout=600) as item:
+                if item is not None:
+                    process(item)
+        """
+        item = self.lease(lease_secs=lease_secs, block=block, timeout=timeout)
+        if item is None:
+            yield None
+            return
+
+        stop = threading.Event()
+        renew_secs = renew_secs or max(1, lease_secs // 3)
+
+        def heartbeat():
+            while not stop.wait(renew_secs):
+                if not self.renew_lease(item, lease_secs):
+                    logging.getLogger("rediswq").warning(f"Lost lease on {item} in {self.name()}")
+                    return
+
+        renewer = threading.Thread(target=heartbeat, name=f"lease-renewal-{self._session}", daemon=True)
+        renewer.start()
+        try:
+            yield item
+        finally:
+            stop.set()
+            renewer.join()
+        if self._db.hget(self._lease_owners_key, item) == self._session.encode():
+            self.complete(item)
+
     def complete(self, value):
         """Complete working on the item with 'value'.
 
@@ -107,11 +438,85 @@ class RedisWQ(object):
         other worker may have picked it up.  There is no indication
         of what happened.
         """
-        self._db.lrem(self._processing_q_key, 0, value)
-        # If we crash here, then the GC code will try to move the value, but it will
-        # not be here, which is fine.  So this does not need to be a transaction.
-        itemkey = self._itemkey(value)
-        self._db.delete(self._lease_key_prefix + itemkey, self._session)
+        pipe = self._db.pipeline()
+        pipe.zrem(self._leases_key, value)
+        pipe.hdel(self._lease_owners_key, value)
+        pipe.hdel(self._scores_key, value)
+        pipe.hdel(self._due_key, value)
+        pipe.hdel(self._attempts_key, value)
+        pipe.hdel(self._errors_key, value)
+        pipe.execute()
+
+    def release(self, value):
+        """Give up the lease on the item with 'value' without working on it.
+
+        The item is returned to the consuming end of the main queue and keeps its place in
+        the schedule, so it is leased again ahead of items enqueued after it with the same
+        priority.  No attempt is counted.
+        """
+        pipe = self._db.pipeline()
+        pipe.zrem(self._leases_key, value)
+        pipe.hdel(self._lease_owners_key, value)
+        pipe.rpush(self._main_q_key, value)
+        pipe.execute()
+
+    def complete_many(self, values):
+        """Complete working on all of 'values' in a single round trip (see complete)."""
+        if not values:
+            return
+        pipe = self._db.pipeline()
+        pipe.zrem(self._leases_key, *values)
+        pipe.hdel(self._lease_owners_key, *values)
+        pipe.hdel(self._scores_key, *values)
+        pipe.hdel(self._due_key, *values)
+        pipe.hdel(self._attempts_key, *values)
+        pipe.hdel(self._errors_key, *values)
+        pipe.execute()
+
+    def fail(self, value, error="", retry=True):
+        """Stop working on the item with 'value' because processing failed.
+
+        The item is retried after an exponential backoff (with jitter), unless retry is
+        false or it has now failed max_attempts times, in which case it is moved onto
+        the dead-letter list with 'error'.
+
+        Returns True if the item was dead-lettered.
+        """
+        attempts, dead = self._fail_script(
+            keys=[self._leases_key, self._lease_owners_key, self._attempts_key, self._delayed_key,
+                  self._dead_q_key, self._errors_key, self._scores_key, self._due_key],
+            args=[value, time.time(), self._max_attempts if retry else 0, self._backoff_secs,
+                  random.uniform(0.8, 1.2), str(error)])
+        logger = logging.getLogger("rediswq")
+        if dead:
+            logger.warning(f"Dead-lettered {value} from {self.name()} after {attempts} attempts: {error}")
+        else:
+            logger.info(f"Retrying {value} from {self.name()} after attempt {attempts}: {error}")
+        return bool(dead)
+
+    def dead_letters(self):
+        """Return a list of (item, last error, attempts) for every dead-lettered item."""
+        items = self._db.lrange(self._dead_q_key, 0, -1)
+        if not items:
+            return []
+        errors = self._db.hmget(self._errors_key, items)
+        attempts = self._db.hmget(self._attempts_key, items)
+        return [(item, error.decode() if error else None, int(attempt or 0))
+                for item, error, attempt in zip(items, errors, attempts)]
+
+    def requeue_dead_letters(self):
+        """Move every dead-lettered item back onto the main queue, resetting its attempts.
+
+        Returns the number of items requeued.
+        """
+        requeued = 0
+        while True:
+            item = self._db.rpoplpush(self._dead_q_key, self._main_q_key)
+            if item is None:
+                return requeued
+            self._db.hdel(self._attempts_key, item)
+            self._db.hdel(self._errors_key, item)
+            requeued += 1
 
 # TODO: add functions to clean up all keys associated with "name" when
 # processing is complete.
@@ -125,6 +530,34 @@ class RedisWQ(object):
 # make it so it can be pip installed by anyone (see
 # http://stackoverflow.com/questions/8247605/configuring-so-that-pip-install-can-work-from-github)
 
-# TODO(etune): finish code to GC expired leases, and call periodically
-#  e.g. each time lease times out.
 
+def run_reaper(queues, interval_secs=60, grace_secs=60, stop_event=None):
+    """Call check_expired_leases on each queue every interval_secs until stop_event (a threading.Event) is set.
+
+    Can be run in a thread by workers, or standalone for a whole fleet (see __main__).
+    """
+    logger = logging.getLogger("rediswq")
+    while stop_event is None or not stop_event.is_set():
+        for queue in queues:
+            reclaimed = queue.check_expired_leases(grace_secs=grace_secs)
+            if reclaimed:
+                logger.info(f"Reclaimed {reclaimed} expired items from {queue.name()} "
+                            f"({queue.reclaimed_count()} in total)")
+        if stop_event is None:
+            time.sleep(interval_secs)
+        else:
+            stop_event.wait(interval_secs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Return items with expired leases to their work queues.")
+    parser.add_argument("queues", nargs="+", help="work queue names, e.g. jobS2 jobS1")
+    parser.add_argument("--host", default="redis-master")
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--interval", type=int, default=60, help="seconds between checks")
+    parser.add_argument("--grace", type=int, default=60, help="seconds an item must be unclaimed before reclaiming")
+    cli_args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s %(levelname)-8s %(name)s %(message)s", level=logging.INFO)
+    queues = [RedisWQ(name=queue, host=cli_args.host, port=cli_args.port) for queue in cli_args.queues]
+    run_reaper(queues, interval_secs=cli_args.interval, grace_secs=cli_args.grace)
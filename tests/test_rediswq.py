@@ -0,0 +1,169 @@
+# Tests of RedisWQ's lease bookkeeping (the Lua scripts) against fakeredis, with a fake clock
+# so expiry, grace periods and retry backoff can be stepped through without sleeping.
+
+import fakeredis
+import pytest
+
+import rediswq
+
+ITEM = b'{"in_scene": "S2A_MSIL1C_20180820T223011_N0206_R072_T60KWE_20180821T013410"}'
+
+
+class FakeClock(object):
+    def __init__(self, now=1600000000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def advance(self, secs):
+        self.now += secs
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rediswq, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def queue(monkeypatch, clock):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(rediswq.redis, "StrictRedis", lambda **kwargs: fakeredis.FakeStrictRedis(server=server))
+    queue = rediswq.RedisWQ(name="jobTest", max_attempts=2, backoff_secs=60)
+    queue.push(ITEM)
+    return queue
+
+
+def test_expired_lease_is_reclaimed(queue, clock):
+    assert queue.lease(lease_secs=10, block=False) == ITEM
+    assert queue.lease(lease_secs=10, block=False) is None
+
+    clock.advance(9)
+    assert queue.check_expired_leases() == 0
+
+    clock.advance(2)
+    assert queue.check_expired_leases() == 1
+    assert queue.reclaimed_count() == 1
+    assert queue.lease(lease_secs=10, block=False) == ITEM
+
+
+def test_completed_item_is_not_reclaimed(queue, clock):
+    item = queue.lease(lease_secs=10, block=False)
+    queue.complete(item)
+
+    clock.advance(60)
+    assert queue.check_expired_leases() == 0
+    assert queue.empty()
+
+
+def test_unclaimed_item_is_reclaimed_after_grace(queue, clock):
+    # A worker that crashed between brpoplpush and claiming leaves the item on the processing list.
+    queue.db().rpoplpush("jobTest", "jobTest:processing")
+
+    assert queue.check_expired_leases(grace_secs=60) == 0
+    clock.advance(59)
+    assert queue.check_expired_leases(grace_secs=60) == 0
+    clock.advance(1)
+    assert queue.check_expired_leases(grace_secs=60) == 1
+    assert queue.db().llen("jobTest:processing") == 0
+    assert queue.lease(lease_secs=10, block=False) == ITEM
+
+
+def test_item_claimed_within_grace_is_forgotten(queue, clock):
+    db = queue.db()
+    db.rpoplpush("jobTest", "jobTest:processing")
+    assert queue.check_expired_leases(grace_secs=60) == 0
+
+    # claimed before the grace period ran out
+    db.lrem("jobTest:processing", 1, ITEM)
+    clock.advance(30)
+    assert queue.check_expired_leases(grace_secs=60) == 0
+    assert db.hlen("jobTest:unclaimed_since") == 0
+
+
+def test_renew_extends_lease(queue, clock):
+    item = queue.lease(lease_secs=10, block=False)
+
+    clock.advance(8)
+    assert queue.renew_lease(item, lease_secs=10)
+    clock.advance(8)
+    assert queue.check_expired_leases() == 0
+
+    clock.advance(3)
+    assert queue.check_expired_leases() == 1
+    # a lease that expired is not resurrected
+    assert not queue.renew_lease(item, lease_secs=10)
+
+
+def test_renew_by_another_session_fails(queue):
+    item = queue.lease(lease_secs=10, block=False)
+    other = rediswq.RedisWQ(name="jobTest")
+    assert not other.renew_lease(item, lease_secs=10)
+
+
+def test_failed_item_is_delayed_then_dead_lettered(queue, clock):
+    item = queue.lease(lease_secs=10, block=False)
+    assert not queue.fail(item, "boom")
+    assert queue.db().zscore("jobTest:delayed", item) is not None
+    assert not queue.empty()
+
+    # waiting out the backoff (60s, with up to 20% jitter)
+    assert queue.lease(lease_secs=10, block=False) is None
+    clock.advance(73)
+    assert queue.lease(lease_secs=10, block=False) == ITEM
+
+    assert queue.fail(item, "boom again")
+    assert queue.dead_letters() == [(ITEM, "boom again", 2)]
+    assert queue.lease(lease_secs=10, block=False) is None
+
+    assert queue.requeue_dead_letters() == 1
+    assert queue.dead_letters() == []
+    assert queue.lease(lease_secs=10, block=False) == ITEM
+    assert queue.db().hget("jobTest:attempts", ITEM) is None
+
+
+def test_fail_without_retry_is_dead_lettered(queue):
+    item = queue.lease(lease_secs=10, block=False)
+    assert queue.fail(item, "bad input", retry=False)
+    assert queue.dead_letters() == [(ITEM, "bad input", 1)]
+
+
+def test_complete_clears_attempts(queue, clock):
+    item = queue.lease(lease_secs=10, block=False)
+    queue.fail(item, "boom")
+    clock.advance(73)
+    item = queue.lease(lease_secs=10, block=False)
+    queue.complete(item)
+    assert queue.empty()
+    assert queue.db().hget("jobTest:attempts", ITEM) is None
+
+
+def test_released_item_keeps_its_place(queue, clock):
+    item = queue.lease(lease_secs=10, block=False)
+    clock.advance(1)
+    for later in (b"later-1", b"later-2"):
+        queue.push(later)
+    # moves both into pending, leaving later-2 waiting
+    assert queue.lease(lease_secs=10, block=False) == b"later-1"
+
+    clock.advance(1)
+    queue.release(item)
+    assert queue.lease(lease_secs=10, block=False) == ITEM
+
+
+def test_reclaimed_item_keeps_its_place(queue, clock):
+    queue.lease(lease_secs=10, block=False)
+    clock.advance(1)
+    queue.push(b"later")
+    queue.lease_many(n=1, lease_secs=60, block=False)
+    queue.release(b"later")
+
+    clock.advance(10)
+    assert queue.check_expired_leases() == 1
+    assert queue.lease(lease_secs=10, block=False) == ITEM
+    assert queue.lease(lease_secs=10, block=False) == b"later"
+    assert queue.db().hlen("jobTest:scores") == 2
+    queue.complete_many([ITEM, b"later"])
+    assert queue.db().hlen("jobTest:scores") == 0
@@ -6,9 +6,59 @@ from xarray.ufuncs import logical_or  as xr_or
 
 ## Utils ##
 
+def _values_in(arr, values):
+    """
+    Returns a boolean mask shaped like `arr`, with `True` wherever the value is in `values`.
+    Small integer dtypes (e.g. uint8 SCL, uint16 pixel_qa) use a lookup table indexed by
+    the data itself; other dtypes use a binary search against the sorted `values`.
+    Either way, `arr` is only traversed once regardless of how many values are checked.
+
+    Parameters
+    ----------
+    arr: np.ndarray
+        The data to check for value matches.
+    values: np.ndarray
+        The values to check for.
+
+    Returns
+    -------
+    mask: np.ndarray
+        A boolean NumPy array shaped like ``arr``.
+    """
+    if arr.dtype.kind in 'ui' and arr.dtype.itemsize <= 2:
+        info = np.iinfo(arr.dtype)
+        # Only values representable in the dtype of `arr` can ever match.
+        values = values[(info.min <= values) & (values <= info.max) & (values == np.floor(values))]
+        # Index the table by the unsigned view of the data so signed dtypes need no copy.
+        unsigned = np.dtype('u{}'.format(arr.dtype.itemsize))
+        lut = np.zeros(2 ** (8 * arr.dtype.itemsize), dtype=np.bool_)
+        lut[values.astype(arr.dtype).view(unsigned)] = True
+        return lut[arr.view(unsigned)]
+    if arr.dtype.kind == 'b':
+        return np.isin(arr, values)
+    sorted_values = np.unique(values)
+    if len(sorted_values) == 0:
+        return np.zeros(arr.shape, dtype=np.bool_)
+    idx = np.searchsorted(sorted_values, arr)
+    np.clip(idx, 0, len(sorted_values) - 1, out=idx)
+    return sorted_values[idx] == arr
+
+
+def _data_values_in(data_arr, values):
+    """
+    Applies `_values_in()` to the data of an `xarray.DataArray`, block by block if it is
+    dask-backed so that the mask stays lazy.
+    """
+    arr = data_arr.data
+    if hasattr(arr, 'map_blocks'):
+        return arr.map_blocks(_values_in, values, dtype=np.bool_)
+    return _values_in(np.asarray(arr), values)
+
+
 def xarray_values_in(data, values, data_vars=None):
     """
     Returns a mask for an xarray Dataset or DataArray, with `True` wherever the value is in values.
+    Each data variable is checked in a single pass, no matter how many values there are.
 
     Parameters
     ----------
@@ -21,20 +71,20 @@ def xarray_values_in(data, values, data_vars=None):
 
     Returns
     -------
-    mask: np.ndarray
+    mask: np.ndarray or dask.array.Array
         A NumPy array shaped like ``data``. The mask can be used to mask ``data``.
         That is, ``data.where(mask)`` is an intended use.
+        If ``data`` is backed by dask, the mask is a lazy dask array with the same chunks.
     """
-    data_vars_to_check = data_vars if data_vars is not None else list(data.data_vars.keys())
+    values = np.asarray(values).ravel()
     if isinstance(data, xr.Dataset):
-        mask = np.full_like(data[data_vars_to_check[0]].values, False, dtype=np.bool)
+        data_vars_to_check = data_vars if data_vars is not None else list(data.data_vars.keys())
+        mask = None
         for data_arr in data[data_vars_to_check].values():
-            for value in values:
-                mask = mask | (data_arr.values == value)
+            data_arr_mask = _data_values_in(data_arr, values)
+            mask = data_arr_mask if mask is None else mask | data_arr_mask
     elif isinstance(data, xr.DataArray):
-        mask = np.full_like(data, False, dtype=np.bool)
-        for value in values:
-            mask = mask | (data.values == value)
+        mask = _data_values_in(data, values)
     return mask
 
 ## End Utils ##
@@ -88,9 +88,11 @@ def export_xarray_to_multiple_geotiffs(ds, path, x_coord='longitude', y_coord='l
 
 
 def export_xarray_to_geotiff(data, tif_path, bands=None, no_data=-9999, crs="EPSG:4326",
-                             x_coord='longitude', y_coord='latitude'):
+                             x_coord='longitude', y_coord='latitude', cog=False, compress='DEFLATE',
+                             blocksize=512, overview_level=5, overview_resampling='average'):
     """
-    Export a GeoTIFF from a 2D `xarray.Dataset`.
+    Export a tiled, compressed GeoTIFF (or COG) from a 2D `xarray.Dataset`.
+    Data is streamed to the file block by block - dask-backed data is computed one chunk at a time.
 
     Parameters
     ----------
@@ -107,35 +109,18 @@ def export_xarray_to_geotiff(data, tif_path, bands=None, no_data=-9999, crs="EPS
         The CRS of the output.
     x_coord, y_coord: string
         The string names of the x and y dimensions.
+    cog: bool
+        Whether to write a Cloud Optimized GeoTIFF directly, rather than converting afterwards.
+    compress: str
+        The GDAL compression to use, or `None` for no compression.
+    blocksize: int
+        The tile size in pixels. Must be a multiple of 16.
+    overview_level: int
+        The number of overview levels to build for COGs.
+    overview_resampling: str
+        The resampling method to build COG overviews with.
     """
-    if isinstance(data, xr.DataArray):
-        height, width = data.sizes[y_coord], data.sizes[x_coord]
-        count, dtype = 1, data.dtype
-    else:
-        if bands is None:
-            bands = list(data.data_vars.keys())
-        else:
-            assrt_msg_begin = "The `data` parameter is an `xarray.Dataset`. "
-            assert isinstance(bands, list), assrt_msg_begin + "Bands must be a list of strings."
-            assert len(bands) > 0 and isinstance(bands[0], str), assrt_msg_begin + "You must supply at least one band."
-        height, width = data.dims[y_coord], data.dims[x_coord]
-        count, dtype = len(bands), data[bands[0]].dtype
-    with rasterio.open(
-            tif_path,
-            'w',
-            driver='GTiff',
-            height=height,
-            width=width,
-            count=count,
-            dtype=dtype,
-            crs=crs,
-            transform=_get_transform_from_xr(data, x_coord=x_coord, y_coord=y_coord),
-            nodata=no_data) as dst:
-        if isinstance(data, xr.DataArray):
-            dst.write(data.values, 1)
-        else:
-            for index, band in enumerate(bands):
-                dst.write(data[band].values.astype(dtype), index + 1)
-    dst.close()
-
-## End export ##
\ No newline at end of file
+    dc_utilities.write_geotiff_from_xr(tif_path, data, bands=bands, no_data=no_data, crs=crs,
+                                       x_coord=x_coord, y_coord=y_coord, cog=cog, compress=compress,
+                                       blocksize=blocksize, overview_level=overview_level,
+                                       overview_resampling=overview_resampling)
@@ -585,7 +585,8 @@ def create_hdmedians_multiple_band_mosaic(dataset_in,
 
 def restore_or_convert_dtypes(dtype_for_all=None, band_list=None, dataset_in_dtypes=None, dataset_out=None, no_data=-9999):
     """
-    Converts datatypes of data variables in a copy of an xarray Dataset.
+    Converts datatypes of data variables of an xarray Dataset in place.
+    Nan values are replaced by `no_data` in the same pass for integer datatypes.
 
     Parameters
     ----------
@@ -610,12 +611,12 @@ def restore_or_convert_dtypes(dtype_for_all=None, band_list=None, dataset_in_dty
     if dtype_for_all is not None:
         # Integer types can't represent nan.
         if np.issubdtype(dtype_for_all, np.integer): # This also works for Python int type.
-            utilities.nan_to_num(dataset_out, no_data)
-        convert_to_dtype(dataset_out, dtype_for_all)
+            utilities.nan_to_num_astype(dataset_out, no_data, dtype_for_all)
+        else:
+            utilities.nan_to_num_astype(dataset_out, None, dtype_for_all)
     else:  # Restore dtypes to state before masking.
         for band in dataset_in_dtypes:
             band_dtype = dataset_in_dtypes[band]
-            if np.issubdtype(band_dtype, np.integer):
-                utilities.nan_to_num(dataset_out[band], no_data)
-            dataset_out[band] = dataset_out[band].astype(band_dtype)
+            band_no_data = no_data if np.issubdtype(band_dtype, np.integer) else None
+            utilities.nan_to_num_astype(dataset_out[band], band_no_data, band_dtype)
     return dataset_out
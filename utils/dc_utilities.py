@@ -134,59 +134,198 @@ def perform_timeseries_analysis(dataset_in, band_name, intermediate_product=None
       intermediate_product: result of this function for previous data, to be combined here
     Output:
       dataset_out (xarray.DataSet) - dataset containing
-        variables: normalized_data, total_data, total_clean
+        variables: normalized_data, min, max, total_data, total_clean, total_sq
     """
 
     assert operation in ['mean', 'max', 'min'], "Please enter a valid operation."
 
+    dataset_out = timeseries_stats(dataset_in, band_name, no_data=no_data)
+    if intermediate_product is not None:
+        dataset_out = merge_timeseries_stats(intermediate_product, dataset_out)
+    dataset_out['normalized_data'] = dataset_out['total_data'] / dataset_out['total_clean']
+
+    nan_to_num(dataset_out, 0)
+
+    return dataset_out
+
+
+def timeseries_stats(dataset_in, band_name, no_data=-9999):
+    """
+    Computes mergeable partial statistics through time for a single band.
+    If `dataset_in` is backed by dask, the statistics are lazy and computed per chunk.
+
+    Parameters
+    ----------
+    dataset_in: xarray.Dataset
+        Dataset with a `time` dimension containing `band_name`.
+    band_name: str
+        The name of the band to create statistics for.
+    no_data: int or float
+        The no data value, which is excluded from all statistics.
+
+    Returns
+    -------
+    stats: xarray.Dataset
+        Dataset with variables total_data (sum), total_clean (count), total_sq (sum of
+        squares), min and max. Partials for different scenes can be combined with
+        `merge_timeseries_stats()` or `reduce_timeseries_stats()`.
+    """
     data = dataset_in[band_name]
     data = data.where(data != no_data)
 
-    processed_data_sum = data.sum('time')
-
-    clean_data = data.notnull()
-
-    clean_data_sum = clean_data.astype('bool').sum('time')
-
-    dataset_out = None
-    if intermediate_product is None:
-        processed_data_normalized = processed_data_sum / clean_data_sum
-        dataset_out = xr.Dataset(
-            {
-                'normalized_data': processed_data_normalized,
-                'min': data.min(dim='time'),
-                'max': data.max(dim='time'),
-                'total_data': processed_data_sum,
-                'total_clean': clean_data_sum
-            },
-            coords={'latitude': dataset_in.latitude,
-                    'longitude': dataset_in.longitude})
+    return xr.Dataset(
+        {
+            'min': data.min(dim='time'),
+            'max': data.max(dim='time'),
+            'total_data': data.sum('time'),
+            'total_clean': data.notnull().sum('time'),
+            'total_sq': (data ** 2).sum('time')
+        },
+        coords={'latitude': dataset_in.latitude,
+                'longitude': dataset_in.longitude})
+
+
+def _merge_stat(stats_out, key, other, ufunc):
+    """Combine `other` into `stats_out[key]` with `ufunc`, in place where both are in memory."""
+    current = stats_out[key]
+    if isinstance(current.data, np.ndarray) and isinstance(other.data, np.ndarray) \
+            and current.shape == other.shape and np.can_cast(other.dtype, current.dtype, casting='same_kind'):
+        ufunc(current.data, other.data, out=current.data)
     else:
-        dataset_out = intermediate_product
-        dataset_out['total_data'] += processed_data_sum
-        dataset_out['total_clean'] += clean_data_sum
-        dataset_out['normalized_data'] = dataset_out['total_data'] / dataset_out['total_clean']
-        dataset_out['min'] = xr.concat([dataset_out['min'], data.min(dim='time')], dim='time').min(dim='time')
-        dataset_out['max'] = xr.concat([dataset_out['max'], data.max(dim='time')], dim='time').max(dim='time')
+        stats_out[key] = ufunc(current, other)
 
-    nan_to_num(dataset_out, 0)
 
-    return dataset_out
+def merge_timeseries_stats(stats_out, stats_in):
+    """
+    Merges the partial statistics `stats_in` into `stats_out` in place.
+    NaN minima and maxima (pixels with no clean data) are ignored, as with `min(dim='time')`.
 
+    Parameters
+    ----------
+    stats_out, stats_in: xarray.Dataset
+        Partial statistics from `timeseries_stats()` or `perform_timeseries_analysis()`.
 
-def nan_to_num(data, number):
+    Returns
+    -------
+    stats_out: xarray.Dataset
+        The updated `stats_out`.
     """
-    Converts all nan values in `data` to `number`.
+    _merge_stat(stats_out, 'total_data', stats_in['total_data'], np.add)
+    _merge_stat(stats_out, 'total_clean', stats_in['total_clean'], np.add)
+    _merge_stat(stats_out, 'min', stats_in['min'], np.fmin)
+    _merge_stat(stats_out, 'max', stats_in['max'], np.fmax)
+    if 'total_sq' in stats_out and 'total_sq' in stats_in:
+        _merge_stat(stats_out, 'total_sq', stats_in['total_sq'], np.add)
+    return stats_out
+
+
+def reduce_timeseries_stats(partials):
+    """
+    Reduces a list of partial statistics (e.g. one per scene or per worker) into one.
+    The first partial is updated in place and returned.
+
+    Parameters
+    ----------
+    partials: list of xarray.Dataset
+        Partial statistics from `timeseries_stats()`.
+
+    Returns
+    -------
+    stats: xarray.Dataset
+        The combined statistics, including `normalized_data` (mean) and `std`.
+    """
+    partials = list(partials)
+    if len(partials) == 0:
+        raise ValueError('`partials` is empty!')
+    stats = functools.reduce(merge_timeseries_stats, partials)
+    stats['normalized_data'] = stats['total_data'] / stats['total_clean']
+    stats['std'] = np.sqrt((stats['total_sq'] / stats['total_clean'] - stats['normalized_data'] ** 2).clip(min=0))
+    return stats
+
+
+# Upper bound on the number of elements processed at once by the in-place dtype helpers,
+# so temporary NaN masks stay small regardless of the size of the data.
+_BLOCK_ELEMENTS = 2 ** 22
+
+
+def _blocks(shape):
+    """Yield index expressions splitting an array of `shape` into slabs along its first axis."""
+    if len(shape) == 0:
+        yield Ellipsis
+        return
+    rows = max(1, _BLOCK_ELEMENTS // max(1, int(np.prod(shape[1:]))))
+    for start in range(0, shape[0], rows):
+        yield slice(start, start + rows)
+
+
+def _nan_to_num_astype_block(block, number, dtype):
+    """Replace nan values in `block` with `number` (if not None) and convert to `dtype`."""
+    with np.errstate(invalid='ignore'):
+        out = block.astype(dtype)
+    if number is not None and block.dtype.kind == 'f':
+        out[np.isnan(block)] = number
+    return out
+
+
+def _nan_to_num_astype_array(arr, number, dtype):
+    """
+    In-memory version of `_nan_to_num_astype_block()` which works one slab at a time.
+    If no conversion is needed, `arr` is modified in place and returned.
+    """
+    dtype = np.dtype(dtype)
+    out = arr if arr.dtype == dtype else np.empty(arr.shape, dtype=dtype)
+    replace = number is not None and arr.dtype.kind == 'f'
+    for index in _blocks(arr.shape):
+        block = arr[index]
+        if out is not arr:
+            with np.errstate(invalid='ignore'):
+                np.copyto(out[index], block, casting='unsafe')
+        if replace:
+            np.copyto(out[index], number, where=np.isnan(block), casting='unsafe')
+    return out
+
+
+def _nan_to_num_astype_data_array(data_arr, number, dtype):
+    """Apply `_nan_to_num_astype_array()` to the data of `data_arr` in place, lazily if it is dask-backed."""
+    dtype = data_arr.dtype if dtype is None else np.dtype(dtype)
+    arr = data_arr.data
+    if hasattr(arr, 'map_blocks'):
+        data_arr.data = arr.map_blocks(_nan_to_num_astype_block, number, dtype, dtype=dtype)
+    else:
+        data_arr.data = _nan_to_num_astype_array(np.asarray(arr), number, dtype)
+
+
+def nan_to_num_astype(data, number, dtype):
+    """
+    Converts all nan values in `data` to `number` and converts `data` to `dtype`,
+    in one pass per block and in place.
 
     Parameters
     ----------
     data: xarray.Dataset or xarray.DataArray
+    number: int or float
+        The value to replace nan values with. If `None`, nan values are left as they are.
+    dtype: str or numpy.dtype or dict
+        The dtype to convert to - or a dictionary mapping data variable names to dtypes.
+        If `None` (or a data variable is not in the dictionary), the dtype is unchanged.
     """
     if isinstance(data, xr.Dataset):
         for key in list(data.data_vars):
-            data[key].values[np.isnan(data[key].values)] = number
+            key_dtype = dtype.get(key, None) if isinstance(dtype, dict) else dtype
+            _nan_to_num_astype_data_array(data[key], number, key_dtype)
     elif isinstance(data, xr.DataArray):
-        data.values[np.isnan(data.values)] = number
+        _nan_to_num_astype_data_array(data, number, dtype)
+
+
+def nan_to_num(data, number):
+    """
+    Converts all nan values in `data` to `number`.
+
+    Parameters
+    ----------
+    data: xarray.Dataset or xarray.DataArray
+    """
+    nan_to_num_astype(data, number, None)
 
 
 def clear_attrs(dataset):
@@ -243,12 +382,60 @@ def add_timestamp_data_to_xr(dataset):
                 'time': dataset.time})
 
 
+def _get_geotiff_profile(height, width, count, dtype, crs, transform, no_data, blocksize=512, compress='DEFLATE'):
+    """Creation options for a tiled (and optionally compressed) GeoTIFF, as used for our COGs."""
+    profile = dict(driver='GTiff', height=height, width=width, count=count, dtype=dtype, crs=crs,
+                   transform=transform, nodata=no_data, interleave='pixel', tiled=True,
+                   blockxsize=blocksize, blockysize=blocksize, BIGTIFF='IF_SAFER')
+    if compress is not None:
+        profile['compress'] = compress
+        # Floating point predictor for floats, horizontal differencing for integers.
+        profile['predictor'] = 3 if np.dtype(dtype).kind == 'f' else 2
+        if compress.upper() == 'DEFLATE':
+            profile['zlevel'] = 9
+    return profile
+
+
+def _get_xr_windows(data_arr, x_coord, y_coord, blocksize):
+    """
+    Yields `rasterio.windows.Window` objects covering a 2D `xarray.DataArray`.
+    Dask-backed arrays are split along their chunks (so each chunk is computed once),
+    in-memory arrays along `blocksize` tiles.
+    """
+    from rasterio.windows import Window
+
+    def _edges(axis, size):
+        if data_arr.chunks is not None:
+            sizes = data_arr.chunks[data_arr.get_axis_num(axis)]
+        else:
+            sizes = [min(blocksize, size - start) for start in range(0, size, blocksize)]
+        return np.cumsum([0] + list(sizes))
+
+    y_edges = _edges(y_coord, data_arr.sizes[y_coord])
+    x_edges = _edges(x_coord, data_arr.sizes[x_coord])
+    for row_off, row_end in zip(y_edges[:-1], y_edges[1:]):
+        for col_off, col_end in zip(x_edges[:-1], x_edges[1:]):
+            yield Window(int(col_off), int(row_off), int(col_end - col_off), int(row_end - row_off))
+
+
+def _write_xr_blocks(dst, data_arrs, dtype, x_coord, y_coord, blocksize):
+    """Stream 2D `xarray.DataArray` objects into the bands of an open rasterio dataset, window by window."""
+    for index, data_arr in enumerate(data_arrs):
+        data_arr = data_arr.transpose(y_coord, x_coord)
+        for window in _get_xr_windows(data_arr, x_coord, y_coord, blocksize):
+            block = data_arr.isel({y_coord: slice(window.row_off, window.row_off + window.height),
+                                   x_coord: slice(window.col_off, window.col_off + window.width)}).values
+            dst.write(block.astype(dtype, copy=False), index + 1, window=window)
+
+
 def write_geotiff_from_xr(tif_path, data, bands=None, no_data=-9999, crs="EPSG:4326",
-                          x_coord='longitude', y_coord='latitude'):
+                          x_coord='longitude', y_coord='latitude', cog=False, compress='DEFLATE',
+                          blocksize=512, overview_level=5, overview_resampling='average'):
     """
     NOTE: Instead of this function, please use `import_export.export_xarray_to_geotiff()`.
 
-    Export a GeoTIFF from an `xarray.Dataset`.
+    Export a tiled, compressed GeoTIFF (or COG) from an `xarray.Dataset`.
+    Data is written block by block, so dask-backed data is never fully materialised.
 
     Parameters
     ----------
@@ -264,10 +451,21 @@ def write_geotiff_from_xr(tif_path, data, bands=None, no_data=-9999, crs="EPSG:4
         The CRS of the output.
     x_coord, y_coord: string
         The string names of the x and y dimensions.
+    cog: bool
+        Whether to write a Cloud Optimized GeoTIFF (with internal overviews) directly.
+    compress: str
+        The GDAL compression to use (e.g. 'DEFLATE', 'LZW'), or `None` for no compression.
+    blocksize: int
+        The tile size in pixels. Must be a multiple of 16.
+    overview_level: int
+        The number of overview (decimation) levels to build for COGs.
+    overview_resampling: str
+        The `rasterio.enums.Resampling` name to build COG overviews with.
     """
     if isinstance(data, xr.DataArray):
         height, width = data.sizes[y_coord], data.sizes[x_coord]
         count, dtype = 1, data.dtype
+        data_arrs = [data]
     else:
         if bands is None:
             bands = list(data.data_vars.keys())
@@ -275,32 +473,160 @@ def write_geotiff_from_xr(tif_path, data, bands=None, no_data=-9999, crs="EPSG:4
             assrt_msg_begin = "The `data` parameter is an `xarray.Dataset`. "
             assert isinstance(bands, list), assrt_msg_begin + "Bands must be a list of strings."
             assert len(bands) > 0 and isinstance(bands[0], str), assrt_msg_begin + "You must supply at least one band."
-        height, width = data.dims[y_coord], data.dims[x_coord]
+        height, width = data.sizes[y_coord], data.sizes[x_coord]
         count, dtype = len(bands), data[bands[0]].dtype
-    with rasterio.open(
-            tif_path,
-            'w',
-            driver='GTiff',
-            height=height,
-            width=width,
-            count=count,
-            dtype=dtype,
-            crs=crs,
-            transform=_get_transform_from_xr(data, x_coord=x_coord, y_coord=y_coord),
-            nodata=no_data) as dst:
-        if isinstance(data, xr.DataArray):
-            dst.write(data.values, 1)
-        else:
-            for index, band in enumerate(bands):
-                dst.write(data[band].values, index + 1)
-    dst.close()
+        data_arrs = [data[band] for band in bands]
+    profile = _get_geotiff_profile(height, width, count, dtype, crs,
+                                   _get_transform_from_xr(data, x_coord=x_coord, y_coord=y_coord),
+                                   no_data, blocksize=blocksize, compress=compress)
+    if not cog:
+        with rasterio.open(tif_path, 'w', **profile) as dst:
+            _write_xr_blocks(dst, data_arrs, dtype, x_coord, y_coord, blocksize)
+        return
+
+    # COGs need their overviews ahead of the full resolution data, so tiles are streamed
+    # into an in-memory (compressed) dataset and copied out with its overviews in one go.
+    from rasterio.enums import Resampling
+    from rasterio.io import MemoryFile
+    from rasterio.shutil import copy
+
+    with MemoryFile() as memfile:
+        with memfile.open(**profile) as mem:
+            _write_xr_blocks(mem, data_arrs, dtype, x_coord, y_coord, blocksize)
+            if overview_level and overview_resampling is not None:
+                overviews = [2 ** j for j in range(1, overview_level + 1)]
+                mem.build_overviews(overviews, Resampling[overview_resampling])
+                mem.update_tags(OVR_RESAMPLING_ALG=Resampling[overview_resampling].name.upper())
+            copy_kwargs = {k: v for k, v in profile.items()
+                           if k not in ('driver', 'height', 'width', 'count', 'dtype', 'crs', 'transform', 'nodata')}
+            copy(mem, tif_path, driver='GTiff', copy_src_overviews=True, **copy_kwargs)
+
+
+def _parse_color(color):
+    """Convert a colour name (e.g. 'red') or hex string (e.g. '#FF0000') to an RGB tuple of ints."""
+    from matplotlib.colors import to_rgb
+    return tuple(int(round(255 * c)) for c in to_rgb(color))
+
+
+def _scale_to_byte(data, scale=None, no_data=None):
+    """
+    Linearly scale `data` from `scale` (a (min, max) tuple) to 0-255, like `gdal_translate -scale`.
+    If `scale` is None, values are clamped to 0-255 (like `gdal_translate -ot Byte`).
+    If `scale` is 'auto', the 2nd-98th percentile of the valid data is used.
+    Pixels equal to `no_data` (or nan) are set to 0.
+    """
+    data = np.asarray(data, dtype=np.float32)
+    invalid = np.isnan(data)
+    if no_data is not None:
+        invalid |= data == no_data
+    if isinstance(scale, str) and scale == 'auto':
+        valid = data[~invalid]
+        scale = tuple(np.percentile(valid, (2, 98))) if valid.size else (0, 255)
+    if scale is not None:
+        low, high = float(scale[0]), float(scale[1])
+        data = (data - low) * (255.0 / max(high - low, np.finfo(np.float32).eps))
+    out = np.clip(data, 0, 255).astype(np.uint8)
+    out[invalid] = 0
+    return out
+
+
+def _read_color_scale(color_scale):
+    """
+    Read a `gdaldem color-relief` compatible colour table.
+    Each line is `value R G B [A]` - values can also be percentages (e.g. '50%') or 'nv' (nodata).
+
+    Returns
+    -------
+    entries: list of tuple
+        (value, (R, G, B, A)) pairs in file order - value is a float, a percentage string or 'nv'.
+    """
+    entries = []
+    with open(color_scale) as color_file:
+        for line in color_file:
+            parts = line.replace(',', ' ').replace('\t', ' ').split()
+            if len(parts) < 2 or parts[0].startswith('#'):
+                continue
+            value = parts[0] if parts[0] == 'nv' or parts[0].endswith('%') else float(parts[0])
+            if len(parts) == 2:
+                color = _parse_color(parts[1]) + (255,)
+            else:
+                color = tuple(int(c) for c in parts[1:4]) + ((int(parts[4]),) if len(parts) > 4 else (255,))
+            entries.append((value, color))
+    return entries
+
+
+def _apply_color_scale(data, color_scale, interpolate=True, no_data=None):
+    """
+    Colour a 2D array with a `gdaldem color-relief` compatible colour table, returning an RGBA uint8 array.
+    Values are linearly interpolated between entries (or the nearest entry is used if `interpolate` is False)
+    and clamped to the first and last entries. No data pixels take the 'nv' colour or are transparent black.
+    """
+    data = np.asarray(data, dtype=np.float64)
+    invalid = np.isnan(data)
+    if no_data is not None:
+        invalid |= data == no_data
+    valid = data[~invalid]
+    data_min, data_max = (valid.min(), valid.max()) if valid.size else (0.0, 0.0)
+
+    nv_color = (0, 0, 0, 0)
+    points = []
+    for value, color in _read_color_scale(color_scale):
+        if value == 'nv':
+            nv_color = color
+            continue
+        if isinstance(value, str):
+            value = data_min + float(value[:-1]) / 100.0 * (data_max - data_min)
+        points.append((value, color))
+    if not points:
+        raise ValueError(f"The color scale {color_scale} has no value entries.")
+    points.sort(key=lambda point: point[0])
+    values = np.array([point[0] for point in points], dtype=np.float64)
+    colors = np.array([point[1] for point in points], dtype=np.float64)
+
+    rgba = np.empty(data.shape + (4,), dtype=np.uint8)
+    filled = np.where(invalid, values[0], data)
+    if interpolate:
+        for channel in range(4):
+            rgba[..., channel] = np.round(np.interp(filled, values, colors[:, channel]))
+    else:
+        idx = np.clip(np.searchsorted(values, filled), 1, len(values) - 1)
+        idx -= np.abs(filled - values[idx - 1]) <= np.abs(values[idx] - filled)
+        rgba[...] = colors[idx]
+    rgba[invalid] = nv_color
+    return rgba
+
+
+def write_image(path, image, driver=None):
+    """
+    Write an RGB or RGBA uint8 image (shaped rows x columns x bands) to a PNG or WebP file in-process.
+
+    Parameters
+    ----------
+    path: str
+        The path to write to. The format is taken from the extension unless `driver` is given.
+    image: np.ndarray
+        A uint8 array with 3 (RGB) or 4 (RGBA) bands in the last dimension.
+    driver: str
+        The GDAL driver to use, e.g. 'PNG' or 'WEBP'.
+    """
+    from rasterio.io import MemoryFile
+    from rasterio.shutil import copy
+
+    if driver is None:
+        driver = 'WEBP' if path.lower().endswith('.webp') else 'PNG'
+    height, width, count = image.shape
+    with MemoryFile() as memfile:
+        with memfile.open(driver='GTiff', height=height, width=width, count=count, dtype='uint8') as mem:
+            mem.write(np.moveaxis(image, -1, 0))
+            copy(mem, path, driver=driver)
+    # PNG/WebP drivers can leave a sidecar for the (non-existent) georeferencing.
+    if os.path.exists(path + '.aux.xml'):
+        os.remove(path + '.aux.xml')
 
 
 def write_png_from_xr(png_path, dataset, bands, png_filled_path=None, fill_color='red', scale=None, low_res=False,
                       no_data=-9999, crs="EPSG:4326"):
     """Write a rgb png from an xarray dataset.
-    Note that using `low_res==True` currently causes the file(s)
-    for `png_path` and `png_filled_path` to not be created.
 
     Args:
         png_path: path for the png to be written to.
@@ -309,33 +635,28 @@ def write_png_from_xr(png_path, dataset, bands, png_filled_path=None, fill_color
         png_filled_path: optional png with no_data values filled
         fill_color: color to use as the no_data fill
         scale: desired scale - tuple like (0, 4000) for the upper and lower bounds
+            or a list of three such tuples (one per band)
+        low_res: write the png at 25% of the resolution of `dataset`
 
     """
     assert isinstance(bands, list), "Bands must a list of strings"
     assert len(bands) == 3 and isinstance(bands[0], str), "You must supply three string bands for a PNG."
 
-    tif_path = os.path.join(os.path.dirname(png_path), str(uuid.uuid4()) + ".png")
-    write_geotiff_from_xr(tif_path, dataset, bands, no_data=no_data, crs=crs)
-
-    scale_string = ""
-    if scale is not None and len(scale) == 2:
-        scale_string = "-scale {} {} 0 255".format(scale[0], scale[1])
-    elif scale is not None and len(scale) == 3:
-        for index, scale_member in enumerate(scale):
-            scale_string += " -scale_{} {} {} 0 255".format(index + 1, scale_member[0], scale_member[1])
-    outsize_string = "-outsize 25% 25%" if low_res else ""
-    cmd = "gdal_translate -ot Byte " + outsize_string + " " + scale_string + " -of PNG -b 1 -b 2 -b 3 " + tif_path + ' ' + png_path
-
-    os.system(cmd)
+    if low_res:
+        # Decimate before loading, so only every 4th pixel is read.
+        dataset = dataset.isel({dim: slice(None, None, 4) for dim in dataset[bands[0]].dims})
+    band_scales = scale if scale is not None and len(scale) == 3 else [scale] * 3
+    rgb = np.dstack([_scale_to_byte(dataset[band].values, band_scale, no_data)
+                     for band, band_scale in zip(bands, band_scales)])
 
     if png_filled_path is not None and fill_color is not None:
-        cmd = "convert -transparent \"#000000\" " + png_path + " " + png_path
-        os.system(cmd)
-        cmd = "convert " + png_path + " -background " + \
-            fill_color + " -alpha remove " + png_filled_path
-        os.system(cmd)
-
-    os.remove(tif_path)
+        # Black is treated as no data - transparent in `png_path` and `fill_color` in `png_filled_path`.
+        black = (rgb == 0).all(axis=-1)
+        write_image(png_path, np.dstack([rgb, np.where(black, 0, 255).astype(np.uint8)]))
+        rgb[black] = _parse_color(fill_color)
+        write_image(png_filled_path, rgb)
+    else:
+        write_image(png_path, rgb)
 
 
 def write_single_band_png_from_xr(png_path, dataset, band, color_scale=None, fill_color=None, interpolate=True,
@@ -346,31 +667,83 @@ def write_single_band_png_from_xr(png_path, dataset, band, color_scale=None, fil
         png_path: path for the png to be written to.
         dataset: dataset to use for the png creation.
         band: The band to write to a png
-        png_filled_path: optional png with no_data values filled
         fill_color: color to use as the no_data fill
         color_scale: path to a color scale compatible with gdal.
+        interpolate: interpolate between color scale entries rather than using the nearest entry.
 
     """
     assert os.path.exists(color_scale), "Color scale must be a path to a text file containing a gdal compatible scale."
     assert isinstance(band, str), "Band must be a string."
 
-    tif_path = os.path.join(os.path.dirname(png_path), str(uuid.uuid4()) + ".png")
-    write_geotiff_from_xr(tif_path, dataset, [band], no_data=no_data, crs=crs)
+    rgb = _apply_color_scale(dataset[band].values, color_scale, interpolate=interpolate, no_data=no_data)[..., :3]
 
-    cmd = "gdaldem color-relief -of PNG -b 1 " + tif_path + " " + \
-        color_scale + " " + png_path
-    os.system(cmd)
+    if fill_color is not None:
+        # White is treated as no data - transparent, or filled with `fill_color`.
+        white = (rgb == 255).all(axis=-1)
+        if fill_color != "transparent":
+            rgb[white] = _parse_color(fill_color)
+        else:
+            rgb = np.dstack([rgb, np.where(white, 0, 255).astype(np.uint8)])
+
+    write_image(png_path, rgb)
+
+
+def render_quicklook(src_paths, out_path, scale='auto', color_scale=None, interpolate=True, max_size=1024,
+                     fill_color=None):
+    """
+    Render a quicklook (thumbnail) PNG or WebP directly from one or three (COG) rasters.
+    The rasters are read decimated, so only their overviews are fetched for COGs.
+
+    Parameters
+    ----------
+    src_paths: list of str
+        Paths or URLs of the rasters - three for an RGB image, or one for a pseudocolor image.
+    out_path: str
+        The path of the image to write (.png or .webp).
+    scale: tuple or list of tuple or 'auto'
+        The (min, max) range to stretch each band over, one per band, or 'auto' for a
+        2nd-98th percentile stretch. Ignored for pseudocolor images.
+    color_scale: str
+        Path to a gdal compatible color scale - required for single band quicklooks.
+    interpolate: bool
+        Interpolate between color scale entries rather than using the nearest entry.
+    max_size: int
+        The maximum width or height of the quicklook, in pixels.
+    fill_color: str
+        Color for no data pixels. By default, they are transparent.
+    """
+    from rasterio.enums import Resampling
+
+    assert len(src_paths) in [1, 3], "You must supply one or three rasters for a quicklook."
+    assert len(src_paths) == 3 or color_scale is not None, "Single band quicklooks require a color scale."
+
+    bands, no_data = [], None
+    for src_path in src_paths:
+        with rasterio.open(src_path) as src:
+            factor = max(1.0, max(src.width, src.height) / float(max_size))
+            out_shape = (max(1, int(src.height / factor)), max(1, int(src.width / factor)))
+            bands.append(src.read(1, out_shape=out_shape, resampling=Resampling.nearest))
+            no_data = src.nodata
+
+    if color_scale is not None:
+        rgba = _apply_color_scale(bands[0], color_scale, interpolate=interpolate, no_data=no_data)
+        invalid = rgba[..., 3] == 0
+    else:
+        band_scales = scale if isinstance(scale, (list, tuple)) and len(scale) == 3 else [scale] * 3
+        rgb = np.dstack([_scale_to_byte(band, band_scale, no_data) for band, band_scale in zip(bands, band_scales)])
+        invalid = np.zeros(rgb.shape[:2], dtype=np.bool_)
+        for band in bands:
+            invalid |= np.isnan(band) if band.dtype.kind == 'f' else False
+            if no_data is not None:
+                invalid |= band == no_data
+        rgba = np.dstack([rgb, np.where(invalid, 0, 255).astype(np.uint8)])
 
     if fill_color is not None:
-        cmd = "convert -transparent \"#FFFFFF\" " + \
-            png_path + " " + png_path
-        os.system(cmd)
-        if fill_color is not None and fill_color != "transparent":
-            cmd = "convert " + png_path + " -background " + \
-                fill_color + " -alpha remove " + png_path
-            os.system(cmd)
-
-    os.remove(tif_path)
+        rgba[invalid] = _parse_color(fill_color) + (255,)
+        rgba = rgba[..., :3]
+    write_image(out_path, rgba)
+    return out_path
+
 
 def _get_transform_from_xr(data, x_coord='longitude', y_coord='latitude'):
     """Create a geotransform from an xarray.Dataset or xarray.DataArray.
@@ -270,22 +270,14 @@ def wofs_classify(dataset_in, clean_mask=None, x_coord='longitude', y_coord='lat
 
     if enforce_float64:
         if dtype != 'float64':
-            blue.values = blue.values.astype('float64')
-            green.values = green.values.astype('float64')
-            red.values = red.values.astype('float64')
-            nir.values = nir.values.astype('float64')
-            swir1.values = swir1.values.astype('float64')
-            swir2.values = swir2.values.astype('float64')
+            for band in [blue, green, red, nir, swir1, swir2]:
+                utilities.nan_to_num_astype(band, None, 'float64')
     else:
         if dtype == 'float64':
             pass
         elif dtype != 'float32':
-            blue.values = blue.values.astype('float32')
-            green.values = green.values.astype('float32')
-            red.values = red.values.astype('float32')
-            nir.values = nir.values.astype('float32')
-            swir1.values = swir1.values.astype('float32')
-            swir2.values = swir2.values.astype('float32')
+            for band in [blue, green, red, nir, swir1, swir2]:
+                utilities.nan_to_num_astype(band, None, 'float32')
 
     shape = blue.values.shape
     classified = _run_regression(blue.values, green.values, red.values, nir.values, swir1.values, swir2.values)
@@ -203,16 +203,31 @@ def yaml_prep_water(scene_dir, original_yml):
     }
 
 
+def mlwater_scene_name(img_yml_path):
+    """
+    Name of the ml water product of a scene, as used for its prepared output directory.
+    Assumes dirname of yml references name of the scene.
+    """
+    return os.path.dirname(img_yml_path).split('/')[-1] + '_mlwater'
+
+
 def genprepmlwater(img_yml_path, lab_yml_path,
                    inter_dir='../tmp/data/intermediate/',
                    s3_bucket='public-eo-data',
-                   s3_dir='common_sensing/fiji/mlwater_test/'):
+                   s3_dir='common_sensing/fiji/mlwater_test/',
+                   force=False):
     """
     optical_yaml_path: dc yml metadata of single image within S3 bucket
     summary_yaml_path: dc yml metadata of wofs-like summary product within S3 bucket
+    force: prepare the scene even if it is already prepared in s3_dir
     """
 
     scene_name = os.path.dirname(img_yml_path).split('/')[-1]
+
+    # Nothing to do if already prepared
+    status = skip_if_prepared(mlwater_scene_name(img_yml_path), s3_bucket, s3_dir, force)
+    if status is not None:
+        return status
         
     inter_dir = f"{inter_dir}{scene_name}_tmp/"
     os.makedirs(inter_dir, exist_ok=True)
@@ -249,7 +264,9 @@ def genprepmlwater(img_yml_path, lab_yml_path,
             root.info(f"{scene_name} Found & access yamls")
         except:
             root.exception(f"{scene_name} Yaml or band files can't be found")
-            raise Exception('Streaming Error')
+            raise RetryableError('Streaming Error')
+
+        pipeline_stage('process')
 
         try:
             root.info(f"{scene_name} Loading & Reformatting bands")
@@ -366,8 +383,8 @@ def genprepmlwater(img_yml_path, lab_yml_path,
             out_prob_prod = inter_prodir + scene_name + '_waterprob.tif'
             output_crs = xr_data.rio.crs
 
-            export_xarray_to_geotiff(X_t, out_mask_prod, bands=['water_mask'], crs=output_crs, x_coord='x', y_coord='y', no_data=-9999)
-            export_xarray_to_geotiff(X_t, out_prob_prod, bands=['water_prob'], crs=output_crs, x_coord='x', y_coord='y', no_data=-9999)
+            export_xarray_to_geotiff(X_t, out_mask_prod, bands=['water_mask'], crs=output_crs, x_coord='x', y_coord='y', no_data=-9999, cog=True)
+            export_xarray_to_geotiff(X_t, out_prob_prod, bands=['water_prob'], crs=output_crs, x_coord='x', y_coord='y', no_data=-9999, cog=True)
         except:
             root.exception(f"{scene_name} Water product export failed")
             raise Exception('Export error')
@@ -380,13 +397,14 @@ def genprepmlwater(img_yml_path, lab_yml_path,
             root.exception(f"{scene_name} yam not created")
             raise Exception('Yaml error')
             
+        pipeline_stage('upload')
         try:
             root.info(f"{scene_name} Uploading to S3 Bucket")
             # UPLOAD
             s3_upload_cogs(glob.glob(f'{inter_prodir}*'), s3_bucket, s3_dir)
         except:
             root.exception(f"{scene_name} Upload to S3 Failed")
-            raise Exception('S3  upload error')
+            raise RetryableError('S3  upload error')
 
         img_yml = None
         lab_yml = None
@@ -411,6 +429,7 @@ def genprepmlwater(img_yml_path, lab_yml_path,
 
         clean_up(inter_dir)
         print('not boo')
+        return job_status(scene_name)
 
     except Exception as e:
         logging.error(f"could not process {scene_name}, {e}", )
@@ -439,6 +458,7 @@ def genprepmlwater(img_yml_path, lab_yml_path,
 
         clean_up(inter_dir)
         print('boo')
+        return job_status(scene_name, e)
 
         
 if __name__ == '__main__':
@@ -30,47 +30,6 @@ def rename_bands(in_xr, des_bands, position):
     return in_xr
     
     
-def conv_sgl_wofs_cog(in_path, out_path, nodata=-9999):
-    """
-    Convert a single input file to COG format. Default settings via cogeo repository (funcs within prep_utils). 
-    COG val TBC
-    
-    :param in_path: path to non-cog file
-    :param out_path: path to new cog file
-    :return: 
-    """
-    print (in_path, out_path)    
-    # set default cog profile (as recommended by alex leith)
-    cog_profile = {
-        'driver': 'GTiff',
-        'interleave': 'pixel',
-        'tiled': True,
-        'blockxsize': 512,
-        'blockysize': 512,
-        'compress': 'DEFLATE',
-        'predictor': 2,
-        'zlevel': 9
-    }    
-        
-    cog_translate(
-        in_path,
-        out_path,
-        cog_profile,
-        overview_level=5,
-        overview_resampling='average'
-    )
-    
-#     ds = gdal.Open(in_path, gdal.GA_Update)
-#     if ds is not None:
-#         b = ds.GetRasterBand(1)
-#         b.SetNoDataValue(nodata)
-#         b.FlushCache()
-#         b = None
-#         ds = None 
-#     else:
-#         print ('not updated nodata')
-
-
 def yaml_prep_wofs(scene_dir, original_yml):
     """
     Prepare individual wofs directory containing L8/S2/S1 cog water products.
@@ -156,7 +115,15 @@ def resamp_bands(xr, xrs):
         return xr.interp(x=xrs[0]['x'], y=xrs[0]['y'])
     
     
-def per_scene_wofs(optical_yaml_path, s3_source=True, s3_bucket='public-eo-data', s3_dir='common_sensing/fiji/wofsdefault/', inter_dir='../tmp/data/intermediate/', aoi_mask=False):
+def wofs_scene_name(optical_yaml_path):
+    """
+    Name of the wofs product of a scene, as used for its prepared output directory.
+    Assumes dirname of yml references name of the scene - should hold true for all ard-workflows prepared scenes
+    """
+    return os.path.dirname(optical_yaml_path).split('/')[-1]
+
+
+def per_scene_wofs(optical_yaml_path, s3_source=True, s3_bucket='public-eo-data', s3_dir='common_sensing/fiji/wofsdefault/', inter_dir='../tmp/data/intermediate/', aoi_mask=False, force=False):
     """
     Generate and prepare wofs (and wofs-like) products for .
     Assumes all data can be found and downoaded using relative locations within yaml & dir name contains unique scene_name.
@@ -166,9 +133,16 @@ def per_scene_wofs(optical_yaml_path, s3_source=True, s3_bucket='public-eo-data'
     - generalise to s2 - should be easy
     - generalise to s1 - need to coalesce on approach (basic thresholding initially?)
     - check acknowledgements
+
+    Skips scenes already prepared in s3_dir unless force is True.
     """
     # Assume dirname of yml references name of the scene - should hold true for all ard-workflows prepared scenes
-    scene_name = os.path.dirname(optical_yaml_path).split('/')[-1]
+    scene_name = wofs_scene_name(optical_yaml_path)
+
+    # Nothing to do if already prepared
+    status = skip_if_prepared(scene_name, s3_bucket, s3_dir, force)
+    if status is not None:
+        return status
     
     inter_dir = f"{inter_dir}{scene_name}_tmp/"
     os.makedirs(inter_dir, exist_ok=True)
@@ -219,8 +193,10 @@ def per_scene_wofs(optical_yaml_path, s3_source=True, s3_bucket='public-eo-data'
             root.info(f"{scene_name} Found & Downloaded yml & data")
         except:
             root.exception(f"{scene_name} Yaml or band files can't be found")
-            raise Exception('Download Error')
+            raise RetryableError('Download Error')
     
+        pipeline_stage('process')
+
         try:
             root.info(f"{scene_name} Loading & Reformatting bands")
             # data loading pre-requisite xarray format for applying mask + wofs classifier
@@ -292,16 +268,13 @@ def per_scene_wofs(optical_yaml_path, s3_source=True, s3_bucket='public-eo-data'
         try:
             root.info(f"{scene_name} Exporting water product")            
             dataset_to_output = water_classes
-            if 'MSIL2A' in inter_dir:
-                output_file_name = f'{inter_dir}{"_".join(yml_meta["image"]["bands"]["blue"]["path"].split("_")[:4])}_waternc.tif' # can't
-            else:
-                output_file_name = f'{inter_dir}{"_".join(yml_meta["image"]["bands"]["blue"]["path"].split("_")[:7])}_waternc.tif' # can't write directly to cog...(?)
-            export_xarray_to_geotiff(dataset_to_output, output_file_name, x_coord='x', y_coord='y', crs=bands_data.attrs['crs'])
             if 'MSIL2A' in inter_dir:
                 output_cog_name = f'{cog_dir}{"_".join(yml_meta["image"]["bands"]["blue"]["path"].split("_")[:4])}_water.tif'
             else:
                 output_cog_name = f'{cog_dir}{"_".join(yml_meta["image"]["bands"]["blue"]["path"].split("_")[:7])}_water.tif'
-            conv_sgl_wofs_cog(output_file_name, output_cog_name)
+            # written straight to cog - no intermediate _waternc.tif to re-read. no_data=None as cog_translate
+            # dropped the nodata tag, so -9999 stays a plain value in the product
+            export_xarray_to_geotiff(dataset_to_output, output_cog_name, x_coord='x', y_coord='y', crs=bands_data.attrs['crs'], no_data=None, cog=True)
             root.info(f"{scene_name} Exported COG water product")
         except:
             root.exception(f"{scene_name} Water product export failed")
@@ -315,13 +288,14 @@ def per_scene_wofs(optical_yaml_path, s3_source=True, s3_bucket='public-eo-data'
             root.exception(f"{scene_name} yam not created")
             raise Exception('Yaml error')
 
+        pipeline_stage('upload')
         try:
             root.info(f"{scene_name} Uploading to S3 Bucket")
             s3_upload_cogs(glob.glob(f'{cog_dir}*'), s3_bucket, s3_dir)
             root.info(f"{scene_name} Uploaded to S3 Bucket")
         except:
             root.exception(f"{scene_name} Upload to S3 Failed")
-            raise Exception('S3  upload error')
+            raise RetryableError('S3  upload error')
 
         root.removeHandler(handler)
         handler.close()
@@ -346,18 +320,22 @@ def per_scene_wofs(optical_yaml_path, s3_source=True, s3_bucket='public-eo-data'
             print(out)
                 
         print('not boo')
+        return job_status(scene_name)
 
             
-    except:
-        print('boo')
+    except Exception as e:
         root.exception("Processing INCOMPLETE so tidying up")
         root.removeHandler(handler)
         handler.close()
 
-        shutil.move(log_file, cog_dir + 'log_file.txt')
-        
-        s3_upload_cogs(glob.glob(cog_dir + '*log_file.txt'), s3_bucket, s3_dir)        
-                
+        try:
+            shutil.move(log_file, cog_dir + 'log_file.txt')
+            s3_upload_cogs(glob.glob(cog_dir + '*log_file.txt'), s3_bucket, s3_dir)
+        except Exception:
+            root.exception(f"{scene_name} log file not uploaded")
+
         cmd = 'rm -frv {}'.format(inter_dir)
         p   = Popen(cmd, shell=True, stdin=PIPE, stdout=PIPE, stderr=STDOUT, close_fds=True)
-        out = p.stdout.read()
\ No newline at end of file
+        out = p.stdout.read()
+
+        return job_status(scene_name, e)
\ No newline at end of file
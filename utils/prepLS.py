@@ -304,13 +304,28 @@ def yaml_prep_landsat(scene_dir):
     }
 
 
+def ls_scene_name(in_scene):
+    """
+    Short name of a Landsat scene, as used for its prepared output directory.
+
+    :param in_scene: url of the ESPA order download i.e. ".../LC080750722019010401T1-SC20190211152221.tar.gz"
+    :return: scene name i.e. "LC08_L1TP_075072_20190104"
+    """
+    down_basename = split_all(in_scene)[-1]
+    return f"{down_basename[:4]}_L1TP_{down_basename[4:10]}_{down_basename[10:18]}"
+
+
 def prepareLS(in_scene, s3_bucket='cs-odc-data', s3_dir='common_sensing/fiji/default',
-              inter_dir='/tmp/data/intermediate/', prodlevel='L2A'):
+              inter_dir='/tmp/data/intermediate/', prodlevel='L2A', force=False):
     root = setup_logging()
 
     ls_url = in_scene
     down_basename = split_all(ls_url)[-1]
-    scene_name = f"{down_basename[:4]}_L1TP_{down_basename[4:10]}_{down_basename[10:18]}"
+    scene_name = ls_scene_name(in_scene)
+    # Nothing to do if already prepared
+    status = skip_if_prepared(scene_name, s3_bucket, s3_dir, force)
+    if status is not None:
+        return status
     inter_dir = f"{inter_dir}{scene_name}_tmp/"
     os.makedirs(inter_dir, exist_ok=True)
     down_tar = f"{inter_dir}{down_basename}"
@@ -330,7 +345,9 @@ def prepareLS(in_scene, s3_bucket='cs-odc-data', s3_dir='common_sensing/fiji/def
             root.info(f"{scene_name} DOWNLOADed + EXTRACTED")
         except Exception as e:
             root.exception(f"{scene_name} CANNOT BE FOUND")
-            raise Exception('Download Error', e)
+            raise RetryableError('Download Error', e)
+
+        pipeline_stage('process')
 
         try:
             root.info(f"{scene_name} Converting COGs")
@@ -356,19 +373,22 @@ def prepareLS(in_scene, s3_bucket='cs-odc-data', s3_dir='common_sensing/fiji/def
             root.exception(f"{scene_name} yaml not created {e}")
             raise Exception('Yaml error', e)
 
+        pipeline_stage('upload')
         try:
             root.info(f"{scene_name} Uploading to S3 Bucket")
             s3_upload_cogs(glob.glob(cog_dir + '*'), s3_bucket, s3_dir)
             root.info(f"{scene_name} Uploaded to S3 Bucket")
         except Exception as e:
             root.exception(f"{scene_name} Upload to S3 Failed")
-            raise Exception('S3  upload error', e)
+            raise RetryableError('S3  upload error', e)
 
         clean_up(inter_dir)
+        return job_status(scene_name)
 
     except Exception as e:
         logging.error(f"Could not process {scene_name}, {e}")
         clean_up(inter_dir)
+        return job_status(scene_name, e)
 
 
 if __name__ == '__main__':
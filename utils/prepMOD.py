@@ -159,14 +159,29 @@ def yaml_prep_MCD43A4(scene_dir):
     }
 
 
+def mod_scene_name(in_scene):
+    """
+    Short name of a MODIS granule, as used for its prepared output directory.
+
+    :param in_scene: input MODIS granule i.e. "MCD43A4.A2020008.h00v08.006.2020017034128.hdf"
+    :return: scene name i.e. "MCD43A4_A2020008_h00v08"
+    """
+    return '_'.join(in_scene.split('/')[-1].replace('.','_').split('_')[0:3])
+
+
 def prepareMOD(in_scene, 
                s3_bucket='public-eo-data', 
                s3_dir='common_sensing/fiji/default',
-               inter_dir='/tmp/data/intermediate/'):
+               inter_dir='/tmp/data/intermediate/',
+               force=False):
     
     root = setup_logging()
 
-    scene_name = '_'.join(in_scene.split('/')[-1].replace('.','_').split('_')[0:3])
+    scene_name = mod_scene_name(in_scene)
+    # Nothing to do if already prepared
+    status = skip_if_prepared(scene_name, s3_bucket, s3_dir, force)
+    if status is not None:
+        return status
     inter_dir = "/tmp/data/intermediate/"
     os.makedirs(inter_dir, exist_ok=True)
     down_path = os.path.join(inter_dir, in_scene)
@@ -184,7 +199,9 @@ def prepareMOD(in_scene,
             root.info(f"{scene_name} DOWNLOADED")
         except Exception as e:
             root.exception(f"{scene_name} CANNOT BE FOUND")
-            raise Exception('Download Error', e)
+            raise RetryableError('Download Error', e)
+
+        pipeline_stage('process')
 
         try:
             root.info(f"{scene_name} Converting COGs")
@@ -202,19 +219,22 @@ def prepareMOD(in_scene,
             root.exception(f"{scene_name} yaml not created {e}")
             raise Exception('Yaml error', e)
 
+        pipeline_stage('upload')
         try:
             root.info(f"{scene_name} Uploading to S3 Bucket")
             s3_upload_cogs(glob.glob(cog_dir + '*'), s3_bucket, s3_dir)
             root.info(f"{scene_name} Uploaded to S3 Bucket")
         except Exception as e:
             root.exception(f"{scene_name} Upload to S3 Failed")
-            raise Exception('S3  upload error', e)
+            raise RetryableError('S3  upload error', e)
 
         clean_up(inter_dir)
+        return job_status(scene_name)
 
     except Exception as e:
         logging.error(f"Could not process {scene_name}, {e}")
 #         clean_up(inter_dir)
+        return job_status(scene_name, e)
 
 
 if __name__ == '__main__':
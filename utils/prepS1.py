@@ -17,6 +17,12 @@ from utils.prep_utils import *
 cookie_jar_path = os.path.join(os.path.expanduser('~'), ".bulk_download_cookiejar.txt")
 cookie_jar = MozillaCookieJar()
 
+# Members of a S1 .SAFE zip that SNAP reads - skips the quick-looks and pdf report
+S1_SAFE_MEMBERS = r'manifest\.safe$|/(annotation|measurement|support)/'
+
+# ASF download urls are cached (see prep_utils.redis_cache) for a week, keyed "asf_url:<scene>"
+ASF_URL_CACHE_TTL_SECS = 7 * 24 * 3600
+
 
 def get_asf_cookie(user, password):
     logging.info("logging into asf")
@@ -84,21 +90,48 @@ def get_s1_asf_urls(s1_name_list):
     return df.loc[df['Processing Level'] == 'GRD_HD']
 
 
+def cache_s1_asf_urls(s1_name_list, db=None, ttl_secs=ASF_URL_CACHE_TTL_SECS):
+    """
+    Resolve the ASF download urls of S1_NAME_LIST in batches (see get_s1_asf_urls) and cache them,
+    so that prepareS1 jobs don't each query the ASF search API. Run by the producer.
+
+    :param s1_name_list: Sentinel-1 scene names, with or without .SAFE
+    :param db: redis connection to cache in, defaults to prep_utils.redis_cache()
+    :return: number of urls cached
+    """
+    s1_names = [s1_name[:-5] if s1_name.endswith('.SAFE') else s1_name for s1_name in s1_name_list]
+    if not s1_names:
+        return 0
+    df = get_s1_asf_urls(s1_names)
+    urls = {f"asf_url:{s1_name}": s1url for s1_name, s1url in zip(df['Granule Name'], df['URL'])}
+    cache_set(urls, ttl_secs, db)
+    logging.info(f"cached {len(urls)} of {len(s1_names)} asf urls")
+    return len(urls)
+
+
 def get_s1_asf_url(s1_name, retry=3):
     """
-    Finds Alaska Satellite Facility download url for single S1_NAME Sentinel-1 scene. 
+    Finds Alaska Satellite Facility download url for single S1_NAME Sentinel-1 scene, 
+    from the url cache (see cache_s1_asf_urls) if it is there. 
 
     :param s1_name: Scene ID for Sentinel Tile (i.e. "S1A_IW_SLC__1SDV_20190411T063207_20190411T063242_026738_0300B4_6882")
     :param retry: number of times to retry
     :return s1url:download url
     :return False: unable to find url
     """
+    s1url = cache_get(f"asf_url:{s1_name}")
+    if s1url:
+        logging.info(f"cached asf url: {s1url}")
+        return s1url
+
     logging.info(f"fetching: https://api.daac.asf.alaska.edu/services/search/param?granule_list={s1_name}&output=csv")
     try:
-        return pd \
+        s1url = pd \
             .read_csv(f"https://api.daac.asf.alaska.edu/services/search/param?granule_list={s1_name}&output=csv") \
             .URL \
             .values[0]
+        cache_set({f"asf_url:{s1_name}": s1url}, ASF_URL_CACHE_TTL_SECS)
+        return s1url
     except HTTPError as e:
         logging.debug(f"could not query: {e}", )
         if e.code == 503 and retry > 0:
@@ -110,23 +143,25 @@ def get_s1_asf_url(s1_name, retry=3):
         return 'NaN'
 
 
-def get_asf_file(url, output_path, chunk_size=16 * 1024):  # 8 kb default
-    context = {}
-    opener = build_opener(HTTPCookieProcessor(cookie_jar), HTTPHandler(), HTTPSHandler(**context))
-    request = Request(url)
-    response = opener.open(request)
+_asf_session = None
+
 
-    with open(output_path, "wb") as f:
-        while True:
-            chunk = response.read(chunk_size)
-            if not chunk:
-                break
-            f.write(chunk)
+def asf_session():
+    """
+    Session for ASF downloads, authenticated by the ASF cookie (see get_asf_cookie) and reused
+    so connections are pooled across scenes and download segments.
+    """
+    global _asf_session
+    if _asf_session is None:
+        _asf_session = new_http_session(cookies=cookie_jar)
+    return _asf_session
 
 
 def download_extract_s1_scene_asf(s1_name, download_dir):
     """
-    Downloads single S1_NAME Sentinel-1 scene into DOWLOAD_DIR. 
+    Downloads single S1_NAME Sentinel-1 scene into DOWLOAD_DIR, extracting the S1_SAFE_MEMBERS
+    as the .zip downloads. Interrupted range requests resume and the throughput is logged (see
+    fetch_extract_zip).
 
     :param s1_name: Scene ID for Sentinel Tile (i.e. "S1A_IW_SLC__1SDV_20190411T063207_20190411T063242_026738_0300B4_6882")
     :param download_dir: path to directory for downloaded S1 granule
@@ -152,14 +187,14 @@ def download_extract_s1_scene_asf(s1_name, download_dir):
     if not check_cookie_is_logged_in(cookie_jar):
         get_asf_cookie(asf_user, asf_pwd)
 
-    if not os.path.exists(zipped) & (not os.path.exists(safe_dir)):
-        get_asf_file(s1url, zipped)
-
     if not os.path.exists(safe_dir):
-        logging.info('Extracting ASF scene: {}'.format(zipped))
-        zip_ref = zipfile.ZipFile(zipped, 'r')
-        zip_ref.extractall(os.path.dirname(download_dir))
-        zip_ref.close()
+        if os.path.exists(zipped):
+            logging.info('Extracting ASF scene: {}'.format(zipped))
+            extract_zip(zipped, os.path.dirname(download_dir), S1_SAFE_MEMBERS)
+        else:
+            logging.info('Downloading and extracting ASF scene: {}'.format(s1url))
+            fetch_extract_zip(requests_opener(asf_session(), s1url, timeout=60), os.path.dirname(download_dir),
+                              S1_SAFE_MEMBERS, name=s1_name)
 
 
 def find_s1_uuid(s1_filename):
@@ -187,6 +222,8 @@ def download_extract_s1_esa(scene_uuid, down_dir, original_scene_dir):
     Download a single S2 scene from ESA via sentinelsat 
     based upon uuid. 
     Assumes esa hub creds stored as env variables.
+    Online products are extracted (S1_SAFE_MEMBERS only) as they download, without staging the .zip,
+    and checked against the product's MD5 as sentinelsat's download does.
     
     :param scene_uuid: S2 download uuid from sentinelsat query
     :param down_dir: directory in which to create a downloaded product dir
@@ -198,18 +235,24 @@ def download_extract_s1_esa(scene_uuid, down_dir, original_scene_dir):
 
         # if downloaded .zip file doesn't exist then download it
         if not os.path.exists(original_scene_dir.replace('.SAFE/', '.zip')):
-            logging.info('Downloading ESA scene zip: {}'.format(os.path.basename(original_scene_dir)))
-
             copernicus_username = os.getenv("COPERNICUS_USERNAME")
             copernicus_pwd = os.getenv("COPERNICUS_PWD")
             logging.debug(f"ESA username: {copernicus_username}")
             esa_api = SentinelAPI(copernicus_username, copernicus_pwd)
+            product = esa_api.get_product_odata(scene_uuid)
+
+            if product.get('Online', True):
+                logging.info('Downloading and extracting ESA scene: {}'.format(original_scene_dir))
+                fetch_extract_zip(requests_opener(esa_api.session, product['url']), os.path.dirname(down_dir),
+                                  S1_SAFE_MEMBERS, md5=product.get('md5'))
+                return
+
+            # offline products need retrieving from the long term archive first
+            logging.info('Downloading ESA scene zip: {}'.format(os.path.basename(original_scene_dir)))
             esa_api.download(scene_uuid, down_dir, checksum=True)
         # extract downloaded .zip file
         logging.info('Extracting ESA scene: {}'.format(original_scene_dir))
-        zip_ref = zipfile.ZipFile(original_scene_dir.replace('.SAFE/', '.zip'), 'r')
-        zip_ref.extractall(os.path.dirname(down_dir))
-        zip_ref.close()
+        extract_zip(original_scene_dir.replace('.SAFE/', '.zip'), os.path.dirname(down_dir), S1_SAFE_MEMBERS)
 
     else:
         logging.warning('ESA scene already extracted: {}'.format(original_scene_dir))
@@ -380,7 +423,8 @@ def prepareS1(
         s3_bucket='public-eo-data',
         s3_dir='common_sensing/sentinel_1/',
         inter_dir='/tmp/data/intermediate/',
-        source='asf'
+        source='asf',
+        force=False
 ):
     """
     Prepare IN_SCENE of Sentinel-1 satellite data into OUT_DIR for ODC indexing.
@@ -389,7 +433,8 @@ def prepareS1(
     :param out_dir: output directory to drop COGs into.
     :param --inter: optional intermediary directory to be used for processing.
     :param --source: Api source to be used for downloading scenes. Defaults to gcloud. Options inc. 'gcloud', 'esahub', 'sedas' COMING SOON
-    :return: None
+    :param force: prepare the scene even if it is already prepared in s3_dir
+    :return: dict of the scene name, status and error (see job_status)
 
     Assumptions:
     - etc.... tbd
@@ -399,7 +444,12 @@ def prepareS1(
     if not in_scene.endswith('.SAFE'):
         in_scene = in_scene + '.SAFE'
     # shorten scene name
-    scene_name = in_scene[:32]
+    scene_name = s1_scene_name(in_scene)
+
+    # Nothing to do if already prepared
+    status = skip_if_prepared(scene_name, s3_bucket, s3_dir, force)
+    if status is not None:
+        return status
 
     # Unique inter_dir needed for clean-up
     inter_dir = inter_dir + scene_name + '_tmp/'
@@ -448,7 +498,9 @@ def prepareS1(
                 root.info(f"{in_scene} {scene_name} DOWNLOADED via ESA")
             except Exception as e:
                 root.exception(f"{in_scene} {scene_name} UNAVAILABLE via ESA too")
-                raise Exception('Download Error ESA', e)
+                raise RetryableError('Download Error ESA', e)
+        pipeline_stage('process')
+
         # Figure out what bands are available.
         bands = available_bands(in_scene)
         cmd = [
@@ -465,9 +517,9 @@ def prepareS1(
 
         if not os.path.exists(out_prod1):
             if ext_dem:
-                # inc. function to subset by S1 scene extent on fly due to cog
-                print(ext_dem)
-                s3_download(s3_bucket, ext_dem, ext_dem_path)
+                # subset by S1 scene extent on fly due to cog
+                root.info(f"{in_scene} {scene_name} Subsetting {ext_dem}")
+                s3_subset_dem(s3_bucket, ext_dem, s1_footprint(input_mani), ext_dem_path)
 
                 cmd = [
                     snap_gpt,
@@ -533,22 +585,25 @@ def prepareS1(
             raise Exception('YAML creation error', e)
 
             # MOVE COG DIRECTORY TO OUTPUT DIRECTORY
+        pipeline_stage('upload')
         try:
             root.info(f"{in_scene} {scene_name} Uploading to S3 Bucket")
             s3_upload_cogs(glob.glob(os.path.join(cog_dir, '*')), s3_bucket, s3_dir)
             root.info(f"{in_scene} {scene_name} Uploaded to S3 Bucket")
         except Exception as e:
             root.exception(f"{in_scene} {scene_name} Upload to S3 Failed")
-            raise Exception('S3  upload error', e)
+            raise RetryableError('S3  upload error', e)
         print('not boo')
        # DELETE ANYTHING WITHIN THE TEMP DIRECTORY
 
         clean_up(inter_dir)
+        return job_status(scene_name)
 
     except Exception as e:
         logging.error(f"could not process {scene_name} {e}")
         print('boo')
         clean_up(inter_dir)
+        return job_status(scene_name, e)
 
 
 if __name__ == '__main__':
@@ -13,118 +13,27 @@ import uuid
 from sentinelsat import SentinelAPI
 
 from utils.prep_utils import *
+# ASF login, url lookup (and its cache) and download session are shared with prepS1, so the
+# cookie and the "asf_url:<scene>" cache entries are the same for both.
+from utils.prepS1 import cookie_jar, get_asf_cookie, check_cookie_is_logged_in, get_s1_asf_urls, \
+    get_s1_asf_url, asf_session
 
 from utils.s1am.raw2ard import Raw2Ard
 
-cookie_jar_path = os.path.join( os.path.expanduser('~'), ".bulk_download_cookiejar.txt")
-cookie_jar = MozillaCookieJar()
 
-
-def get_asf_cookie(user, password):
-
-    logging.info("logging into asf")
-
-    login_url = "https://urs.earthdata.nasa.gov/oauth/authorize"
-    client_id = "BO_n7nTIlMljdvU6kRRB3g"
-    redirect_url = "https://auth.asf.alaska.edu/login"
-
-    user_pass = base64.b64encode(bytes(user + ":" + password, "utf-8"))
-    user_pass = user_pass.decode("utf-8")
-
-    auth_cookie_url = f"{login_url}?client_id={client_id}&redirect_uri={redirect_url}&response_type=code&state="
-    context = {}
-    opener = build_opener(HTTPCookieProcessor(cookie_jar), HTTPHandler(), HTTPSHandler(**context))
-    request = Request(auth_cookie_url, headers={"Authorization": "Basic {0}".format(user_pass)})
-
-    try:
-        response = opener.open(request)
-    except HTTPError as e:
-        if e.code == 401:
-            logging.error("invalid username and password")
-            return False
-        else:
-            # If an error happens here, the user most likely has not confirmed EULA.
-            logging.error(f"Could not log in. {e.code} {e.response}")
-            return False
-
-    if check_cookie_is_logged_in(cookie_jar):
-        # COOKIE SUCCESS!
-        cookie_jar.save(cookie_jar_path)
-        logging.info("successfully logged into asf")
-        return True
-
-    logging.info("failed logging into asf")
-    return False
-
-
-def check_cookie_is_logged_in(cj):
-    for cookie in cj:
-        if cookie.name == 'urs_user_already_logged':
-            # Only get this cookie if we logged in successfully!
-            return True
-
-    return False
-
-
-def get_s1_asf_urls(s1_name_list):
-    df = pd.DataFrame()
-
-    num_parts = math.ceil(len(s1_name_list) / 119)
-    s1_name_lists = numpy.array_split(numpy.array(s1_name_list), num_parts)
-    logging.debug([len(l) for l in s1_name_lists])
-
-    for l in s1_name_lists:
-        try:
-            df = df.append(
-                pd.read_csv(
-                    f"https://api.daac.asf.alaska.edu/services/search/param?granule_list={','.join(l)}&output=csv"
-                ),
-                ignore_index=True
-            )
-        except Exception as e:
-            logging.error(e)
-
-    return df.loc[df['Processing Level'] == 'GRD_HD']
-
-
-def get_s1_asf_url(s1_name, retry=3):
+def get_asf_file(url, output_path, segments=None):
     """
-    Finds Alaska Satellite Facility download url for single S1_NAME Sentinel-1 scene. 
+    Download an ASF url to OUTPUT_PATH in parallel range segments, resuming on failure (see download_file).
 
-    :param s1_name: Scene ID for Sentinel Tile (i.e. "S1A_IW_SLC__1SDV_20190411T063207_20190411T063242_026738_0300B4_6882")
-    :param retry: number of times to retry
-    :return s1url:download url
-    :return False: unable to find url
+    :param segments: number of concurrent segments, defaults to ASF_DOWNLOAD_SEGMENTS env var or 4
+    :return: dict of bytes, secs and bytes_per_sec achieved - logged too, for tuning segments per site
     """
-    logging.info(f"fetching: https://api.daac.asf.alaska.edu/services/search/param?granule_list={s1_name}&output=csv")
-    try:
-        return pd \
-            .read_csv(f"https://api.daac.asf.alaska.edu/services/search/param?granule_list={s1_name}&output=csv") \
-            .URL \
-            .values[0]
-    except HTTPError as e:
-        logging.debug(f"could not query: {e}", )
-        if e.code == 503 and retry > 0:
-            logging.info("retrying...")
-            return get_s1_asf_url(s1_name, retry - 1)
-        return 'NaN'
-    except Exception as e:
-        logging.debug(f"could not query: {e}")
-        return 'NaN'
-
-
-def get_asf_file(url, output_path, chunk_size=16*1024):  # 8 kb default
-    context = {}
-    opener = build_opener(HTTPCookieProcessor(cookie_jar), HTTPHandler(), HTTPSHandler(**context))
-    request = Request(url)
-    response = opener.open(request)
-
-    with open(output_path, "wb") as f:
-        while True:
-            chunk = response.read(chunk_size)
-            if not chunk:
-                break
-            f.write(chunk)
+    segments = int(os.getenv("ASF_DOWNLOAD_SEGMENTS", "4")) if segments is None else segments
+    stats = download_file(url, output_path, session=asf_session(), segments=segments,
+                          chunk_bytes=4 * 1024 * 1024)
+    logging.info(f"ASF download {os.path.basename(output_path)}: {segments} segments, "
+                 f"{stats['bytes_per_sec'] / 1e6:.1f} MB/s")
+    return stats
 
 
 def download_extract_s1_scene_asf(s1_name, download_dir):
@@ -354,7 +263,7 @@ def yaml_prep_s1(scene_dir):
 
 
 def prepareS1AM(in_scene, chunks=24, ext_dem=True, s3_bucket='public-eo-data', s3_dir='common_sensing/sentinel_1/', inter_dir='/tmp/data/intermediate/',
-                source='asf'):
+                source='asf', force=False):
     """
     Prepare IN_SCENE of Sentinel-1 satellite data into OUT_DIR for ODC indexing. 
 
@@ -362,7 +271,8 @@ def prepareS1AM(in_scene, chunks=24, ext_dem=True, s3_bucket='public-eo-data', s
     :param out_dir: output directory to drop COGs into.
     :param --inter: optional intermediary directory to be used for processing.
     :param --source: Api source to be used for downloading scenes. Defaults to gcloud. Options inc. 'gcloud', 'esahub', 'sedas' COMING SOON
-    :return: None
+    :param force: prepare the scene even if it is already prepared in s3_dir
+    :return: dict of the scene name, status and error (see job_status)
     
     Assumptions:
     - etc.... tbd
@@ -372,7 +282,12 @@ def prepareS1AM(in_scene, chunks=24, ext_dem=True, s3_bucket='public-eo-data', s
     if not in_scene.endswith('.SAFE'):
         in_scene = in_scene + '.SAFE'
     # shorten scene name
-    scene_name = in_scene[:32]
+    scene_name = s1_scene_name(in_scene)
+
+    # Nothing to do if already prepared
+    status = skip_if_prepared(scene_name, s3_bucket, s3_dir, force)
+    if status is not None:
+        return status
 
     # Unique inter_dir needed for clean-up
     inter_dir = inter_dir + scene_name + '_tmp/'
@@ -425,7 +340,7 @@ def prepareS1AM(in_scene, chunks=24, ext_dem=True, s3_bucket='public-eo-data', s
                 root.info(f"{in_scene} {scene_name} DOWNLOADED via ESA")
             except Exception as e:
                 root.exception(f"{in_scene} {scene_name} UNAVAILABLE via ESA too")
-                raise Exception('Download Error ESA', e)
+                raise RetryableError('Download Error ESA', e)
 
         try:
             root.info(f"{in_scene} {scene_name} DOWNLOADING External DEMs")
@@ -434,14 +349,19 @@ def prepareS1AM(in_scene, chunks=24, ext_dem=True, s3_bucket='public-eo-data', s
             ext_dem_path_W = "common_sensing/ancillary_products/SRTM1Sec/SRTM30_Fiji_W.tif"
             ext_dem_E = f'{inter_dir}SRTM30_Fiji_E.tif'
             ext_dem_W = f'{inter_dir}SRTM30_Fiji_W.tif'
-            if not os.path.exists(ext_dem_path_E):
-                s3_download(s3_bucket, ext_dem_path_E, ext_dem_E)
-                s3_download(s3_bucket, ext_dem_path_W, ext_dem_W)
+            # subset each to its side of the scene, read from the zip. Raw2Ard only reads the DEM
+            # of the hemispheres the scene covers, so a half the scene misses is skipped.
+            aoi = s1_footprint(down_zip)
+            for ext_dem_path, ext_dem in ((ext_dem_path_E, ext_dem_E), (ext_dem_path_W, ext_dem_W)):
+                if s3_subset_dem(s3_bucket, ext_dem_path, aoi, ext_dem) is None:
+                    root.info(f"{in_scene} {scene_name} SKIPPED {ext_dem_path}, outside the scene")
             root.info(f"{in_scene} {scene_name} DOWNLOADED E+W DEMs")
         except Exception as e:
             root.exception(e)
             root.exception(f"{ext_dem_path_E} or {ext_dem_path_W} UNAVAILABLE")
         
+        pipeline_stage('process')
+
         try:
             root.info(f"{in_scene} {scene_name} Starting AM SNAP processing")        
             # Do AM Processing
@@ -481,22 +401,25 @@ def prepareS1AM(in_scene, chunks=24, ext_dem=True, s3_bucket='public-eo-data', s
             raise Exception('YAML creation error', e)
 
             # MOVE COG DIRECTORY TO OUTPUT DIRECTORY
+        pipeline_stage('upload')
         try:
             root.info(f"{in_scene} {scene_name} Uploading to S3 Bucket")
             s3_upload_cogs(glob.glob(os.path.join(cog_dir, '*')), s3_bucket, s3_dir)
             root.info(f"{in_scene} {scene_name} Uploaded to S3 Bucket")
         except Exception as e:
             root.exception(f"{in_scene} {scene_name} Upload to S3 Failed")
-            raise Exception('S3  upload error', e)
+            raise RetryableError('S3  upload error', e)
         print('not boo')
 
         # DELETE ANYTHING WITHIN THE TEMP DIRECTORY
         clean_up(inter_dir)
+        return job_status(scene_name)
 
     except Exception as e:
         logging.error(f"could not process {scene_name} {e}")
         print('boo')
         clean_up(inter_dir)
+        return job_status(scene_name, e)
 
 
 if __name__ == '__main__':
@@ -3,21 +3,132 @@ from sentinelsat import SentinelAPI
 import shutil
 from dateutil.parser import parse
 import glob
+import re
 import zipfile
 import uuid
 from subprocess import Popen, PIPE, STDOUT
+from concurrent.futures import ThreadPoolExecutor
+import base64
+import hashlib
+import threading
 
 from utils.prep_utils import *
 
+# Products converted to COGs, by product set. 'wofs' is the minimal set needed by WOfS (genprepWater).
+S2_PROD_SETS = {
+    'full': ["AOT_10m", "B01_60m", "B02_10m", "B03_10m", "B04_10m", "B05_20m", "B06_20m",
+             "B07_20m", "B08_10m", "B8A_20m", "B09_60m", "B11_20m", "B12_20m", "SCL_20m",
+             "WVP_10m"],
+    'wofs': ["B02_10m", "B03_10m", "B04_10m", "B08_10m", "B11_20m", "B12_20m", "SCL_20m"],
+}
+
+# Band name of each product in L1C and L2A scenes, as used in the prepared scene's yaml.
+S2_L1C_BAND_NAMES = {
+    "B01": 'coastal_aerosol',
+    "B02": 'blue',
+    "B03": 'green',
+    "B04": 'red',
+    "B05": 'vegetation_red_edge_1',
+    "B06": 'vegetation_red_edge_2',
+    "B07": 'vegetation_red_edge_3',
+    "B08": 'nir',
+    "B8A": 'vegetation_red_edge_4',
+    "B09": 'water_vapour',
+    "B10": 'swir_cirrus',
+    "B11": 'swir1',
+    "B12": 'swir2',
+    "TCI": 'true_colour'
+}
+S2_L2A_BAND_NAMES = {
+    "AOT_10m": 'aerosol_optical_thickness',
+    "B01_60m": 'coastal_aerosol',
+    "B02_10m": 'blue',
+    "B03_10m": 'green',
+    "B04_10m": 'red',
+    "B05_20m": 'vegetation_red_edge_1',
+    "B06_20m": 'vegetation_red_edge_2',
+    "B07_20m": 'vegetation_red_edge_3',
+    "B08_10m": 'nir',
+    "B8A_20m": 'vegetation_red_edge_4',
+    "B09_60m": 'water_vapour',
+    "B11_20m": 'swir1',
+    "B12_20m": 'swir2',
+    "SCL_20m": 'scene_classification',
+    "WVP_10m": 'wvp'
+}
+
+
+_gcs_client = None
+_gcs_client_lock = threading.Lock()
+
+
+def gcs_client():
+    """
+    Storage client for the public Sentinel-2 bucket, created once per process from the
+    GCP_CLIENT_EMAIL and GCP_PRIVATE_KEY env vars (anonymous if they are not set).
+    """
+    global _gcs_client
+    with _gcs_client_lock:
+        if _gcs_client is None:
+            if os.getenv("GCP_CLIENT_EMAIL"):
+                _gcs_client = storage.Client.from_service_account_info({
+                    "client_email": os.getenv("GCP_CLIENT_EMAIL"),
+                    # env var holds the key as it would appear in a credentials json, i.e. with escaped newlines
+                    "private_key": os.getenv("GCP_PRIVATE_KEY", "").replace('\\n', '\n'),
+                    "token_uri": "https://oauth2.googleapis.com/token"})
+            else:
+                _gcs_client = storage.Client.create_anonymous_client()
+        return _gcs_client
+
 
-def download_s2_granule_gcloud(s2_id, inter_dir, download_dir, safe_form=True, bands=False):
+def gcs_download_blob(blob, out_path, chunk_bytes=32 * 1024 * 1024, retries=3):
+    """
+    Download a GCS blob in chunks, resuming from the last complete chunk on error, then verify
+    it against the blob MD5. Downloads to out_path + '.part' and renames once verified.
+
+    :param blob: storage.Blob as listed (i.e. with size and md5_hash)
+    :param out_path: path to download to
+    :param chunk_bytes: size of each ranged request
+    :param retries: attempts per chunk
+    """
+    part_path = out_path + '.part'
+    with open(part_path, 'ab') as f:
+        offset = f.tell()
+        while offset < blob.size:
+            end = min(offset + chunk_bytes, blob.size) - 1
+            for attempt in range(retries):
+                try:
+                    blob.download_to_file(f, start=offset, end=end)
+                    break
+                except Exception:
+                    if attempt == retries - 1:
+                        raise
+                    logging.warning(f"{blob.name} chunk {offset}-{end} failed, retrying")
+                    f.seek(offset)
+                    f.truncate()
+                    sleep(2 ** attempt)
+            offset = f.tell()
+
+    if blob.md5_hash:
+        md5 = hashlib.md5()
+        with open(part_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                md5.update(chunk)
+        if base64.b64encode(md5.digest()).decode() != blob.md5_hash:
+            os.remove(part_path)
+            raise IOError(f"{blob.name} failed MD5 check")
+    os.replace(part_path, out_path)
+
+
+def download_s2_granule_gcloud(s2_id, inter_dir, download_dir, safe_form=True, bands=False, max_workers=8):
     """
     Downloads a single Sentinel-2 (L1C or L2A) acquisition from GCloud bucket into new S2ID directory
 
     :param s2_id: ID for Sentinel-2 Granule (i.e. "S2B_MSIL1C_20190815T110629_N0208_R137_T30UWB_20190815T135651")
     :param download_dir: path to dir for downloaded S2 granule dir to be created within (doesn't have to already exist)
     :param safe_form: download into .SAFE folder structure or single dir of .jp2s. default=True
-    :param bands: download only a subset of S2 bands. default is False. input is list i.e. ["B02.jp2", "B03.jp2"]
+    :param bands: download only a subset of S2 bands (plus MTD_*.xml metadata). default is False. input is list of file name endings i.e. ["B02.jp2", "B03.jp2"] or ["B02_10m.jp2"]
+    :param max_workers: number of blobs to download concurrently
     :return:
     """
     if s2_id.endswith('.SAFE'):
@@ -26,24 +137,9 @@ def download_s2_granule_gcloud(s2_id, inter_dir, download_dir, safe_form=True, b
     dir_name = download_dir
     if (not safe_form) & (not os.path.exists(dir_name)):
         os.makedirs(dir_name)
-    
-    tmpjson = f"{inter_dir}tmpcreds.json"
-    lines = ['{\n',
-     f'  "client_email": "{os.getenv("GCP_CLIENT_EMAIL")}",\n',
-     f'  "private_key": "{os.getenv("GCP_PRIVATE_KEY")}",\n',
-     '  "token_uri": "https://oauth2.googleapis.com/token"\n',
-     '}\n']
-    
-    with open(tmpjson, 'w') as cred:
-        for line in lines:
-            cred.write(line)
-    
-#     client = storage.Client.create_anonymous_client()
-    client = storage.Client.from_service_account_json(tmpjson)
-    bucket = client.bucket(bucket_name="gcp-public-data-sentinel-2")
 
-    os.remove(tmpjson)
-    
+    bucket = gcs_client().bucket(bucket_name="gcp-public-data-sentinel-2")
+
     identifiers = s2_id.split('_')[5]
     dir1 = identifiers[1:3]
     dir2 = identifiers[3]
@@ -57,15 +153,9 @@ def download_s2_granule_gcloud(s2_id, inter_dir, download_dir, safe_form=True, b
 
     # filter bands if needed
     if bands:
-        try:
-            des_blobs = []
-            for blob in blobs:
-                if blob.name[-7:] in bands:
-                    des_blobs.append(blob)
-            blobs = des_blobs
-        except:
-            logging.error('Bands either False or list. I.e. [B02.jp2, B03.jp2]')
+        blobs = [blob for blob in blobs if re.search(s2_member_pattern(bands), blob.name)]
 
+    downloads = []
     for blob in blobs:
         if not blob.name.endswith("$"):  # weird end directory signifier...
 
@@ -78,7 +168,42 @@ def download_s2_granule_gcloud(s2_id, inter_dir, download_dir, safe_form=True, b
                 os.makedirs(interdir, exist_ok=True)
                 name = os.path.join(dir_name + '/'.join(blob.name.split('/')[5:]))
 
-            blob.download_to_filename(name)
+            downloads.append((blob, name))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # list() re-raises the first download error
+        list(executor.map(lambda d: gcs_download_blob(*d), downloads))
+
+
+def s2_download_bands(in_scene, prodlevel='L2A', prods='full'):
+    """
+    Band file endings to download for a scene (see download_s2_granule_gcloud), so that only
+    the products we COG are fetched.
+
+    :param in_scene: input Sentinel-2 scene name (either L1C or L2A)
+    :param prodlevel: desired product level, as for prepareS2
+    :param prods: name of a product set in S2_PROD_SETS or list of products i.e. ["B02_10m", "SCL_20m"]
+    :return: list of band file endings, or False if the whole scene is needed (sen2cor needs every L1C band,
+             and full L1C scenes COG every band)
+    """
+    if isinstance(prods, str):
+        prods = S2_PROD_SETS[prods]
+    if '_MSIL2A_' in in_scene:
+        return [f"{prod}.jp2" for prod in prods]
+    if prodlevel == 'L2A' or prods == 'full':
+        return False
+    # L1C band files are named by band alone, and have no AOT, SCL or WVP products
+    return sorted({f"{prod[:3]}.jp2" for prod in prods if prod[0] == 'B'})
+
+
+def s2_member_pattern(bands=False):
+    """
+    Regex matching the SAFE files to download for BANDS (see s2_download_bands) plus the
+    MTD_*.xml metadata, or None if BANDS is False i.e. the whole scene is needed.
+    """
+    if not bands:
+        return None
+    return '|'.join(re.escape(band) + '$' for band in bands) + r'|(^|/)MTD_[^/]*\.xml$'
 
 
 def band_name_s2(prod_path):
@@ -92,48 +217,38 @@ def band_name_s2(prod_path):
     if prod_name.split('_')[1] == 'MSIL1C':
         logging.debug(prod_name)
         prod_name = prod_name.split('_')[-1][:-4]
-        prod_map = {
-            "B01": 'coastal_aerosol',
-            "B02": 'blue',
-            "B03": 'green',
-            "B04": 'red',
-            "B05": 'vegetation_red_edge_1',
-            "B06": 'vegetation_red_edge_2',
-            "B07": 'vegetation_red_edge_3',
-            "B08": 'nir',
-            "B8A": 'vegetation_red_edge_4',
-            "B09": 'water_vapour',
-            "B10": 'swir_cirrus',
-            "B11": 'swir1',
-            "B12": 'swir2',
-            "TCI": 'true_colour'
-        }
+        prod_map = S2_L1C_BAND_NAMES
 
     else:
         prod_name = prod_name[-11:-4]
-        prod_map = {
-            "AOT_10m": 'aerosol_optical_thickness',
-            "B01_60m": 'coastal_aerosol',
-            "B02_10m": 'blue',
-            "B03_10m": 'green',
-            "B04_10m": 'red',
-            "B05_20m": 'vegetation_red_edge_1',
-            "B06_20m": 'vegetation_red_edge_2',
-            "B07_20m": 'vegetation_red_edge_3',
-            "B08_10m": 'nir',
-            "B8A_20m": 'vegetation_red_edge_4',
-            "B09_60m": 'water_vapour',
-            "B11_20m": 'swir1',
-            "B12_20m": 'swir2',
-            "SCL_20m": 'scene_classification',
-            "WVP_10m": 'wvp'
-        }
+        prod_map = S2_L2A_BAND_NAMES
 
     layer_name = prod_map[prod_name]
 
     return layer_name
 
 
+def s2_prod_band_names(in_scene, prodlevel='L2A', prods='full'):
+    """
+    Band names the prepared scene has once PRODS are COGged (see band_name_s2), so a scene
+    prepared with fewer products, i.e. prods='wofs', is not taken as prepared for 'full'.
+
+    :param in_scene: input Sentinel-2 scene name (either L1C or L2A)
+    :param prodlevel: desired product level, as for prepareS2
+    :param prods: name of a product set in S2_PROD_SETS or list of products i.e. ["B02_10m", "SCL_20m"]
+    :return: set of band names
+    """
+    if prods == 'full' and not ('_MSIL2A_' in in_scene or prodlevel == 'L2A'):
+        # full L1C scenes COG every band file
+        return set(S2_L1C_BAND_NAMES.values())
+    if isinstance(prods, str):
+        prods = S2_PROD_SETS[prods]
+    if '_MSIL2A_' in in_scene or prodlevel == 'L2A':
+        return {S2_L2A_BAND_NAMES[prod] for prod in prods}
+    # L1C band files are named by band alone, and have no AOT, SCL or WVP products
+    return {S2_L1C_BAND_NAMES[prod[:3]] for prod in prods if prod[0] == 'B'}
+
+
 def find_s2_uuid(s2_filename):
     """
     Returns S2 uuid required for download via sentinelsat, based upon an input S2 file/scene name. 
@@ -155,15 +270,18 @@ def find_s2_uuid(s2_filename):
         return res.uuid.values[0]
 
 
-def download_extract_s2_esa(scene_uuid, down_dir, original_scene_dir):
+def download_extract_s2_esa(scene_uuid, down_dir, original_scene_dir, bands=False):
     """
     Download a single S2 scene from ESA via sentinelsat 
     based upon uuid. 
     Assumes esa hub creds stored as env variables.
+    Online products are extracted as they download, without staging the .zip, and checked against
+    the product's MD5 as sentinelsat's download does.
     
     :param scene_uuid: S2 download uuid from sentinelsat query
     :param down_dir: directory in which to create a downloaded product dir
     :param original_scene_dir: 
+    :param bands: extract only a subset of S2 bands (see download_s2_granule_gcloud). default is False
     :return: 
     """
     # if unzipped .SAFE file doesn't exist then we must do something
@@ -171,19 +289,25 @@ def download_extract_s2_esa(scene_uuid, down_dir, original_scene_dir):
 
         # if downloaded .zip file doesn't exist then download it
         if not os.path.exists(original_scene_dir.replace('.SAFE/', '.zip')):
-            logging.info('Downloading ESA scene zip: {}'.format(os.path.basename(original_scene_dir)))
-
             copernicus_username = os.getenv("COPERNICUS_USERNAME")
             copernicus_pwd = os.getenv("COPERNICUS_PWD")
             logging.debug(f"ESA username: {copernicus_username}")
             esa_api = SentinelAPI(copernicus_username, copernicus_pwd)
+            product = esa_api.get_product_odata(scene_uuid)
+
+            if product.get('Online', True):
+                logging.info('Downloading and extracting ESA scene: {}'.format(original_scene_dir))
+                fetch_extract_zip(requests_opener(esa_api.session, product['url']), os.path.dirname(down_dir),
+                                  s2_member_pattern(bands), md5=product.get('md5'))
+                return
+
+            # offline products need retrieving from the long term archive first
+            logging.info('Downloading ESA scene zip: {}'.format(os.path.basename(original_scene_dir)))
             esa_api.download(scene_uuid, down_dir, checksum=True)
 
         # extract downloaded .zip file
         logging.info('Extracting ESA scene: {}'.format(original_scene_dir))
-        zip_ref = zipfile.ZipFile(original_scene_dir.replace('.SAFE/', '.zip'), 'r')
-        zip_ref.extractall(os.path.dirname(down_dir))
-        zip_ref.close()
+        extract_zip(original_scene_dir.replace('.SAFE/', '.zip'), os.path.dirname(down_dir), s2_member_pattern(bands))
 
     else:
         logging.warning('ESA scene already extracted: {}'.format(original_scene_dir))
@@ -194,7 +318,7 @@ def download_extract_s2_esa(scene_uuid, down_dir, original_scene_dir):
         os.remove(original_scene_dir.replace('.SAFE/', '.zip'))
 
 
-def conv_s2scene_cogs(original_scene_dir, cog_scene_dir, scene_name, overwrite=False):
+def conv_s2scene_cogs(original_scene_dir, cog_scene_dir, scene_name, overwrite=False, prods='full'):
     """
     Convert S2 scene products to cogs [+ validate TBC].
     Works for both L1C and L2A .SAFE dir structures.
@@ -203,6 +327,7 @@ def conv_s2scene_cogs(original_scene_dir, cog_scene_dir, scene_name, overwrite=F
     :param cog_scene_dir: directory in which to create the output COGs
     :param scene_name: shortened S2 scene name (i.e. S2A_MSIL2A_20190124T221941_T60KYF from S2A_MSIL2A_20190124T221941_N0211_R029_T60KYF_20190124T234344)
     :param overwrite: Binary for whether to overwrite or skip existing COG files)
+    :param prods: name of a product set in S2_PROD_SETS or list of L2A products to convert
     :return: 
     """
 
@@ -214,13 +339,13 @@ def conv_s2scene_cogs(original_scene_dir, cog_scene_dir, scene_name, overwrite=F
         logging.info('Creating scene cog directory: {}'.format(cog_scene_dir))
         os.mkdir(cog_scene_dir)
 
-    des_prods = ["AOT_10m", "B01_60m", "B02_10m", "B03_10m", "B04_10m", "B05_20m", "B06_20m",
-                 "B07_20m", "B08_10m", "B8A_20m", "B09_60m", "B11_20m", "B12_20m", "SCL_20m",
-                 "WVP_10m"]
+    des_prods = S2_PROD_SETS[prods] if isinstance(prods, str) else prods
 
     # find all individual prods to convert to cog (ignore true colour images (TCI))
     if scene_name.split('_')[1] == 'MSIL1C':
         prod_paths = glob.glob(original_scene_dir + 'GRANULE/*/IMG_DATA/*.jp2')
+        if prods != 'full':
+            prod_paths = [x for x in prod_paths if x[-7:-4] in {p[:3] for p in des_prods}]
 
     elif scene_name.split('_')[1] == 'MSIL2A':
         prod_paths = glob.glob(original_scene_dir + 'GRANULE/*/IMG_DATA/*/*.jp2')
@@ -394,6 +519,20 @@ def yaml_prep_s2(scene_dir):
     }
 
 
+def s2_scene_name(in_scene):
+    """
+    Short name of a Sentinel-2 scene, as used for its prepared output directory.
+
+    :param in_scene: input Sentinel-2 scene name (either L1C or L2A) i.e. "S2A_MSIL1C_20180820T223011_N0206_R072_T60KWE_20180821T013410[.SAFE]"
+    :return: scene name i.e. "S2A_MSIL2A_20180820T223011_T60KWE"
+    """
+    if not in_scene.endswith('.SAFE'):
+        in_scene = in_scene + '.SAFE'
+    scene_name = in_scene[:-21]
+    scene_name = scene_name[:-17] + scene_name.split('_')[-1]
+    return scene_name.replace('_MSIL1C_', '_MSIL2A_')
+
+
 # @click.command()
 # @click.argument("in_scene")
 # @click.argument("out_dir")
@@ -402,7 +541,7 @@ def yaml_prep_s2(scene_dir):
 # @click.option("--source", default="gcloud", help="Api source to be used for downloading scenes.")
 
 def prepareS2(in_scene, s3_bucket='cs-odc-data', s3_dir='fiji/Sentinel_2_test/', inter_dir='/tmp/data/intermediate/',
-              prodlevel='L2A'):
+              prodlevel='L2A', prods='full', force=False):
     """
     Prepare IN_SCENE of Sentinel-2 satellite data into OUT_DIR for ODC indexing. 
 
@@ -411,7 +550,9 @@ def prepareS2(in_scene, s3_bucket='cs-odc-data', s3_dir='fiji/Sentinel_2_test/',
     :param s3_dir: bucket dir in which to upload prepared products
     :param inter_dir: dir in which to store intermeriary products - this will be nuked at the end of processing, error or not
     :param prodlevel: Desired Sentinel-2 product level. Defaults to 'L1C'. Use 'L2A' for ARD equivalent
-    :return: None
+    :param prods: products to download and COG, either a product set in S2_PROD_SETS ('full', or 'wofs' for the 7 bands WOfS needs) or a list i.e. ["B02_10m", "SCL_20m"]
+    :param force: prepare the scene even if it is already prepared in s3_dir with (at least) prods
+    :return: dict of the scene name, status and error (see job_status)
     
     Assumptions:
     - env set at SEN2COR_8: i.e. Sen2Cor-02.08.00-Linux64/bin/L2A_Process"
@@ -424,13 +565,15 @@ def prepareS2(in_scene, s3_bucket='cs-odc-data', s3_dir='fiji/Sentinel_2_test/',
     if not in_scene.endswith('.SAFE'):
         in_scene = in_scene + '.SAFE'
     # shorten scene name
-    scene_name = in_scene[:-21]
-    scene_name = scene_name[:-17] + scene_name.split('_')[-1]
+    scene_name = s2_scene_name(in_scene)
     if '_MSIL1C_' in in_scene:
-        scene_name = scene_name.replace('_MSIL1C_','_MSIL2A_')
-
         sen2cor8 = os.environ.get("SEN2COR_8")
 
+    # Nothing to do if already prepared
+    status = skip_if_prepared(scene_name, s3_bucket, s3_dir, force, bands=s2_prod_band_names(in_scene, prodlevel, prods))
+    if status is not None:
+        return status
+
     # Unique inter_dir needed for clean-up
     inter_dir = inter_dir + scene_name + '_tmp/'
     os.makedirs(inter_dir, exist_ok=True)
@@ -452,7 +595,8 @@ def prepareS2(in_scene, s3_bucket='cs-odc-data', s3_dir='fiji/Sentinel_2_test/',
         try:
             root.info(f"{in_scene} {scene_name} DOWNLOADING via GCloud")
 #             raise Exception('skipping gcloud for testing')
-            download_s2_granule_gcloud(in_scene, inter_dir, down_dir)
+            download_s2_granule_gcloud(in_scene, inter_dir, down_dir,
+                                       bands=s2_download_bands(in_scene, prodlevel, prods))
             if '_MSIL2A_' in in_scene:
                 down_dir = inter_dir + in_scene + '/' # now need explicit .SAFE dir
                 if not os.path.exists(down_dir): # don't do this for l1c from gcp, prevented by ESA LTA
@@ -466,11 +610,13 @@ def prepareS2(in_scene, s3_bucket='cs-odc-data', s3_dir='fiji/Sentinel_2_test/',
                 root.info(f"{in_scene} {scene_name} AVAILABLE via ESA")
                 if '_MSIL2A_' in in_scene:
                     down_dir = inter_dir + in_scene + '/' # now need explicit .SAFE dir
-                download_extract_s2_esa(s2id, inter_dir, down_dir)
+                download_extract_s2_esa(s2id, inter_dir, down_dir, bands=s2_download_bands(in_scene, prodlevel, prods))
                 root.info(f"{in_scene} {scene_name} DOWNLOADED via ESA")
             except Exception as e:
                 root.exception(f"{in_scene} {scene_name} UNAVAILABLE via ESA too")
-                raise Exception('Download Error ESA', e)
+                raise RetryableError('Download Error ESA', e)
+
+        pipeline_stage('process')
 
         # [CREATE L2A WITHIN TEMP DIRECTORY]
         if ('MSIL1C' in in_scene) & (prodlevel == 'L2A'):
@@ -487,7 +633,7 @@ def prepareS2(in_scene, s3_bucket='cs-odc-data', s3_dir='fiji/Sentinel_2_test/',
         # CONVERT TO COGS TO TEMP COG DIRECTORY**
         try:
             root.info(f"{in_scene} {scene_name} Converting COGs")
-            conv_s2scene_cogs(down_dir, cog_dir, scene_name)
+            conv_s2scene_cogs(down_dir, cog_dir, scene_name, prods=prods)
             root.info(f"{in_scene} {scene_name} COGGED")
         except Exception as e:
             root.exception(f"{in_scene} {scene_name} COG conversion FAILED")
@@ -511,19 +657,22 @@ def prepareS2(in_scene, s3_bucket='cs-odc-data', s3_dir='fiji/Sentinel_2_test/',
             raise Exception('YAML creation error', e)
 
             # MOVE COG DIRECTORY TO OUTPUT DIRECTORY
+        pipeline_stage('upload')
         try:
             root.info(f"{in_scene} {scene_name} Uploading to S3 Bucket")
             s3_upload_cogs(glob.glob(cog_dir + '*'), s3_bucket, s3_dir)
             root.info(f"{in_scene} {scene_name} Uploaded to S3 Bucket")
         except Exception as e:
             root.exception(f"{in_scene} {scene_name} Upload to S3 Failed")
-            raise Exception('S3  upload error', e)
+            raise RetryableError('S3  upload error', e)
 
         clean_up(inter_dir)
+        return job_status(scene_name)
 
     except Exception as e:
         logging.error(f"could not process {scene_name}, {e}", )
         clean_up(inter_dir)
+        return job_status(scene_name, e)
 
         
 if __name__ == '__main__':
@@ -1,11 +1,16 @@
+import contextlib
 import logging
+import math
 import os
 import shutil
 from datetime import datetime
-from random import randint
-from time import sleep
+from concurrent.futures import ThreadPoolExecutor
+from random import uniform
+from threading import Lock
+from time import sleep, monotonic
 from urllib.request import urlopen, HTTPPasswordMgrWithDefaultRealm, HTTPBasicAuthHandler, HTTPDigestAuthHandler, build_opener
 from urllib.error import HTTPError
+from urllib.parse import urlparse
 
 import botocore
 from asynchronousfilereader import AsynchronousFileReader
@@ -24,8 +29,16 @@ from rasterio.enums import Resampling
 from rasterio.env import GDALVersion
 from rasterio.io import MemoryFile
 from rasterio.shutil import copy
+from rasterio.windows import Window, from_bounds
 import numpy as np
 import gc
+import fcntl
+import hashlib
+import io
+import re
+import struct
+import zipfile
+import zlib
 
 
 def to_cog(input_file, output_file, nodata=0):
@@ -73,6 +86,47 @@ def conv_sgl_cog(in_path, out_path, nodata=0):
     # should inc. cog val...
 
 
+class RetryableError(Exception):
+    """A processing failure that may succeed if the job is retried, e.g. a download or upload error."""
+    pass
+
+
+def job_status(scene_name, error=None, skipped=False):
+    """
+    Structured result of a prepare* run, used by workers to complete, retry or dead-letter the job.
+
+    :param scene_name: name of the processed scene
+    :param error: the exception that stopped processing, if any
+    :param skipped: True if the scene was already prepared
+    :return: dict of scene, status ('success', 'skipped' or 'failed'), error and whether a retry may succeed
+    """
+    if skipped:
+        return {'scene': scene_name, 'status': 'skipped'}
+    if error is None:
+        return {'scene': scene_name, 'status': 'success'}
+    return {'scene': scene_name, 'status': 'failed', 'error': str(error),
+            'retryable': isinstance(error, RetryableError)}
+
+
+# Called by pipeline_stage when set, i.e. in the job processes of a worker in pipeline mode.
+_stage_hook = None
+
+
+def set_stage_hook(hook):
+    global _stage_hook
+    _stage_hook = hook
+
+
+def pipeline_stage(stage):
+    """
+    Mark where a prepare* function reaches a stage: 'process' once its inputs are downloaded and
+    'upload' once its outputs are written. Does nothing unless run by a worker in pipeline mode
+    (see worker.Worker), which holds the job at 'process' until a processing slot is free.
+    """
+    if _stage_hook is not None:
+        _stage_hook(stage)
+
+
 def clean_up(work_dir):
     # TODO: sort out logging changes...
     gc.collect()
@@ -148,42 +202,574 @@ def run_snap_command(command, timeout =  60*45):
         raise Exception("Snap returned non zero exit status")
 
 
+# HTTP statuses worth retrying after a backoff
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_http_session = None
+_http_session_lock = Lock()
+
+
+def new_http_session(cookies=None):
+    """
+    requests Session with a connection pool big enough for concurrent segment downloads.
+
+    :param cookies: optional cookie jar for the session to send and update, i.e. an auth cookie jar
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=16)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if cookies is not None:
+        session.cookies = cookies
+    return session
+
+
+def http_session():
+    """
+    Shared requests Session for downloads, so connections are pooled and reused across requests
+    and threads. One per process.
+    """
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            _http_session = new_http_session()
+        return _http_session
+
+
+class _RetryLater(IOError):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _ShortRead(IOError):
+    """A response ended before all the bytes it should have held were read."""
+
+
+def _check_response(r):
+    """Raise _RetryLater for statuses worth retrying, HTTPError for any other error status."""
+    if r.status_code in RETRY_STATUSES:
+        retry_after = r.headers.get('Retry-After', '')
+        raise _RetryLater(f"{r.status_code} from {r.url}", int(retry_after) if retry_after.isdigit() else None)
+    r.raise_for_status()
+
+
+def backoff_delay(attempt, retry_after=None):
+    """
+    Seconds to wait before retry ATTEMPT (from 0): exponential backoff from DOWNLOAD_MIN_WAIT with
+    full jitter, bounded by DOWNLOAD_MAX_WAIT. A server's Retry-After is honoured up to the bound.
+    """
+    min_delay = float(os.getenv("DOWNLOAD_MIN_WAIT", "5"))
+    max_delay = float(os.getenv("DOWNLOAD_MAX_WAIT", "300"))
+    if retry_after is not None:
+        return min(float(retry_after), max_delay)
+    return uniform(0, min(max_delay, min_delay * 2 ** attempt))
+
+
+def with_backoff(func, description, retries=None):
+    """
+    Call FUNC, retrying on connection errors, short reads and RETRY_STATUSES with backoff_delay between
+    attempts. Other HTTP errors (i.e. 404) and local IO errors (i.e. a full disk) are raised straight away.
+
+    :param retries: number of retries, defaults to DOWNLOAD_RETRY env var or 3
+    """
+    retries = int(os.getenv("DOWNLOAD_RETRY", "3")) if retries is None else retries
+    for attempt in range(retries + 1):
+        try:
+            return func()
+        except requests.HTTPError:
+            raise
+        except (requests.RequestException, _RetryLater, _ShortRead) as e:
+            if attempt == retries:
+                raise
+            delay = backoff_delay(attempt, getattr(e, 'retry_after', None))
+            logging.warning(f"{description} failed: {e}, retrying in {delay:.0f}s")
+            sleep(delay)
+
+
+class _DownloadProgress:
+    """Thread-safe count of bytes downloaded, logging progress and throughput every INTERVAL_SECS."""
+
+    def __init__(self, name, total=None, done=0, interval_secs=30):
+        self.name = name
+        self.total = total
+        self.done = done
+        self.fetched = 0
+        self.interval_secs = interval_secs
+        self.started = self.logged = monotonic()
+        self.lock = Lock()
+
+    def add(self, n):
+        with self.lock:
+            self.done += n
+            self.fetched += n
+            if monotonic() - self.logged >= self.interval_secs:
+                self.logged = monotonic()
+                total = f"/{self.total / 1e6:.0f}" if self.total else ""
+                logging.info(f"{self.name}: {self.done / 1e6:.0f}{total} MB, {self.bytes_per_sec() / 1e6:.1f} MB/s")
+
+    def rewind(self, n):
+        """Take N bytes already counted off the progress, as they are being downloaded again."""
+        with self.lock:
+            self.done -= n
+
+    def bytes_per_sec(self):
+        return self.fetched / max(monotonic() - self.started, 1e-6)
+
+
+def _download_range(session, url, path, start, end, progress, chunk_bytes, **kwargs):
+    """
+    Download bytes START to END (inclusive, None for to the end) of URL, appending to PATH and
+    resuming from however much of the range PATH already holds.
+    """
+    done = os.path.getsize(path) if os.path.exists(path) else 0
+    if end is not None and start + done > end:
+        return
+    headers = dict(kwargs.pop('headers', None) or {})
+    if start + done > 0 or end is not None:
+        headers['Range'] = f"bytes={start + done}-{'' if end is None else end}"
+
+    with session.get(url, headers=headers, stream=True, **kwargs) as r:
+        _check_response(r)
+        mode = 'ab'
+        if 'Range' in headers and r.status_code != 206:
+            if start > 0 or end is not None:
+                raise requests.HTTPError(f"{url} ignored range request", response=r)
+            # server can't resume, start again
+            progress.rewind(done)
+            mode = 'wb'
+        with open(path, mode) as f:
+            for chunk in r.iter_content(chunk_bytes):
+                f.write(chunk)
+                progress.add(len(chunk))
+
+    if end is not None and os.path.getsize(path) < end - start + 1:
+        raise _ShortRead(f"{url} connection closed after {start + os.path.getsize(path)} of {end + 1} bytes")
+
+
+def download_file(url, output_path, session=None, segments=4, min_segment_bytes=64 * 1024 * 1024,
+                  chunk_bytes=1024 * 1024, retries=None, **kwargs):
+    """
+    Stream URL to OUTPUT_PATH without holding it in memory. Large files are downloaded in parallel
+    segments if the server supports range requests, and interrupted downloads resume where they
+    stopped (see with_backoff for retries). Progress and throughput are logged.
+
+    :param session: requests Session to use, defaults to the shared http_session()
+    :param segments: maximum number of concurrent range requests
+    :param min_segment_bytes: smallest segment worth its own request
+    :param chunk_bytes: bytes read per write
+    :param retries: retries per request, see with_backoff
+    :param kwargs: passed to session.get, i.e. auth or headers
+    :return: dict of bytes downloaded, secs taken and bytes_per_sec achieved
+    """
+    session = session or http_session()
+    kwargs.setdefault('timeout', 60)
+    name = os.path.basename(output_path)
+
+    # find size and whether ranges are supported
+    def probe():
+        headers = dict(kwargs.get('headers') or {}, Range='bytes=0-0')
+        with session.get(url, stream=True, **dict(kwargs, headers=headers)) as r:
+            _check_response(r)
+            content_range = r.headers.get('Content-Range', '')
+            if r.status_code == 206 and content_range.split('/')[-1].isdigit():
+                return int(content_range.split('/')[-1])
+            return None
+
+    size = with_backoff(probe, f"GET {url}", retries)
+    n = max(1, min(segments, size // min_segment_bytes)) if size else 1
+    bounds = [size * i // n for i in range(n + 1)] if size else [0, None]
+    part_paths = [f"{output_path}.part{i}" for i in range(n)] if n > 1 else [f"{output_path}.part"]
+    resumed = sum(os.path.getsize(p) for p in part_paths if os.path.exists(p))
+    progress = _DownloadProgress(name, size, resumed)
+
+    def fetch(i):
+        end = bounds[i + 1] - 1 if bounds[i + 1] is not None else None
+        with_backoff(lambda: _download_range(session, url, part_paths[i], bounds[i], end, progress,
+                                             chunk_bytes, **kwargs),
+                     f"{name} bytes {bounds[i]}-{end}", retries)
+
+    logging.info(f"Downloading {url} to {output_path} in {n} segment(s)")
+    with ThreadPoolExecutor(max_workers=n) as executor:
+        list(executor.map(fetch, range(n)))
+
+    # stitch segments together
+    with open(part_paths[0], 'ab') as out:
+        for part_path in part_paths[1:]:
+            with open(part_path, 'rb') as f:
+                shutil.copyfileobj(f, out, 16 * 1024 * 1024)
+            os.remove(part_path)
+    os.replace(part_paths[0], output_path)
+
+    return _log_throughput(progress)
+
+
+def _log_throughput(progress):
+    """Log the bytes fetched and throughput of a finished download, returning them as download_file does."""
+    secs = monotonic() - progress.started
+    logging.info(f"Downloaded {progress.name}: {progress.fetched / 1e6:.0f} MB in {secs:.0f}s, "
+                 f"{progress.bytes_per_sec() / 1e6:.1f} MB/s")
+    return {'bytes': progress.fetched, 'secs': secs, 'bytes_per_sec': progress.bytes_per_sec()}
+
+
 def get_file(url, output_path, user=None, password=None):
+    """
+    Download a url to output_path, streamed and resumable (see download_file)
+    :param user: optional http username to apply to the request
+    :param password: optional http password to apply to the request
+    """
     logging.debug(f"downloading {url} to {output_path}")
-    request = get_url(url, user, password)
-    if request:
-        with open(output_path, 'wb') as f:
-            logging.info(f.write(request.content))
+    return download_file(url, output_path, auth=(user, password) if user else None)
 
 
 def get_url(url, user=None, password=None):
     """
-    Fetch a url and return the content as a byte array
+    Fetch a url and return the response, retrying with backoff (see with_backoff).
+    The content is held in memory - use get_file for anything large.
     :param url: the url to go and fetch
     :param user: optional http username to apply to the request
     :param password: optional http password to apply to the request
-    :return: byte array containing the file.
-    """
-    retry = 0
-    max_retry = int(os.getenv("DOWNLOAD_RETRY", "3"))
-    min_delay = int(os.getenv("DOWNLOAD_MIN_WAIT", "60"))
-    max_delay = int(os.getenv("DOWNLOAD_MAX_WAIT", "6000"))
-
-    while retry < max_retry:
-        retry += 1
-        r = requests.get(url, auth=(user, password))
-        if not r.ok:
-            if r.status_code == 429:
-                delay = randint(min_delay, max_delay)
-                logging.error(f"Too many requests. {r.status_code} {r.content.decode('utf-8')}")
-                logging.info(f"sleeping for {delay} seconds")
-                sleep(delay)
-                logging.info("trying again...")
+    :return: requests response
+    """
+    def get():
+        r = http_session().get(url, auth=(user, password) if user else None, timeout=60)
+        _check_response(r)
+        return r
+    return with_backoff(get, f"GET {url}")
+
+
+_redis_cache = None
+
+
+def redis_cache():
+    """
+    Redis connection for caches shared between jobs (REDIS_SERVICE_HOST, as used by the work
+    queues), or None if Redis can't be reached - caching is then skipped for the process.
+    """
+    global _redis_cache
+    if _redis_cache is None:
+        try:
+            import redis
+            db = redis.StrictRedis(host=os.getenv("REDIS_SERVICE_HOST", "redis-master"),
+                                   socket_connect_timeout=2, socket_timeout=5)
+            db.ping()
+            _redis_cache = db
+        except Exception as e:
+            logging.info(f"No redis cache available: {e}")
+            _redis_cache = False
+    return _redis_cache or None
+
+
+def cache_get(key, db=None):
+    """Cached string value of KEY (see redis_cache), or None if missing or there is no cache."""
+    db = db or redis_cache()
+    if db is None:
+        return None
+    try:
+        value = db.get(key)
+    except Exception as e:
+        logging.warning(f"Cache lookup of {key} failed: {e}")
+        return None
+    return value.decode() if value is not None else None
+
+
+def cache_set(mapping, ttl_secs, db=None):
+    """Cache a dict of KEY: value strings for TTL_SECS (see redis_cache). Failures are only logged."""
+    db = db or redis_cache()
+    if db is None or not mapping:
+        return
+    try:
+        pipe = db.pipeline()
+        for key, value in mapping.items():
+            pipe.setex(key, ttl_secs, value)
+        pipe.execute()
+    except Exception as e:
+        logging.warning(f"Caching {len(mapping)} keys failed: {e}")
+
+
+def requests_opener(session, url, **kwargs):
+    """
+    open_url callable (see fetch_extract_zip) for a url fetched with a requests Session.
+    """
+    def open_url(headers):
+        r = session.get(url, headers=headers, stream=True, **kwargs)
+        _check_response(r)
+        return r.raw
+    return open_url
+
+
+class HTTPRangeFile(io.RawIOBase):
+    """
+    Read-only, seekable file over HTTP range requests, so that zipfile can read the central
+    directory and single members of a remote zip without downloading the rest of it.
+
+    A request that fails part way is retried (see with_backoff), so an interrupted download resumes
+    from the block it was reading.
+
+    :param open_url: callable taking a dict of request headers and returning a response with .read()
+    :param size: size of the remote file in bytes
+    :param block_bytes: minimum number of bytes fetched per request
+    :param progress: optional _DownloadProgress to count the bytes fetched
+    """
+
+    def __init__(self, open_url, size, block_bytes=16 * 1024 * 1024, progress=None):
+        self.open_url = open_url
+        self.size = size
+        self.block_bytes = block_bytes
+        self.progress = progress
+        self.pos = 0
+        self.buf = b''
+        self.buf_start = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.pos = max(0, offset)
+        return self.pos
+
+    def readinto(self, b):
+        n = min(len(b), self.size - self.pos)
+        if n <= 0:
+            return 0
+        if not self.buf_start <= self.pos <= self.pos + n <= self.buf_start + len(self.buf):
+            end = min(self.pos + max(n, self.block_bytes), self.size) - 1
+            name = self.progress.name if self.progress is not None else 'remote file'
+            self.buf = with_backoff(lambda: self._fetch(self.pos, end), f"{name} bytes {self.pos}-{end}")
+            self.buf_start = self.pos
+        start = self.pos - self.buf_start
+        b[:n] = self.buf[start:start + n]
+        self.pos += n
+        return n
+
+    def _fetch(self, start, end):
+        response = self.open_url({'Range': f'bytes={start}-{end}'})
+        try:
+            data = response.read()
+        except Exception as e:
+            # only the network is read here, so whatever broke the response is worth retrying
+            raise _ShortRead(f"read failed: {e}") from e
+        finally:
+            response.close()
+        if len(data) != end - start + 1:
+            raise _ShortRead(f"ended after {len(data)} of {end - start + 1} bytes")
+        if self.progress is not None:
+            self.progress.add(len(data))
+        return data
+
+
+class _PushbackStream:
+    """Wraps a stream so bytes read past the end of a zip member can be handed back."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.pending = b''
+
+    def read(self, n):
+        if self.pending:
+            data, self.pending = self.pending[:n], self.pending[n:]
+            return data
+        return self.stream.read(n)
+
+    def read_exact(self, n):
+        data = b''
+        while len(data) < n:
+            chunk = self.read(n - len(data))
+            if not chunk:
+                raise EOFError('zip stream ended early')
+            data += chunk
+        return data
+
+    def unread(self, data):
+        self.pending = data + self.pending
+
+
+class _MeteredStream:
+    """Wraps a stream, counting every byte read from it in PROGRESS and feeding it to HASH (i.e. a hashlib.md5()) if given."""
+
+    def __init__(self, stream, progress, hash=None):
+        self.stream = stream
+        self.progress = progress
+        self.hash = hash
+
+    def read(self, n):
+        data = self.stream.read(n)
+        self.progress.add(len(data))
+        if self.hash is not None:
+            self.hash.update(data)
+        return data
+
+
+def _zip_member_path(out_dir, name):
+    """Path to extract zip member NAME to, refusing names that escape OUT_DIR."""
+    path = os.path.normpath(os.path.join(out_dir, name))
+    if not path.startswith(os.path.normpath(out_dir) + os.sep):
+        raise ValueError(f"unsafe zip member name: {name}")
+    return path
+
+
+def stream_extract_zip(stream, out_dir, members=None, chunk_bytes=1024 * 1024):
+    """
+    Extract a zip from a non-seekable stream (i.e. an HTTP response) as it is read, by walking
+    the local file headers. Only the members matching MEMBERS are written, the rest are skipped.
+
+    :param stream: file-like object with .read(n)
+    :param out_dir: directory to extract into
+    :param members: regex searched for in member names, default all members
+    :param chunk_bytes: bytes read from the stream at a time
+    :return: list of extracted paths
+    """
+    stream = _PushbackStream(stream)
+    extracted = []
+    while stream.read_exact(4) == b'PK\x03\x04':  # central directory follows the last member
+        flags, method, crc, csize, usize, name_len, extra_len = \
+            struct.unpack('<2xHH4xIIIHH', stream.read_exact(26))
+        name = stream.read_exact(name_len).decode('utf-8' if flags & 0x800 else 'cp437')
+        extra = stream.read_exact(extra_len)
+
+        # zip64 sizes live in extra field 0x0001, uncompressed size first
+        zip64 = False
+        while len(extra) >= 4:
+            field_id, field_len = struct.unpack('<HH', extra[:4])
+            if field_id == 0x0001:
+                zip64 = True
+                values = list(struct.unpack(f'<{field_len // 8}Q', extra[4:4 + field_len // 8 * 8]))
+                if usize == 0xFFFFFFFF:
+                    usize = values.pop(0)
+                if csize == 0xFFFFFFFF:
+                    csize = values.pop(0)
+            extra = extra[4 + field_len:]
+
+        if method not in (0, 8):
+            raise ValueError(f"unsupported zip compression method {method} for {name}")
+        descriptor = flags & 0x08
+        if descriptor and method == 0:
+            raise ValueError(f"cannot stream stored zip member {name} of unknown size")
+
+        out = None
+        if not name.endswith('/') and (members is None or re.search(members, name)):
+            path = _zip_member_path(out_dir, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            out = open(path, 'wb')
+            extracted.append(path)
+        decompressor = zlib.decompressobj(-15) if method == 8 else None
+        crc_out = 0
+
+        def write(data):
+            nonlocal crc_out
+            if out is not None:
+                crc_out = zlib.crc32(data, crc_out)
+                out.write(data)
+
+        try:
+            if descriptor:
+                # size unknown until the deflate stream ends
+                while not decompressor.eof:
+                    chunk = stream.read(chunk_bytes)
+                    if not chunk:
+                        raise EOFError('zip stream ended early')
+                    write(decompressor.decompress(chunk))
+                stream.unread(decompressor.unused_data)
+                desc = stream.read_exact(4)
+                if desc == b'PK\x07\x08':
+                    desc = stream.read_exact(4)
+                crc = struct.unpack('<I', desc)[0]
+                stream.read_exact(16 if zip64 else 8)
             else:
-                logging.error(f"could not make request {r.status_code} {r.content.decode('utf-8')}")
-                raise HTTPError(f"could not make request {r.status_code}")
-        else:
-            return r
+                remaining = csize
+                while remaining:
+                    chunk = stream.read(min(chunk_bytes, remaining))
+                    if not chunk:
+                        raise EOFError('zip stream ended early')
+                    remaining -= len(chunk)
+                    if out is not None:
+                        write(decompressor.decompress(chunk) if decompressor else chunk)
+                if out is not None and decompressor:
+                    write(decompressor.flush())
+        finally:
+            if out is not None:
+                out.close()
+        if out is not None and crc_out != crc:
+            raise IOError(f"zip member {name} failed CRC check")
+    return extracted
+
+
+def extract_zip(zip_path, out_dir, members=None):
+    """
+    Extract the members of a local zip matching MEMBERS (regex searched for in member names,
+    default all members) into OUT_DIR.
+
+    :return: list of extracted paths
+    """
+    with zipfile.ZipFile(zip_path) as zf:
+        return [zf.extract(info, out_dir) for info in zf.infolist()
+                if members is None or re.search(members, info.filename)]
+
+
+def fetch_extract_zip(open_url, out_dir, members=None, md5=None, chunk_bytes=1024 * 1024, name=None):
+    """
+    Download a remote zip and extract the members matching MEMBERS into OUT_DIR, without staging
+    the archive on disk. If the server supports range requests only the central directory and the
+    wanted members are fetched, resuming from the failed block if a request breaks (see HTTPRangeFile).
+    Otherwise the zip is extracted as it streams in, and can't be resumed. Progress and throughput
+    are logged as for download_file.
+
+    :param open_url: callable taking a dict of request headers and returning a file-like response
+                     with .read(), .headers and .status, i.e. requests_opener or a urllib opener
+    :param out_dir: directory to extract into
+    :param members: regex searched for in member names, default all members
+    :param md5: optional MD5 hex digest of the whole archive, i.e. from the ESA OData product. The
+                archive is then always streamed, so every byte can be hashed as it arrives, and
+                IOError is raised (with the extracted members removed) if it doesn't match
+    :param chunk_bytes: bytes read from the stream at a time
+    :param name: name of the zip to log progress under, defaults to OUT_DIR
+    :return: list of extracted paths
+    """
+    name = name or out_dir
+    if md5 is None:
+        response = open_url({'Range': 'bytes=0-0'})
+        content_range = response.headers.get('Content-Range', '')
+        if response.status == 206 and content_range.split('/')[-1].isdigit():
+            response.close()
+            size = int(content_range.split('/')[-1])
+            progress = _DownloadProgress(name, size)
+            remote = HTTPRangeFile(open_url, size, progress=progress)
+            with zipfile.ZipFile(remote) as zf:
+                extracted = [zf.extract(info, out_dir) for info in zf.infolist()
+                             if members is None or re.search(members, info.filename)]
+            _log_throughput(progress)
+            return extracted
+        logging.info("Range requests not supported, extracting zip as it downloads")
+    else:
+        response = open_url({})
+
+    progress = _DownloadProgress(name, int(response.headers.get('Content-Length') or 0) or None)
+    try:
+        stream = _MeteredStream(response, progress, hashlib.md5() if md5 else None)
+        extracted = stream_extract_zip(stream, out_dir, members, chunk_bytes)
+        if md5 is not None:
+            # the central directory (and anything else after the last member) counts towards the checksum
+            while stream.read(chunk_bytes):
+                pass
+    finally:
+        response.close()
+    _log_throughput(progress)
+
+    if md5 is not None and stream.hash.hexdigest().lower() != md5.lower():
+        for path in extracted:
+            os.remove(path)
+        raise IOError(f"zip failed MD5 check: got {stream.hash.hexdigest()}, expected {md5}")
+    return extracted
 
 
 def split_all(path):
@@ -377,14 +963,14 @@ def s3_list_objects_paths(s3_bucket, prefix):
     """List of paths only returned, not full object responses"""
     client, bucket = s3_create_client(s3_bucket)
     
-    return [e['Key'] for p in client.get_paginator("list_objects_v2").paginate(Bucket=s3_bucket, Prefix=prefix) for e in p['Contents']]
+    return [e['Key'] for p in client.get_paginator("list_objects_v2").paginate(Bucket=s3_bucket, Prefix=prefix) for e in p.get('Contents', [])]
 
 
 def s3_list_objects_pathssize(s3_bucket, prefix):
     """List of tuples paths + sizes only returned, not full object responses"""
     client, bucket = s3_create_client(s3_bucket)
     
-    return [(e['Key'], e['Size']) for p in client.get_paginator("list_objects_v2").paginate(Bucket=s3_bucket, Prefix=prefix) for e in p['Contents']]
+    return [(e['Key'], e['Size']) for p in client.get_paginator("list_objects_v2").paginate(Bucket=s3_bucket, Prefix=prefix) for e in p.get('Contents', [])]
 
 
 def s3_calc_scene_size(scene_name, s3_bucket, prefix):
@@ -397,6 +983,51 @@ def s3_calc_scene_size(scene_name, s3_bucket, prefix):
     return r
 
 
+def s3_scene_complete(s3_bucket, s3_scene_dir, bands=()):
+    """
+    True if a prepared scene is already complete in S3: its datacube-metadata.yaml is valid,
+    every band it lists was uploaded and it lists every one of BANDS. Costs one ListObjects and one GET.
+
+    :param s3_scene_dir: directory of the prepared scene i.e. s3_dir + scene_name + '/'
+    :param bands: band (measurement) names the scene must have, e.g. those of the products a job prepares
+    """
+    client, bucket = s3_create_client(s3_bucket)
+    keys = {e['Key'] for e in client.list_objects_v2(Bucket=s3_bucket, Prefix=s3_scene_dir).get('Contents', [])}
+    uploaded = s3_scene_uploaded_bands(client, s3_bucket, s3_scene_dir, keys)
+    return uploaded is not None and set(bands) <= uploaded
+
+
+def s3_scene_uploaded_bands(client, s3_bucket, s3_scene_dir, keys):
+    """
+    Band names of a prepared scene whose object keys were already listed, e.g. along with the
+    rest of its prefix: those in its datacube-metadata.yaml, or None if the yaml is missing or
+    invalid or any band it lists was not uploaded. Costs one GET if the yaml is among KEYS.
+    """
+    yml_key = f'{s3_scene_dir}datacube-metadata.yaml'
+    if yml_key not in keys:
+        return None
+    try:
+        yml = yaml.safe_load(client.get_object(Bucket=s3_bucket, Key=yml_key)['Body'].read())
+        bands = yml['image']['bands']
+    except Exception:
+        return None
+    if len(bands) == 0 or not all(f'{s3_scene_dir}{band["path"]}' in keys for band in bands.values()):
+        return None
+    return set(bands)
+
+
+def skip_if_prepared(scene_name, s3_bucket, s3_dir, force=False, bands=()):
+    """
+    Preflight for prepare* functions: the job status to return straight away if the scene is
+    already prepared in S3 with (at least) BANDS (see s3_scene_complete), otherwise None.
+    Never skips if force is True.
+    """
+    if force or not s3_scene_complete(s3_bucket, f'{s3_dir}{scene_name}/', bands):
+        return None
+    logging.getLogger().info(f"{scene_name} already prepared in {s3_bucket}/{s3_dir}, skipping")
+    return job_status(scene_name, skipped=True)
+
+
 def s3_download(s3_bucket, s3_obj_path, dest_path):
     """ - tested only for S3"""
     client, bucket = s3_create_client(s3_bucket)
@@ -410,6 +1041,305 @@ def s3_download(s3_bucket, s3_obj_path, dest_path):
             raise
 
 
+def _link_or_copy(src_path, dest_path):
+    """Hard link SRC_PATH to DEST_PATH, copying if they are on different filesystems."""
+    if os.path.exists(dest_path):
+        os.remove(dest_path)
+    try:
+        os.link(src_path, dest_path)
+    except OSError:
+        shutil.copyfile(src_path, dest_path)
+
+
+@contextlib.contextmanager
+def _cache_lock(cache_path, blocking=True):
+    """
+    Hold the flock on a cache entry's .lock file, yielding False if not BLOCKING and it is held
+    elsewhere. Lock files are unlinked (while held) along with their entry, so a lock won on a
+    file that has since been unlinked is dropped and taken again on the current one.
+    """
+    lock_path = cache_path + '.lock'
+    while True:
+        with open(lock_path, 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                current = os.stat(lock_path).st_ino
+            except FileNotFoundError:
+                current = None
+            if current == os.fstat(lock.fileno()).st_ino:
+                yield True
+                return
+
+
+def _evict_cache(cache_dir, max_bytes, keep=None):
+    """Remove least recently used cache entries until CACHE_DIR holds at most MAX_BYTES, skipping locked entries."""
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.endswith('.lock') and not os.path.exists(path[:-5]):
+            # left by a fetch that failed, or a worker that died
+            with _cache_lock(path[:-5], blocking=False) as locked:
+                if locked and not os.path.exists(path[:-5]):
+                    os.remove(path)
+            continue
+        if name.endswith(('.lock', '.tmp', '.part')):
+            continue
+        try:
+            stat = os.stat(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, os.path.join(cache_dir, name)))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        with _cache_lock(path, blocking=False) as locked:
+            if not locked:
+                continue  # being fetched or linked by another worker
+            try:
+                os.remove(path)
+                total -= size
+                logging.info(f"Evicted {path} from download cache")
+            except FileNotFoundError:
+                pass
+            os.remove(path + '.lock')
+
+
+def cached_fetch(source, version, fetch, dest_path):
+    """
+    Node-local download cache for ancillary inputs shared by many scenes (i.e. DEMs).
+    Entries are addressed by a hash of SOURCE's content VERSION (i.e. its ETag), so a changed
+    source is fetched again. Concurrent workers wait on a file lock rather than fetching the same
+    entry twice, and least recently used entries are evicted beyond DOWNLOAD_CACHE_MAX_GB.
+    The cache lives in DOWNLOAD_CACHE_DIR, which can be a volume shared by the pods on a node.
+
+    :param source: url or s3 path of the input, used for its extension and in logs
+    :param version: string identifying the content of SOURCE, i.e. ETag + size
+    :param fetch: callable downloading SOURCE to the path it is given
+    :param dest_path: path to hard link (or copy) the cached file to - treat it as read-only
+    """
+    cache_dir = os.getenv("DOWNLOAD_CACHE_DIR", "/tmp/data/cache/")
+    max_bytes = float(os.getenv("DOWNLOAD_CACHE_MAX_GB", "20")) * 1e9
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_path = os.path.join(cache_dir, hashlib.sha256(version.encode()).hexdigest() + os.path.splitext(source)[1])
+
+    with _cache_lock(cache_path):
+        if os.path.exists(cache_path):
+            os.utime(cache_path)  # mark as recently used
+            logging.info(f"{source} found in download cache")
+        else:
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            try:
+                fetch(tmp_path)
+            except Exception:
+                # no entry to keep a lock file for
+                for path in (tmp_path, cache_path + '.lock'):
+                    if os.path.exists(path):
+                        os.remove(path)
+                raise
+            os.replace(tmp_path, cache_path)
+            logging.info(f"{source} added to download cache")
+        _link_or_copy(cache_path, dest_path)
+
+    _evict_cache(cache_dir, max_bytes, keep=cache_path)
+
+
+def s3_download_cached(s3_bucket, s3_obj_path, dest_path):
+    """
+    s3_download through the node's download cache (see cached_fetch), validated against the
+    object's current ETag.
+    """
+    client, bucket = s3_create_client(s3_bucket)
+    head = client.head_object(Bucket=s3_bucket, Key=s3_obj_path)
+    cached_fetch(f"s3://{s3_bucket}/{s3_obj_path}", f"{head['ETag']}:{head['ContentLength']}",
+                 lambda path: bucket.download_file(s3_obj_path, path), dest_path)
+
+
+def s3_gdal_path(s3_bucket, s3_obj_path):
+    """
+    GDAL path of an object in s3, so that only the parts GDAL reads (i.e. the windows of a COG)
+    are downloaded. Open it within rasterio.Env(**s3_gdal_env()).
+    """
+    return f"/vsis3/{s3_bucket}/{s3_obj_path}"
+
+
+def s1_scene_name(in_scene):
+    """
+    Short name of a Sentinel-1 scene, as used for its prepared output directory.
+
+    :param in_scene: input Sentinel-1 scene name i.e. "S1A_IW_GRDH_1SDV_20191001T064008_20191001T064044_029261_035324_C74C[.SAFE]"
+    :return: scene name i.e. "S1A_IW_GRDH_1SDV_20191001T064008"
+    """
+    return in_scene[:32]
+
+
+def s1_footprint(manifest_path):
+    """
+    Footprint of a S1 scene from the gml:coordinates of its manifest.safe, as [lat, lon] pairs.
+    MANIFEST_PATH may also be the scene's .zip, whose manifest is read without extracting it.
+    """
+    if manifest_path.endswith('.zip'):
+        with zipfile.ZipFile(manifest_path) as z:
+            text = z.read(next(n for n in z.namelist() if n.endswith('manifest.safe'))).decode()
+    else:
+        with open(manifest_path) as f:
+            text = f.read()
+    coords = re.search(r'<gml:coordinates>([^<]+)</gml:coordinates>', text).group(1)
+    return [[float(v) for v in pair.split(',')] for pair in coords.split()]
+
+
+def subset_dem(dem_src, aoi, out_path, buffer_deg=0.1):
+    """
+    Write the part of a DEM covering a scene footprint (plus a buffer) to a small local GeoTIFF for SNAP.
+    Only the intersecting window is read, so a remote COG DEM is never downloaded whole.
+
+    :param dem_src: path or GDAL path (see s3_gdal_path) of a DEM in geographic coordinates
+    :param aoi: scene footprint as [lat, lon] pairs (see s1_footprint)
+    :param out_path: GeoTIFF to write
+    :param buffer_deg: buffer around the footprint, in degrees
+    :return: out_path, or None (and nothing is written) if the DEM doesn't intersect the footprint
+
+    Footprints crossing the antimeridian are wrapped into the DEM's longitude range, so an eastern
+    and a western hemisphere DEM each get their side of the scene.
+    """
+    lats = [lat for lat, lon in aoi]
+    lons = [lon for lat, lon in aoi]
+
+    with rasterio.open(dem_src) as src:
+        if max(lons) - min(lons) > 180:
+            if src.bounds.left + src.bounds.right > 0:
+                lons = [lon + 360 if lon < 0 else lon for lon in lons]
+            else:
+                lons = [lon - 360 if lon > 0 else lon for lon in lons]
+        left = max(min(lons) - buffer_deg, src.bounds.left)
+        right = min(max(lons) + buffer_deg, src.bounds.right)
+        bottom = max(min(lats) - buffer_deg, src.bounds.bottom)
+        top = min(max(lats) + buffer_deg, src.bounds.top)
+        if left >= right or bottom >= top:
+            logging.info(f"{dem_src} does not intersect the scene footprint")
+            return None
+
+        # whole pixels covering the bounds
+        window = from_bounds(left, bottom, right, top, src.transform)
+        col_off, row_off = math.floor(window.col_off), math.floor(window.row_off)
+        window = Window(col_off, row_off,
+                        math.ceil(window.col_off + window.width) - col_off,
+                        math.ceil(window.row_off + window.height) - row_off)
+        window = window.intersection(Window(0, 0, src.width, src.height))
+
+        profile = src.profile.copy()
+        profile.update(driver='GTiff', width=window.width, height=window.height,
+                       transform=src.window_transform(window), tiled=True, blockxsize=256, blockysize=256,
+                       compress='deflate')
+        with rasterio.open(out_path, 'w', **profile) as dst:
+            dst.write(src.read(window=window))
+
+    logging.info(f"{dem_src} subset to {window.width}x{window.height} pixels")
+    return out_path
+
+
+def s3_subset_dem(s3_bucket, s3_obj_path, aoi, out_path, buffer_deg=0.1):
+    """
+    subset_dem of a COG DEM in s3, read by window with the s3_create_client endpoint and credentials.
+    Falls back to the whole DEM through the download cache (see s3_download_cached) if the windowed
+    read fails.
+    """
+    try:
+        with rasterio.Env(**s3_gdal_env()):
+            return subset_dem(s3_gdal_path(s3_bucket, s3_obj_path), aoi, out_path, buffer_deg)
+    except Exception as e:
+        logging.warning(f"Subsetting {s3_obj_path} failed ({e}), using the whole DEM")
+        s3_download_cached(s3_bucket, s3_obj_path, out_path)
+        return out_path
+
+
+def get_file_cached(url, output_path, user=None, password=None):
+    """
+    get_file through the node's download cache (see cached_fetch), validated against the url's
+    current ETag (or Last-Modified). Urls with neither are always downloaded.
+    """
+    auth = (user, password) if user else None
+
+    def head():
+        r = http_session().head(url, auth=auth, allow_redirects=True, timeout=60)
+        _check_response(r)
+        return r.headers
+    headers = with_backoff(head, f"HEAD {url}")
+
+    version = headers.get('ETag') or headers.get('Last-Modified')
+    if not version:
+        return get_file(url, output_path, user, password)
+    cached_fetch(url, f"{url}:{version}:{headers.get('Content-Length')}",
+                 lambda path: get_file(url, path, user, password), output_path)
+
+
+def s3_gdal_env():
+    """
+    GDAL config for reading /vsis3/ paths with the same endpoint and credentials as s3_create_client,
+    for use as rasterio.Env(**s3_gdal_env()). Reads are unsigned if no credentials are set.
+    """
+    config = {}
+    access = os.getenv("AWS_ACCESS_KEY_ID")
+    secret = os.getenv("AWS_SECRET_ACCESS_KEY")
+    if access and secret:
+        config.update(AWS_ACCESS_KEY_ID=access, AWS_SECRET_ACCESS_KEY=secret)
+    else:
+        config.update(AWS_NO_SIGN_REQUEST='YES')
+
+    endpoint_url = os.getenv("AWS_S3_ENDPOINT_URL")
+    if endpoint_url is not None:
+        endpoint = urlparse(endpoint_url)
+        config.update(AWS_S3_ENDPOINT=endpoint.netloc + endpoint.path.rstrip('/'),
+                      AWS_HTTPS='NO' if endpoint.scheme == 'http' else 'YES',
+                      AWS_VIRTUAL_HOSTING='FALSE')
+    else:
+        config.update(AWS_REGION='eu-west-2')
+    return config
+
+
+def s3_render_quicklooks(s3_bucket, prefix, out_dir, bands=('red', 'green', 'blue'), color_scale=None,
+                         scale='auto', max_size=1024, ext='png', s3_dir=None, max_workers=8):
+    """
+    Render a quicklook for every scene (datacube-metadata.yaml) under `prefix` concurrently.
+    Bands are read straight from their COG overviews so no full resolution data is downloaded.
+
+    :param bands: three band names for an RGB quicklook, or one band name together with `color_scale`.
+    :param s3_dir: optionally upload the quicklooks to this s3 directory (with a trailing '/').
+    :return: dict of scene directory to local quicklook path (None where rendering failed).
+    """
+    from .dc_utilities import render_quicklook
+
+    client, bucket = s3_create_client(s3_bucket)
+    yml_paths = [k for k in s3_list_objects_paths(s3_bucket, prefix) if k.endswith('datacube-metadata.yaml')]
+    os.makedirs(out_dir, exist_ok=True)
+
+    def render(yml_path):
+        scene_dir = os.path.dirname(yml_path)
+        out_path = os.path.join(out_dir, f"{os.path.basename(scene_dir)}.{ext}")
+        try:
+            yml = yaml.safe_load(client.get_object(Bucket=s3_bucket, Key=yml_path)['Body'].read())
+            src_paths = [f"/vsis3/{s3_bucket}/{scene_dir}/{yml['image']['bands'][b]['path']}" for b in bands]
+            # per thread, as rasterio environments are
+            with rasterio.Env(**s3_gdal_env()):
+                render_quicklook(src_paths, out_path, scale=scale, color_scale=color_scale, max_size=max_size)
+            if s3_dir is not None:
+                s3_single_upload(out_path, s3_dir + os.path.basename(out_path), s3_bucket)
+            return scene_dir, out_path
+        except Exception as e:
+            logging.getLogger().warning(f"Failed to render quicklook for {scene_dir}: {e}")
+            return scene_dir, None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(executor.map(render, yml_paths))
+
+
 """rio_cogeo.cogeo: translate a file to a cloud optimized geotiff."""
 def cog_translate(
         src_path,
@@ -3,7 +3,7 @@ import xmltodict
 
 from osgeo import gdal
 from datetime import datetime
-from . utility import findItems
+from . utility import findItems, openFile
 
 def getManifest( pathname ):
 
@@ -14,7 +14,7 @@ def getManifest( pathname ):
     # get xml schema for new task
     meta = {}
 
-    with open ( pathname ) as fd:
+    with openFile ( pathname ) as fd:
         doc = xmltodict.parse( fd.read() )
 
     # product characteristics
@@ -84,7 +84,7 @@ def getAnnotation( annotation ):
     # get xml schema for new task
     meta = {}
 
-    with open ( annotation  ) as fd:
+    with openFile ( annotation  ) as fd:
         doc = xmltodict.parse( fd.read() )
 
     # get resolution
@@ -116,7 +116,7 @@ def getGeolocationGrid( annotation ):
     # get xml schema for new task
     meta = {}
 
-    with open ( annotation  ) as fd:
+    with openFile ( annotation  ) as fd:
         doc = xmltodict.parse( fd.read() )
 
     # get gcps
@@ -55,10 +55,8 @@ class Raw2Ard:
         if os.path.isdir( tmp_path ):
             shutil.rmtree( tmp_path )
 
-        # extract scene zip 
-#         print ( 'Extracting dataset: {}'.format( scene ) )
-        dataset_files = utility.unpackFiles( scene, '(.*?)', tmp_path )
-#         print ( '... OK!' )
+        # list scene zip - metadata is read in place, files are only extracted for processing
+        dataset_files = utility.listFiles( scene, '(.*?)' )
 
         # load metadata into dictionary
         meta = metadata.getManifest( utility.matchFile( dataset_files, '.*\/manifest.safe' ) )
@@ -77,6 +75,12 @@ class Raw2Ard:
         extent = self.getSceneExtent( meta )
         if extent[ 'lon' ][ 'max' ] - extent[ 'lon' ][ 'min' ] > self._fat_swath:
 
+            # extract files read by snap graph - measurement files only for polarizations processed
+#             print ( 'Extracting dataset: {}'.format( scene ) )
+            pols = '|'.join( pol.lower() for pol in self._polarizations )
+            dataset_files = utility.unpackFiles( scene, '.*(\/manifest.safe|\/annotation\/.*|\/support\/.*|\/measurement\/.*-({})-.*)$'.format( pols ), tmp_path )
+#             print ( '... OK!' )
+
             # densify annotated geolocation grid
             self._densify.process( utility.matchFiles( dataset_files, '.*\/annotation\/s1.*\.xml' ), grid_pts=250 )
             meta.update( metadata.getGeolocationGrid( utility.matchFile( dataset_files, '.*\/annotation\/s1.*vv.*\.xml' ) ) )
@@ -115,7 +119,7 @@ class Raw2Ard:
                     
                     ##### set parameters of reader task #####
                     param = self.getParameterSet( schema, 'Read' )
-                    param[ 'file' ] = dataset_files[ 0 ] + '/manifest.safe'       # parent path to extracted dataset
+                    param[ 'file' ] = utility.matchFile( dataset_files, '.*\/manifest.safe' )       # extracted dataset
                     param[ 'formatName' ] = 'SENTINEL-1'
 
                     ##### insert subset task #####
@@ -2,6 +2,7 @@ import os
 import re
 import sys
 import subprocess
+import io
 import zipfile as zf
 
 def unpackFile( scene, exp, out_path ):
@@ -43,6 +44,33 @@ def unpackFiles( scene, exp, out_path ):
     return out_files
 
 
+def listFiles( scene, exp ):
+
+    """              
+    list selected files within zip file as /vsizip/ pathnames - nothing is unpacked
+    """
+
+    # open archive and match filenames against regexp
+    with zf.ZipFile( scene ) as z:
+        return [ '/vsizip/{}/{}'.format( scene, f ) for f in z.namelist() if re.match( exp, f ) ]
+
+
+def openFile( pathname ):
+
+    """              
+    open file for reading - either on disk or a member of a zip file addressed by a 
+    /vsizip/ pathname (as returned by listFiles)
+    """
+
+    if not pathname.startswith( '/vsizip/' ):
+        return open( pathname )
+
+    # split pathname into archive and member pathnames
+    scene, member = pathname[ len( '/vsizip/' ): ].split( '.zip/', 1 )
+    with zf.ZipFile( scene + '.zip' ) as z:
+        return io.StringIO( z.read( member ).decode( 'utf-8' ) )
+
+
 def matchFile( files, exp ):
 
     """              
@@ -0,0 +1,470 @@
+#!/usr/bin/env python
+
+# Worker runtime for the ard-workflows work queues.  Replaces the lease/process/complete
+# loop of the worker-*.ipynb notebooks with one process per pod running a configurable
+# number of concurrent jobs, e.g.
+#
+#   python worker.py jobS2 --concurrency 2
+#
+# Each job slot runs its job in a fresh process, so GDAL/SNAP memory is released between
+# jobs and a job killed (e.g. for running out of memory) only fails that job.
+# SIGTERM (e.g. a pod being stopped) stops new items being leased and lets the jobs in
+# flight finish before exiting.
+#
+# Jobs are only started while their estimated resources fit in the pod's budget, so many
+# cheap jobs can be packed alongside a heavy one - also from other queues, as a worker can
+# serve several, e.g.
+#
+#   python worker.py jobS1 jobMOD --concurrency 4
+#
+# An item's needs come from an optional "_resources" entry in its JSON, else from the peak
+# usage (cpus, memory and scratch disk) recorded for the queue's previous jobs, else from
+# QUEUE_RESOURCES.
+#
+# With --pipeline, jobs are staged so the network and CPUs are kept busy together: the next
+# items are leased and start downloading while `concurrency` jobs process, and finished jobs
+# upload alongside them.  Each prepare function reports where it is (prep_utils.pipeline_stage)
+# and is held once its inputs are downloaded until a processing slot is free.  No more items
+# are leased while `prefetch` jobs are downloading (or waiting for a slot), more than `uploads`
+# jobs are uploading, or scratch disk is short.
+
+import argparse
+import concurrent.futures
+import importlib
+import inspect
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import shutil
+import signal
+import threading
+import time
+from queue import Empty
+
+import rediswq
+
+# Work queue name -> "module:function" of the prepare function each item is passed to,
+# as keyword arguments.  Imported lazily, in the job processes, as each has its own
+# heavyweight dependencies.
+QUEUE_JOBS = {
+    "jobS2": "utils.prepS2:prepareS2",
+    "jobS1": "utils.prepS1:prepareS1",
+    "jobS1AM": "utils.prepS1AM:prepareS1AM",
+    "jobLS": "utils.prepLS:prepareLS",
+    "jobMOD": "utils.prepMOD:prepareMOD",
+    "jobWater": "utils.genprepWater:per_scene_wofs",
+    "jobMLWater": "utils.genprepMLWater:genprepmlwater",
+}
+
+# Work queue name -> default resources needed by a job: cpus, ram_gb and scratch disk_gb.
+QUEUE_RESOURCES = {
+    "jobS2": {"cpus": 2, "ram_gb": 8, "disk_gb": 10},
+    "jobS1": {"cpus": 4, "ram_gb": 24, "disk_gb": 20},
+    "jobS1AM": {"cpus": 4, "ram_gb": 24, "disk_gb": 20},
+    "jobLS": {"cpus": 1, "ram_gb": 4, "disk_gb": 5},
+    "jobMOD": {"cpus": 1, "ram_gb": 2, "disk_gb": 1},
+    "jobWater": {"cpus": 1, "ram_gb": 4, "disk_gb": 2},
+    "jobMLWater": {"cpus": 2, "ram_gb": 8, "disk_gb": 2},
+}
+RESOURCES = ("cpus", "ram_gb", "disk_gb")
+# Headroom added to peak usage when it is recorded as the estimate for future jobs.
+HEADROOM = 1.2
+# Factor a queue's recorded estimates decay by with each successful job that needed less.
+USAGE_DECAY = 0.95
+# Items that do not fit leased (and set aside) from a queue before it waits for a job to move on.
+MAX_SKIPPED = 4
+# Seconds between measurements of a job's scratch disk usage.
+DISK_SAMPLE_SECS = 2
+
+logger = logging.getLogger("worker")
+
+
+def estimate_resources(queue_name):
+    """Resources a job from the queue needs before any usage has been recorded for it.
+
+    :param queue_name: the work queue the item is for
+    :return: dict of cpus, ram_gb and disk_gb
+    """
+    return dict(QUEUE_RESOURCES.get(queue_name, {"cpus": 1, "ram_gb": 4, "disk_gb": 5}))
+
+
+def _dir_size(path):
+    """Bytes in the files under `path`."""
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                # removed by the job while walking
+                pass
+    return total
+
+
+def pod_budget(scratch_dir="/tmp"):
+    """Resources available to this pod: its cpus, memory (respecting cgroup limits) and free scratch disk."""
+    ram_bytes = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    for cgroup_limit in ["/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"]:
+        try:
+            with open(cgroup_limit) as f:
+                ram_bytes = min(ram_bytes, int(f.read().strip()))
+            break
+        except (OSError, ValueError):
+            pass
+    return {"cpus": len(os.sched_getaffinity(0)), "ram_gb": ram_bytes / 1024 ** 3,
+            "disk_gb": shutil.disk_usage(scratch_dir).free / 1024 ** 3}
+
+
+def _report_stages(key, stages, go):
+    """Job process initializer in pipeline mode: send the job's stages (see prep_utils.pipeline_stage)
+    to the worker as (key, stage), waiting at 'process' until the worker sets `go`."""
+    from utils.prep_utils import set_stage_hook
+
+    def hook(stage):
+        stages.put((key, stage))
+        if stage == "process":
+            go.wait()
+    set_stage_hook(hook)
+
+
+def process_item(job, item):
+    """Run `job` ("module:function") on a queue item (JSON of its keyword arguments).
+
+    Returns the job status (see prep_utils.job_status), or None if the job returned nothing,
+    and the peak resources used by the job (including its subprocesses, e.g. SNAP).
+
+    Jobs with an inter_dir are given their own directory within it, whose size is sampled
+    every DISK_SAMPLE_SECS for the job's peak scratch disk usage, and removed afterwards.
+    """
+    module_name, function_name = job.split(":")
+    function = getattr(importlib.import_module(module_name), function_name)
+    kwargs = json.loads(item)
+    kwargs.pop("_resources", None)
+
+    params = inspect.signature(function).parameters
+    if "inter_dir" not in params:
+        return function(**kwargs), _usage(None)
+    scratch_dir = os.path.join(kwargs.get("inter_dir", params["inter_dir"].default), f"job-{os.getpid()}", "")
+    os.makedirs(scratch_dir, exist_ok=True)
+    kwargs["inter_dir"] = scratch_dir
+    peak_bytes = [0]
+    stop = threading.Event()
+
+    def sample():
+        while True:
+            peak_bytes[0] = max(peak_bytes[0], _dir_size(scratch_dir))
+            if stop.wait(DISK_SAMPLE_SECS):
+                return
+    sampler = threading.Thread(target=sample, name="scratch-usage", daemon=True)
+    sampler.start()
+    try:
+        status = function(**kwargs)
+    finally:
+        stop.set()
+        sampler.join()
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+    return status, _usage(peak_bytes[0])
+
+
+def _usage(scratch_bytes):
+    """Peak resources used by this process and its subprocesses, and the peak scratch disk if measured."""
+    own, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    usage = {"ram_gb": max(own.ru_maxrss, children.ru_maxrss) / 1024 ** 2,
+             "cpu_secs": own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime}
+    if scratch_bytes is not None:
+        usage["disk_gb"] = scratch_bytes / 1024 ** 3
+    return usage
+
+
+class Worker(object):
+    """Lease items from one or more work queues and run up to `concurrency` of them at once, each in its own process.
+
+    Queues are leased from in the order given.  Leases on items in flight are renewed in the
+    background, so long jobs are not picked up by other workers.  Failed jobs are retried or
+    dead-lettered (see RedisWQ.fail).
+
+    A job is only started while the needs of all jobs in flight fit within `budget` (see
+    pod_budget), though one job is always allowed to run.  Items that do not fit are set
+    aside and the items behind them tried instead (up to MAX_SKIPPED per queue), then
+    released back to their queue for other workers.  That queue is not leased from again
+    until a job finishes (or, in pipeline mode, moves on a stage), but the others are.
+
+    If `pipeline` is set, up to `prefetch` further jobs download while `concurrency` jobs
+    process and finished jobs upload, with no items leased while more than `uploads` jobs
+    are uploading (see the module notes).  Only processing jobs then count towards the
+    cpus and ram_gb budget, and new items also wait for their disk_gb to be free in
+    `scratch_dir`.
+    """
+    def __init__(self, queues, job=None, concurrency=1, lease_secs=1800, poll_secs=5, budget=None,
+                 pipeline=False, prefetch=1, uploads=1, scratch_dir="/tmp"):
+        self.queues = list(queues) if isinstance(queues, (list, tuple)) else [queues]
+        assert job is None or len(self.queues) == 1, "A job can only be given for a single queue"
+        self.jobs = {queue.name(): job or QUEUE_JOBS[queue.name()] for queue in self.queues}
+        self.concurrency = concurrency
+        self.budget = budget or pod_budget(scratch_dir)
+        self.lease_secs = lease_secs
+        self.poll_secs = poll_secs
+        self.pipeline = pipeline
+        self.prefetch = prefetch
+        self.uploads = uploads
+        self.scratch_dir = scratch_dir
+        self.metrics = {"success": 0, "failed": 0, "wall_secs": 0.0, "max_wall_secs": 0.0}
+        self._draining = threading.Event()
+        self._in_flight = {}
+        self._needs = {}
+        self._full = set()
+        self._stages = multiprocessing.Queue() if pipeline else None
+        self._keys = itertools.count()
+        self._by_key = {}
+
+    def drain(self, *args):
+        """Stop leasing new items; jobs in flight are finished.  Usable as a signal handler."""
+        if not self._draining.is_set():
+            logger.info(f"Draining: finishing {len(self._in_flight)} jobs in flight")
+        self._draining.set()
+
+    def _renew_leases(self):
+        """Renew the leases of all items in flight until the worker stops."""
+        while not self._stopped.wait(max(1, self.lease_secs // 3)):
+            for future, item in list(self._in_flight.items()):
+                if not future.queue.renew_lease(item, self.lease_secs):
+                    logger.warning(f"Lost lease on {item}")
+
+    def _item_needs(self, queue, item):
+        """Estimated resources for an item: its own "_resources", else recorded peak usage, else defaults."""
+        needs = estimate_resources(queue.name())
+        stats = queue.get_stats()
+        needs.update({r: stats[r] for r in RESOURCES if r in stats})
+        try:
+            needs.update(json.loads(item).get("_resources", {}))
+        except (ValueError, AttributeError):
+            pass
+        return needs
+
+    def _fits(self, needs, resources=RESOURCES, futures=None):
+        """True if a job with `needs` fits in the budget alongside the jobs in flight (or just `futures`)."""
+        futures = self._needs if futures is None else futures
+        return all(sum(self._needs[f][r] for f in futures) + needs[r] <= self.budget[r] for r in resources)
+
+    def _in_stage(self, *stages):
+        """Jobs in flight in any of `stages`, in the order they were started."""
+        return [f for f in self._in_flight if f.stage in stages]
+
+    def _can_lease(self):
+        """True if another item may be leased, i.e. there is a free download (or job) slot."""
+        if self._draining.is_set():
+            return False
+        if not self.pipeline:
+            return len(self._in_flight) < self.concurrency
+        return (len(self._in_stage("download", "ready")) < self.prefetch and
+                len(self._in_stage("upload")) <= self.uploads)
+
+    def _admit(self, needs):
+        """True if a job with `needs` may start now.  In pipeline mode its scratch disk must also be free."""
+        if not self._in_flight:
+            return True
+        if not self.pipeline:
+            return self._fits(needs)
+        free_gb = shutil.disk_usage(self.scratch_dir).free / 1024 ** 3
+        return self._fits(needs, ("disk_gb",)) and needs["disk_gb"] <= free_gb
+
+    def _wait_stages(self, timeout):
+        """Wait up to `timeout` for a job to report a stage or finish, then apply every report waiting."""
+        try:
+            report = self._stages.get(timeout=timeout)
+        except Empty:
+            return
+        while report is not None:
+            key, stage = report
+            future = self._by_key.get(key)
+            if future is not None and stage != "done":
+                if stage == "upload":
+                    future.uploading = time.time()
+                future.stage = "ready" if stage == "process" else stage
+                self._full.clear()
+                logger.debug(f"{self._in_flight[future].decode('utf-8')} reached {stage}")
+            try:
+                report = self._stages.get_nowait()
+            except Empty:
+                report = None
+
+    def _start_processing(self):
+        """Let downloaded jobs start processing, in the order they were leased, while slots are free."""
+        for future in self._in_stage("ready"):
+            processing = self._in_stage("process")
+            if len(processing) >= self.concurrency or (
+                    processing and not self._fits(self._needs[future], ("cpus", "ram_gb"), processing)):
+                break
+            future.stage, future.processing = "process", time.time()
+            future.go.set()
+
+    def _record_usage(self, queue, usage, wall_secs):
+        """Update the queue's recorded needs with the peak usage of a successful job."""
+        stats = queue.get_stats()
+        observed = {"ram_gb": usage["ram_gb"] * HEADROOM,
+                    "cpus": max(1.0, usage["cpu_secs"] / max(wall_secs, 1e-3)) * HEADROOM}
+        if "disk_gb" in usage:
+            observed["disk_gb"] = usage["disk_gb"] * HEADROOM
+        # A decaying max: a heavier job raises the estimate straight away, lighter ones only lower it
+        # by USAGE_DECAY each, down to what the queue's jobs are seen to use (rather than QUEUE_RESOURCES).
+        queue.update_stats({r: max(v, USAGE_DECAY * stats.get(r, 0.0)) for r, v in observed.items()})
+
+    def _finish(self, future):
+        """Complete, retry or dead-letter the item of a finished job and record its metrics."""
+        item = self._in_flight.pop(future)
+        self._needs.pop(future)
+        self._by_key.pop(future.key, None)
+        self._full.clear()
+        future.executor.shutdown(wait=False)
+        queue = future.queue
+        finished = time.time()
+        wall_secs = finished - future.started
+        try:
+            status, usage = future.result()
+            # Skipped and failed jobs may not have used anything like what the queue's jobs need.
+            if status is None or status['status'] == 'success':
+                # cpus are estimated over the processing stage only, when the job reported it.
+                self._record_usage(queue, usage,
+                                   (future.uploading or finished) - (future.processing or future.started))
+        except Exception as e:
+            # The job process itself died, e.g. killed for running out of memory.
+            logger.exception(f"Job crashed on {item}")
+            status = {'status': 'failed', 'error': repr(e), 'retryable': True}
+
+        if status is not None and status['status'] == 'failed':
+            queue.fail(item, status['error'], retry=status['retryable'])
+            self.metrics["failed"] += 1
+        else:
+            queue.complete(item)
+            self.metrics["success"] += 1
+        self.metrics["wall_secs"] += wall_secs
+        self.metrics["max_wall_secs"] = max(self.metrics["max_wall_secs"], wall_secs)
+        logger.info(f"job={queue.name()} item={item.decode('utf-8')} "
+                    f"status={status['status'] if status else 'success'} wall_secs={wall_secs:.1f}")
+
+    def _start(self, queue, item, needs):
+        """Run the queue's job on `item` in a new process.  In pipeline mode it starts in the download stage."""
+        key = next(self._keys)
+        go = multiprocessing.Event() if self.pipeline else None
+        if self.pipeline:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=1, initializer=_report_stages,
+                                                              initargs=(key, self._stages, go))
+        else:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=1)
+        future = executor.submit(process_item, self.jobs[queue.name()], item)
+        future.executor, future.started, future.key, future.go = executor, time.time(), key, go
+        future.queue = queue
+        future.stage = "download" if self.pipeline else "process"
+        future.processing = future.uploading = None
+        self._in_flight[future] = item
+        self._needs[future] = needs
+        self._by_key[key] = future
+        if self.pipeline:
+            # Wake the worker as soon as the job finishes, as well as when it reports a stage.
+            future.add_done_callback(lambda f: self._stages.put((key, "done")))
+
+    def _lease_items(self):
+        """Lease items into free slots from each queue in turn, setting aside those that do not fit."""
+        # Only wait for work if there is nothing else to do, and there is only one queue to wait on.
+        block = len(self.queues) == 1 and not self._in_flight
+        for queue in self.queues:
+            skipped = []
+            while self._can_lease() and len(skipped) < MAX_SKIPPED and queue.name() not in self._full:
+                item = queue.lease(lease_secs=self.lease_secs, block=block, timeout=self.poll_secs)
+                if item is None:
+                    break
+                needs = self._item_needs(queue, item)
+                if not self._admit(needs):
+                    skipped.append(item)
+                    continue
+                logger.info(f"Working on {item.decode('utf-8')} from {queue.name()} needing {needs}")
+                self._start(queue, item, needs)
+
+            if skipped:
+                # Back to the head of the queue for other workers, in order, and wait for a job to move on.
+                for item in reversed(skipped):
+                    queue.release(item)
+                self._full.add(queue.name())
+
+    def run(self):
+        """Process items until the queues are empty, or the worker is drained.
+
+        Returns the worker metrics: counts of jobs by status, and total and max job wall time.
+        """
+        logger.info(f"Worker with sessionID: {self.queues[0].sessionID()} running "
+                    f"{', '.join(f'{name}: {job}' for name, job in self.jobs.items())} "
+                    f"with {self.concurrency} slots" +
+                    (f", prefetching {self.prefetch} and uploading {self.uploads}" if self.pipeline else ""))
+        self._stopped = threading.Event()
+        renewer = threading.Thread(target=self._renew_leases, name="lease-renewal", daemon=True)
+        renewer.start()
+        try:
+            while self._in_flight or not (self._draining.is_set() or all(q.empty() for q in self.queues)):
+                self._lease_items()
+
+                if not self._in_flight and len(self.queues) > 1:
+                    # Nothing leased from any queue - wait before polling them again.
+                    self._draining.wait(self.poll_secs)
+                elif self._in_flight and self.pipeline:
+                    self._wait_stages(self.poll_secs)
+                    for future in [f for f in self._in_flight if f.done()]:
+                        self._finish(future)
+                    self._start_processing()
+                elif self._in_flight:
+                    done, _ = concurrent.futures.wait(list(self._in_flight), timeout=self.poll_secs,
+                                                      return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        self._finish(future)
+        finally:
+            self._stopped.set()
+            renewer.join()
+
+        jobs = self.metrics["success"] + self.metrics["failed"]
+        logger.info(f"Worker finished: {self.metrics['success']} succeeded, {self.metrics['failed']} failed, "
+                    f"mean wall_secs={self.metrics['wall_secs'] / max(jobs, 1):.1f}, "
+                    f"max wall_secs={self.metrics['max_wall_secs']:.1f}")
+        return self.metrics
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Process items from ard-workflows work queues.")
+    parser.add_argument("queues", nargs="+",
+                        help=f"work queue names, leased from in this order, of {', '.join(QUEUE_JOBS)}")
+    parser.add_argument("--job", help="module:function to run instead of the queue's default (one queue only)")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("WORKER_CONCURRENCY", 1)),
+                        help="number of jobs to run at once")
+    parser.add_argument("--lease-secs", type=int, default=1800)
+    parser.add_argument("--cpus", type=float, help="cpu budget for jobs, default all available")
+    parser.add_argument("--ram-gb", type=float, help="memory budget for jobs, default all available")
+    parser.add_argument("--disk-gb", type=float, help="scratch disk budget for jobs, default all free")
+    parser.add_argument("--scratch-dir", default="/tmp", help="where jobs write intermediate data")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="download the next jobs and upload finished ones while jobs process")
+    parser.add_argument("--prefetch", type=int, default=1, help="jobs downloading at once, in pipeline mode")
+    parser.add_argument("--uploads", type=int, default=1, help="uploading jobs to allow before leasing stops, in pipeline mode")
+    parser.add_argument("--host", default=os.getenv("REDIS_SERVICE_HOST", "redis-master"))
+    parser.add_argument("--port", type=int, default=6379)
+    cli_args = parser.parse_args(args)
+    if cli_args.job and len(cli_args.queues) > 1:
+        parser.error("--job can only be given with a single queue")
+
+    level = os.getenv("LOGLEVEL", "INFO").upper()
+    logging.basicConfig(format="%(asctime)s %(levelname)-8s %(name)s %(message)s", datefmt="%Y-%m-%d %H:%M:%S",
+                        level=level)
+
+    queues = [rediswq.RedisWQ(name=name, host=cli_args.host, port=cli_args.port) for name in cli_args.queues]
+    budget = pod_budget(cli_args.scratch_dir)
+    budget.update({r: getattr(cli_args, r) for r in RESOURCES if getattr(cli_args, r) is not None})
+    worker = Worker(queues, job=cli_args.job, concurrency=cli_args.concurrency, lease_secs=cli_args.lease_secs,
+                    budget=budget, pipeline=cli_args.pipeline, prefetch=cli_args.prefetch, uploads=cli_args.uploads,
+                    scratch_dir=cli_args.scratch_dir)
+    signal.signal(signal.SIGTERM, worker.drain)
+    signal.signal(signal.SIGINT, worker.drain)
+    worker.run()
+
+
+if __name__ == "__main__":
+    main()